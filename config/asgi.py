@@ -0,0 +1,29 @@
+"""
+ASGI config for hac-shop project.
+
+This module contains the ASGI application used by production ASGI servers
+such as uvicorn. It exposes a module-level variable named ``application``.
+
+Serving the site from here lets the async purchase views (enabled with
+DRILL_SUPPERS_ASYNC_VIEWS) keep many Stripe requests in flight from one
+process, while the rest of the site still runs as normal sync views. Run it
+with gunicorn's uvicorn worker::
+
+    DRILL_SUPPERS_ASYNC_VIEWS=True gunicorn config.asgi:application -k uvicorn.workers.UvicornWorker
+
+"""
+import os
+import sys
+from pathlib import Path
+
+from django.core.asgi import get_asgi_application
+
+# This allows easy placement of apps within the interior
+# hac_shop directory.
+ROOT_DIR = Path(__file__).resolve(strict=True).parent.parent
+sys.path.append(str(ROOT_DIR / "hac_shop"))
+# We defer to a DJANGO_SETTINGS_MODULE already in the environment.
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
+
+# This application object is used by any ASGI server configured to use this file.
+application = get_asgi_application()
@@ -278,3 +278,72 @@ SOCIALACCOUNT_ADAPTER = "hac_shop.users.adapters.SocialAccountAdapter"
 # ------------------------------------------------------------------------------
 STRIPE_CALLBACK_URL=env("STRIPE_CALLBACK_URL", default="http://localhost:8000")
 stripe.api_key = env("STRIPE_SECRET_KEY")
+# Point at scripts/fake_stripe_server.py for load testing and working offline
+stripe.api_base = env("STRIPE_API_BASE", default=stripe.api_base)
+
+# Keep the remaining meals for capacity limited drill nights in Redis, when the
+# cache is backed by Redis
+DRILL_SUPPERS_REDIS_INVENTORY = env.bool("DRILL_SUPPERS_REDIS_INVENTORY", default=True)
+# How long meals are held for a buyer while they complete the Stripe checkout
+DRILL_SUPPERS_RESERVATION_MINUTES = env.int("DRILL_SUPPERS_RESERVATION_MINUTES", default=35)
+# Signing secret of the Stripe webhook endpoint at /supper/stripe/webhook. It
+# is required, as events signed with an empty secret could be forged by anyone
+STRIPE_WEBHOOK_SECRET = env("STRIPE_WEBHOOK_SECRET")
+# Serve the purchase pages from async views, for deployments under config.asgi
+DRILL_SUPPERS_ASYNC_VIEWS = env.bool("DRILL_SUPPERS_ASYNC_VIEWS", default=False)
+# Connections kept open to Stripe by each process running the async views
+STRIPE_ASYNC_MAX_CONNECTIONS = env.int("STRIPE_ASYNC_MAX_CONNECTIONS", default=100)
+# Keep-alive connections to Stripe held by each process, and how long a call
+# may take to connect and to respond
+STRIPE_POOL_SIZE = env.int("STRIPE_POOL_SIZE", default=10)
+STRIPE_CONNECT_TIMEOUT = env.float("STRIPE_CONNECT_TIMEOUT", default=5)
+STRIPE_READ_TIMEOUT = env.float("STRIPE_READ_TIMEOUT", default=30)
+# Retries made on network errors and 409/429/5xx responses from Stripe, waiting
+# STRIPE_RETRY_BACKOFF seconds before the first and doubling up to the maximum
+STRIPE_MAX_NETWORK_RETRIES = env.int("STRIPE_MAX_NETWORK_RETRIES", default=2)
+STRIPE_RETRY_BACKOFF = env.float("STRIPE_RETRY_BACKOFF", default=0.25)
+STRIPE_RETRY_MAX_BACKOFF = env.float("STRIPE_RETRY_MAX_BACKOFF", default=2)
+# Stop calling Stripe from every worker for STRIPE_BREAKER_RESET_SECONDS after
+# STRIPE_BREAKER_FAILURES failed calls within STRIPE_BREAKER_WINDOW seconds
+STRIPE_BREAKER_FAILURES = env.int("STRIPE_BREAKER_FAILURES", default=10)
+STRIPE_BREAKER_WINDOW = env.int("STRIPE_BREAKER_WINDOW", default=30)
+STRIPE_BREAKER_RESET_SECONDS = env.int("STRIPE_BREAKER_RESET_SECONDS", default=30)
+# Threads refunding a batch of transactions at once, and the most refunds they
+# may make each second between them
+DRILL_SUPPERS_REFUND_WORKERS = env.int("DRILL_SUPPERS_REFUND_WORKERS", default=8)
+DRILL_SUPPERS_REFUNDS_PER_SECOND = env.float("DRILL_SUPPERS_REFUNDS_PER_SECOND", default=20)
+# Seconds before a failed job is retried, doubling with each attempt up to the
+# maximum, and how long a job may run before its worker is assumed to have died
+DRILL_SUPPERS_JOB_BACKOFF = env.int("DRILL_SUPPERS_JOB_BACKOFF", default=10)
+DRILL_SUPPERS_JOB_MAX_BACKOFF = env.int("DRILL_SUPPERS_JOB_MAX_BACKOFF", default=3600)
+DRILL_SUPPERS_JOB_LOCK_TIMEOUT = env.int("DRILL_SUPPERS_JOB_LOCK_TIMEOUT", default=900)
+# Days finished jobs are kept before the worker deletes them
+DRILL_SUPPERS_JOB_RETENTION_DAYS = env.int("DRILL_SUPPERS_JOB_RETENTION_DAYS", default=7)
+# Bearer token a Prometheus server sends to scrape the Stripe call metrics,
+# which are otherwise only shown to staff
+DRILL_SUPPERS_METRICS_TOKEN = env("DRILL_SUPPERS_METRICS_TOKEN", default="")
+# Longest the drill night availability API is cached for, by the site and by
+# any CDN in front of it, as the meals left change with every sale
+DRILL_SUPPERS_AVAILABILITY_MAX_AGE = env.int("DRILL_SUPPERS_AVAILABILITY_MAX_AGE", default=60)
+# Seconds a drill night report waits for live updates before asking again,
+# below the timeout of any proxy in front of the site
+DRILL_SUPPERS_LIVE_TIMEOUT = env.int("DRILL_SUPPERS_LIVE_TIMEOUT", default=25)
+# Requests each client may make to a rate limited view in a burst, and the
+# seconds over which they are allowed again, see drill_suppers.throttling.
+# Buyers are limited by their email and session, and only loosely by their
+# address, which members behind one NAT share
+DRILL_SUPPERS_RATE_LIMITS = {
+    "purchase": (10, 60 * 10),
+    "purchase_ip": (100, 60 * 10),
+    "refund": (5, 60 * 10),
+    "refund_ip": (50, 60 * 10),
+}
+# Turned off to load test the site from a single address
+DRILL_SUPPERS_RATE_LIMITS_ENABLED = env.bool("DRILL_SUPPERS_RATE_LIMITS_ENABLED", default=True)
+# Proxies in front of the site that append to X-Forwarded-For, so that rate
+# limits apply to the client's address rather than theirs. 1 in production
+DRILL_SUPPERS_TRUSTED_PROXIES = env.int("DRILL_SUPPERS_TRUSTED_PROXIES", default=0)
+# Buyers let through the waiting room of a drill night each minute, unless
+# the night sets its own rate, and how long a queue ticket stays valid
+DRILL_SUPPERS_WAITING_ROOM_RATE = env.int("DRILL_SUPPERS_WAITING_ROOM_RATE", default=60)
+DRILL_SUPPERS_QUEUE_TICKET_HOURS = env.int("DRILL_SUPPERS_QUEUE_TICKET_HOURS", default=6)
@@ -21,6 +21,12 @@ DATABASES["default"] = env.db("DATABASE_URL")  # noqa F405
 DATABASES["default"]["ATOMIC_REQUESTS"] = True  # noqa F405
 DATABASES["default"]["CONN_MAX_AGE"] = env.int("CONN_MAX_AGE", default=60)  # noqa F405
 
+# DRILL SUPPERS
+# ------------------------------------------------------------------------------
+# The Heroku router appends the client's address to X-Forwarded-For, and is
+# what REMOTE_ADDR shows, so without it every buyer would share one address
+DRILL_SUPPERS_TRUSTED_PROXIES = env.int("DRILL_SUPPERS_TRUSTED_PROXIES", default=1)
+
 # CACHES
 # ------------------------------------------------------------------------------
 CACHES = {
@@ -1,5 +1,9 @@
+from unittest import mock
+
 import pytest
+from django.core.cache import cache
 
+from hac_shop.drill_suppers import throttling, waiting_room
 from hac_shop.drill_suppers.models import (
     DrillNight,
     StripeCheckoutSession,
@@ -21,6 +25,24 @@ def media_storage(settings, tmpdir):
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    # Rate limits and waiting room queues fall back to process memory without Redis
+    throttling._local_buckets.clear()
+    waiting_room._local_issued.clear()
+    waiting_room._local_state.clear()
+
+
+@pytest.fixture(autouse=True)
+def stripe_price_create():
+    # Checkout sessions are made for a drill night's Stripe price, which is
+    # created on its first sale
+    with mock.patch("stripe.Price.create") as create_mock:
+        create_mock.return_value = mock.Mock(id="price_test")
+        yield create_mock
+
+
 @pytest.fixture
 def user() -> User:
     return UserFactory()
@@ -1,21 +1,136 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db import transaction
+from django.db.models import Count, Max, Min, QuerySet
+from django.shortcuts import redirect
+from django.utils import timezone
+
+from hac_shop.utils.pagination import EstimatedCountPaginator
+
+from . import exports, refunds
+from .models import (
+    DrillNight,
+    Job,
+    ReconciliationRun,
+    RefundBatch,
+    RefundBatchItem,
+    TransactionRecord,
+    utc_now,
+)
+
+@admin.action(description="Export bookings for selected nights as CSV")
+def export_csv(modeladmin, request, queryset):
+    return exports.response(exports.bookings(drill_nights=queryset), "csv", "bookings")
+
+
+@admin.action(description="Export bookings for selected nights as Excel")
+def export_xlsx(modeladmin, request, queryset):
+    return exports.response(exports.bookings(drill_nights=queryset), "xlsx", "bookings")
+
+
+class DrillNightListQuerySet(QuerySet):
+    """The nights in the changelist, whose date hierarchy reads the date_time index."""
+
+    def datetimes(self, field_name, kind, *args, **kwargs):
+        if kind != "year":
+            # The months or days of one year are a short range of the index
+            return super().datetimes(field_name, kind, *args, **kwargs)
+
+        # DISTINCT over the year of every night reads the whole table. Nights
+        # are held every year, so the years are taken from the first to the
+        # last night instead, the two ends of the index
+        date_range = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if date_range["first"] is None:
+            return []
+
+        first, last = (timezone.localtime(date_range[end]) for end in ("first", "last"))
+        return [
+            first.replace(year=year, month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+            for year in range(first.year, last.year + 1)
+        ]
+
+
+class DrillNightChangeList(ChangeList):
+
+    # Only the columns shown are loaded, which also spares each row working
+    # out its Stripe product in DrillNight.from_db
+    list_fields = ["date_time", "cut_off_time", "annotation", "meals_sold", "waiting_room"]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).only(*self.list_fields)
+        return DrillNightListQuerySet(queryset.model, queryset.query, queryset.db)
+
+    def get_results(self, request):
+        super().get_results(request)
+
+        # Counted for the nights on the page alone, in one query on the
+        # night and status index
+        paid_bookings = dict(
+            TransactionRecord.objects.filter(
+                drill_night__in=[drill_night.pk for drill_night in self.result_list],
+                status=TransactionRecord.PaymentStatus.PAID,
+            )
+            .values_list("drill_night")
+            .annotate(Count("pk"))
+        )
+
+        for drill_night in self.result_list:
+            drill_night.paid_bookings = paid_bookings.get(drill_night.pk, 0)
 
-from .models import DrillNight, TransactionRecord
 
 @admin.register(DrillNight)
 class DrillNightAdmin(admin.ModelAdmin):
 
-    list_display = ["date", "annotation", "day_of_week", "time", "cut_off_delta", "meals_sold"]
+    list_display = [
+        "date",
+        "annotation",
+        "day_of_week",
+        "time",
+        "cut_off_delta",
+        "meals_sold",
+        "paid_bookings",
+        "waiting_room",
+    ]
     date_hierarchy = "date_time"
+    readonly_fields = ["meals_sold", "meals_reserved"]
+
+    # Years of nights are paged without COUNT(*) scanning them all for the
+    # page count and again for the unfiltered total
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    actions = [export_csv, export_xlsx]
+
+    def get_changelist(self, request, **kwargs):
+        return DrillNightChangeList
+
+    # The date and time columns sort on the indexed date_time
+    def date(self, obj):
+        return obj.date
+    date.admin_order_field = "date_time"
+
+    def day_of_week(self, obj):
+        return obj.day_of_week
+    day_of_week.admin_order_field = "date_time"
+
+    def time(self, obj):
+        return obj.time
+    time.admin_order_field = "date_time"
 
     def meals_sold(self, obj):
         return obj.meals_sold
     meals_sold.short_description = "Approximate Meals Sold"
 
+    def paid_bookings(self, obj):
+        return obj.paid_bookings
+
 
 @admin.action(description='Refund and cancel selected transactions')
 def refund(modeladmin, request, queryset):
-    [transaction.refund(ignore_checks=True) for transaction in queryset.all()]
+    # Refunds are made in the background, the progress page follows them
+    batch = refunds.create_batch(queryset, user=request.user)
+    refunds.start_batch(batch)
+    return redirect(batch)
 
 @admin.register(TransactionRecord)
 class TransactionRecordAdmin(admin.ModelAdmin):
@@ -25,5 +140,97 @@ class TransactionRecordAdmin(admin.ModelAdmin):
     date_hierarchy = "drill_night__date_time"
     search_fields = ["email", "name"]
 
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
     actions = [refund]
 
+    # The meal counters of the night, which decide what is left to sell, only
+    # follow status changes made with update_status. Refunds and cancellations
+    # are made with the actions and the site
+    counted_fields = ["drill_night", "status", "quantity"]
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = list(super().get_readonly_fields(request, obj))
+        return readonly_fields + self.counted_fields if obj is not None else readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+
+            if not change:
+                sold, reserved = TransactionRecord.meal_counts(obj.status, obj.quantity)
+                if sold or reserved:
+                    DrillNight.objects.adjust_meals(obj.drill_night_id, sold=sold, reserved=reserved)
+
+    def delete_model(self, request, obj):
+        TransactionRecord.delete_bookings(TransactionRecord.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        TransactionRecord.delete_bookings(queryset)
+
+
+class RefundBatchItemInline(admin.TabularInline):
+    model = RefundBatchItem
+    fields = ["transaction_record", "status", "error", "updated_at"]
+    readonly_fields = fields
+    raw_id_fields = ["transaction_record"]
+    can_delete = False
+    extra = 0
+
+
+@admin.register(RefundBatch)
+class RefundBatchAdmin(admin.ModelAdmin):
+
+    list_display = ["created_at", "created_by", "finished_at"]
+    readonly_fields = ["created_by", "finished_at"]
+    inlines = [RefundBatchItemInline]
+
+
+@admin.action(description="Run the selected jobs again")
+def retry_jobs(modeladmin, request, queryset):
+    queryset.exclude(status=Job.Status.RUNNING).update(
+        status=Job.Status.QUEUED, attempts=0, run_at=utc_now(), finished_at=None
+    )
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+
+    list_filter = ["status", "function"]
+    list_display = ["function", "status", "priority", "attempts", "run_at", "locked_by"]
+    # Workers import and call whatever a job names, so jobs are only ever
+    # queued by the code
+    readonly_fields = [
+        "function",
+        "args",
+        "kwargs",
+        "attempts",
+        "last_error",
+        "locked_by",
+        "locked_at",
+        "finished_at",
+    ]
+
+    actions = [retry_jobs]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ReconciliationRun)
+class ReconciliationRunAdmin(admin.ModelAdmin):
+
+    list_display = [
+        "started_at",
+        "sessions_seen",
+        "api_calls",
+        "marked_paid",
+        "marked_cancelled",
+        "discrepancy_count",
+    ]
+    readonly_fields = [field.name for field in ReconciliationRun._meta.fields]
+
+    def discrepancy_count(self, obj):
+        return len(obj.discrepancies)
+    discrepancy_count.short_description = "Discrepancies"
@@ -0,0 +1,192 @@
+"""
+Async versions of the purchase views, used when DRILL_SUPPERS_ASYNC_VIEWS is
+set and the site is served by config.asgi, and the long-poll of live updates
+for the drill night report, which is always async.
+
+Stripe is called through the pooled async client, so a process can have
+hundreds of checkouts waiting on Stripe at once. Database work runs in
+Django's thread through sync_to_async, and each write uses its own short
+transaction instead of ATOMIC_REQUESTS.
+"""
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http.response import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils.cache import add_never_cache_headers
+
+from . import live, stripe_client, throttling, waiting_room
+from .forms import PurchaseForm
+from .models import (
+    DrillNight,
+    DrillNightSoldOutError,
+    DrillNightUnavailableError,
+    TransactionRecord,
+)
+from .views import SOLD_OUT_MESSAGE, UNAVAILABLE_MESSAGE, stripe_unavailable
+
+
+def earlier_checkout_session(form: PurchaseForm):
+    """The checkout session of the booking made by an earlier submission of the form."""
+    earlier = form.earlier_booking()
+    return None if earlier is None else earlier.stripecheckoutsession
+
+
+def save_purchase(form: PurchaseForm):
+    """Save a valid purchase and return its checkout session, or None if the form has errors."""
+    if not form.is_valid():
+        return None
+
+    try:
+        return form.save().stripecheckoutsession
+    except DrillNightSoldOutError:
+        form.add_error("drill_night", SOLD_OUT_MESSAGE)
+        return None
+    except DrillNightUnavailableError:
+        form.add_error("drill_night", UNAVAILABLE_MESSAGE)
+        return None
+
+
+UPDATE_ID = re.compile(r"^\d+-\d+$")
+
+
+def get_transaction_record(pk) -> TransactionRecord:
+    return get_object_or_404(
+        TransactionRecord.objects.select_related("stripecheckoutsession"), pk=pk
+    )
+
+
+@transaction.non_atomic_requests
+@throttling.rate_limit("purchase", keys=("email", "session"))
+@throttling.rate_limit("purchase_ip", keys=("ip",))
+async def transaction_record_create(request):
+    form = PurchaseForm(request.POST or None)
+
+    if request.method == "POST":
+        # A repeated submission of the form goes to the booking it already
+        # made, even if the night has since sold out
+        checkout_session = await sync_to_async(earlier_checkout_session)(form)
+
+        if checkout_session is None:
+            if await stripe_client.abreaker_open():
+                return await sync_to_async(stripe_unavailable)(request)
+
+            # Only buyers let through a night's waiting room may book it
+            queued = await sync_to_async(waiting_room.queue_redirect)(
+                request, request.POST.get("drill_night")
+            )
+            if queued is not None:
+                return queued
+
+            checkout_session = await sync_to_async(save_purchase)(form)
+
+        if checkout_session is not None:
+            transaction_record = checkout_session.transaction_record
+
+            # Only a booking from an earlier submission can have moved on
+            if transaction_record.status != TransactionRecord.PaymentStatus.AWAITING_CHECKOUT:
+                return redirect(transaction_record)
+
+            try:
+                await checkout_session.agenerate_session()
+            except stripe_client.StripeUnavailableError:
+                await sync_to_async(checkout_session.transaction_record.update_status)(
+                    TransactionRecord.PaymentStatus.CANCELLED
+                )
+                return await sync_to_async(stripe_unavailable)(request)
+
+            return redirect(checkout_session.checkout_url)
+
+    else:
+        queued = await sync_to_async(waiting_room.queue_redirect)(request)
+        if queued is not None:
+            return queued
+
+    response = await sync_to_async(render)(
+        request, "drill_suppers/transactionrecord_form.html", {"form": form}
+    )
+    # The form carries a new idempotency key each time, so must never be cached
+    add_never_cache_headers(response)
+    return response
+
+
+@transaction.non_atomic_requests
+async def transaction_record_purchased(request, pk):
+    checkout_session_id = request.GET.get("session_id")
+
+    if not checkout_session_id:
+        return JsonResponse({"reason": "no session id"}, status=400)
+
+    transaction_record = await sync_to_async(get_transaction_record)(pk)
+    checkout_session = transaction_record.stripecheckoutsession
+
+    if checkout_session.session_id != checkout_session_id:
+        return JsonResponse({"reason": "incorrect session id"}, status=400)
+
+    # The webhook has usually confirmed the payment before the buyer gets
+    # here, only ask Stripe if it hasn't arrived yet
+    if transaction_record.status == TransactionRecord.PaymentStatus.PAID:
+        return redirect(transaction_record)
+
+    if await checkout_session.averify_if_paid():
+        await sync_to_async(transaction_record.update_status)(
+            TransactionRecord.PaymentStatus.PAID
+        )
+        return redirect(transaction_record)
+    else:
+        return JsonResponse({"reason": "not paid"}, status=400)
+
+
+@transaction.non_atomic_requests
+async def transaction_record_cancelled(request, pk):
+    checkout_session_id = request.GET.get("session_id")
+
+    if not checkout_session_id:
+        return JsonResponse({"reason": "no session id"}, status=400)
+
+    transaction_record = await sync_to_async(get_transaction_record)(pk)
+    checkout_session = transaction_record.stripecheckoutsession
+
+    if checkout_session.session_id != checkout_session_id:
+        return JsonResponse({"reason": "incorrect session id"}, status=400)
+
+    if transaction_record.status == TransactionRecord.PaymentStatus.CANCELLED:
+        return redirect(reverse("drill_suppers:index"))
+
+    # Only a booking still awaiting checkout can be cancelled, the buyer may
+    # have paid in another tab before the webhook arrived
+    if (
+        transaction_record.status != TransactionRecord.PaymentStatus.AWAITING_CHECKOUT
+        or await checkout_session.averify_if_paid()
+    ):
+        return redirect(transaction_record)
+
+    await sync_to_async(transaction_record.update_status)(
+        TransactionRecord.PaymentStatus.CANCELLED
+    )
+    return redirect(reverse("drill_suppers:index"))
+
+
+def is_staff(request) -> bool:
+    return request.user.is_staff
+
+
+@transaction.non_atomic_requests
+async def drill_night_live(request, pk):
+    """Wait for changes to a night's bookings after the update the report has."""
+    if not await sync_to_async(is_staff)(request):
+        return HttpResponse(status=403)
+
+    after = request.GET.get("after", "0-0")
+    if not UPDATE_ID.match(after):
+        return JsonResponse({"reason": "invalid update id"}, status=400)
+
+    await sync_to_async(get_object_or_404)(DrillNight, pk=pk)
+
+    latest, updates = await live.changes(
+        pk, after, timeout=settings.DRILL_SUPPERS_LIVE_TIMEOUT
+    )
+    return JsonResponse({"after": latest, "updates": updates})
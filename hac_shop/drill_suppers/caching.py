@@ -0,0 +1,138 @@
+"""
+Cached reads of drill supper data that is requested far more often than it
+changes. Entries are invalidated by the signals in signals.py and expire no
+later than the data would change by itself as cut-off times pass.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import inventory
+
+SELLABLE_CHOICES_KEY = "drill_suppers:sellable_choices"
+AVAILABILITY_KEY = "drill_suppers:availability"
+WAITING_ROOMS_KEY = "drill_suppers:waiting_rooms"
+
+# Upper bound on how long any sellable nights entry is kept
+MAX_TIMEOUT = 60 * 15
+
+
+def sellable_timeout(drill_nights) -> int:
+    """Seconds until the list of sellable nights changes without a save.
+
+    That is when the next of the nights passes its cut-off time, or when the
+    next night comes within the four week sales window.
+    """
+    from .models import DrillNight
+
+    now = datetime.now(timezone.utc)
+    changes = [drill_night.cut_off_time for drill_night in drill_nights]
+
+    next_in_window = (
+        DrillNight.objects.filter(on_sale=True, date_time__gte=now + timedelta(weeks=4))
+        .order_by("date_time")
+        .values_list("date_time", flat=True)
+        .first()
+    )
+    if next_in_window:
+        changes.append(next_in_window - timedelta(weeks=4))
+
+    seconds = min([MAX_TIMEOUT] + [(change - now).total_seconds() for change in changes])
+
+    return max(int(seconds), 1)
+
+
+def get_sellable_choices() -> list:
+    """Return (pk, label) pairs for the drill nights currently on sale."""
+    from .models import DrillNight
+
+    choices = cache.get(SELLABLE_CHOICES_KEY)
+
+    if choices is None:
+        drill_nights = list(DrillNight.sellable.all())
+        choices = [(drill_night.pk, str(drill_night)) for drill_night in drill_nights]
+        cache.set(SELLABLE_CHOICES_KEY, choices, sellable_timeout(drill_nights))
+
+    return choices
+
+
+def get_waiting_rooms() -> dict:
+    """Return the admissions per minute of the nights on sale with a waiting room, by pk."""
+    from .models import DrillNight
+
+    waiting_rooms = cache.get(WAITING_ROOMS_KEY)
+
+    if waiting_rooms is None:
+        drill_nights = list(DrillNight.sellable.all())
+        waiting_rooms = {
+            drill_night.pk: drill_night.admissions_per_minute
+            or settings.DRILL_SUPPERS_WAITING_ROOM_RATE
+            for drill_night in drill_nights
+            if drill_night.waiting_room
+        }
+        cache.set(WAITING_ROOMS_KEY, waiting_rooms, sellable_timeout(drill_nights))
+
+    return waiting_rooms
+
+
+def get_availability() -> tuple:
+    """Return the (body, etag, expires) of the availability API response.
+
+    The body lists the drill nights on sale with the meals left, which are
+    read from Redis for the nights tracked there. It is kept until the list
+    of nights changes, and for at most DRILL_SUPPERS_AVAILABILITY_MAX_AGE
+    seconds as the meals left change with every sale.
+    """
+    from .models import DrillNight
+
+    availability = cache.get(AVAILABILITY_KEY)
+
+    if availability is None:
+        drill_nights = list(DrillNight.sellable.all())
+        tracked = inventory.remaining(
+            [drill_night.pk for drill_night in drill_nights if drill_night.capacity is not None]
+        )
+
+        nights = []
+        for drill_night in drill_nights:
+            if drill_night.capacity is None:
+                remaining = None
+            else:
+                remaining = max(
+                    tracked.get(
+                        drill_night.pk,
+                        drill_night.capacity - drill_night.meals_sold - drill_night.meals_reserved,
+                    ),
+                    0,
+                )
+
+            nights.append(
+                {
+                    "id": drill_night.pk,
+                    "name": str(drill_night),
+                    "date_time": drill_night.date_time.isoformat(),
+                    "annotation": drill_night.annotation,
+                    "price": str(drill_night.price),
+                    "cut_off_time": drill_night.cut_off_time.isoformat(),
+                    "capacity": drill_night.capacity,
+                    "remaining": remaining,
+                }
+            )
+
+        timeout = min(
+            sellable_timeout(drill_nights), settings.DRILL_SUPPERS_AVAILABILITY_MAX_AGE
+        )
+        body = json.dumps({"drill_nights": nights}).encode()
+        expires = datetime.now(timezone.utc) + timedelta(seconds=timeout)
+        availability = (body, hashlib.sha1(body).hexdigest(), expires)
+
+        cache.set(AVAILABILITY_KEY, availability, timeout)
+
+    return availability
+
+
+def invalidate_sellable_nights() -> None:
+    cache.delete_many([SELLABLE_CHOICES_KEY, AVAILABILITY_KEY, WAITING_ROOMS_KEY])
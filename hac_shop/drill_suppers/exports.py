@@ -0,0 +1,245 @@
+"""
+Streaming CSV and XLSX exports of the bookings for kitchen and finance staff.
+
+The rows are read with QuerySet.iterator(), a server-side cursor on
+Postgres, and written out a chunk at a time as the response is sent, so an
+export of any size is made in constant memory. The XLSX file is a zip
+archive written straight to the response with zipfile, which needs no
+spreadsheet library and never holds more than one chunk of the sheet.
+"""
+import csv
+import re
+import zipfile
+from datetime import date
+from typing import Iterable, Iterator, Optional
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import TransactionRecord
+
+# Rows fetched from the database, and written out, at a time
+CHUNK_SIZE = 2000
+
+HEADER = [
+    "Drill night",
+    "Annotation",
+    "Name",
+    "Email",
+    "Quantity",
+    "Status",
+    "Dietary notes",
+    "Reference",
+]
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+STATUSES = dict(TransactionRecord.PaymentStatus.choices)
+
+# Characters that make a spreadsheet read a cell as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+# Control characters that aren't allowed in XML
+XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def bookings(
+    drill_nights: Optional[Iterable] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> Iterator[list]:
+    """The export rows for the given drill nights, or nights between start and end inclusive."""
+    records = TransactionRecord.objects.all()
+
+    if drill_nights is not None:
+        records = records.filter(drill_night__in=drill_nights)
+    if start:
+        records = records.filter(drill_night__date_time__date__gte=start)
+    if end:
+        records = records.filter(drill_night__date_time__date__lte=end)
+
+    rows = (
+        records.order_by("drill_night__date_time", "drill_night_id", "name")
+        .values_list(
+            "drill_night__date_time",
+            "drill_night__annotation",
+            "name",
+            "email",
+            "quantity",
+            "status",
+            "dietary_notes",
+            "id",
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+    # Rows come a night at a time, so each night's time is only formatted once
+    night = shown = None
+
+    for date_time, annotation, name, email, quantity, status, notes, pk in rows:
+        if date_time != night:
+            night, shown = date_time, timezone.localtime(date_time).strftime("%Y-%m-%d %H:%M")
+
+        yield [
+            shown,
+            annotation or "",
+            name,
+            email,
+            quantity,
+            STATUSES.get(status, status),
+            notes or "",
+            str(pk),
+        ]
+
+
+def chunked(rows: Iterator[list]) -> Iterator[list]:
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+class Buffer:
+    """A write-only file whose contents are taken out as they are sent."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        # Text from the csv module, bytes from zipfile
+        self.chunks.append(data.encode() if isinstance(data, str) else bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def safe_cell(value):
+    # Names and notes are typed in by buyers, so mustn't run as formulas
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def stream_csv(rows: Iterator[list]) -> Iterator[bytes]:
+    buffer = Buffer()
+    writer = csv.writer(buffer)
+
+    # A byte order mark, so Excel reads the file as UTF-8
+    yield "\ufeff".encode()
+    writer.writerow(HEADER)
+
+    for chunk in chunked(rows):
+        writer.writerows([safe_cell(value) for value in row] for row in chunk)
+        yield buffer.drain()
+
+    yield buffer.drain()
+
+
+def xlsx_row(number: int, row: list) -> str:
+    cells = []
+
+    for value in row:
+        if isinstance(value, int):
+            cells.append(f"<c><v>{value}</v></c>")
+        else:
+            text = escape(XML_ILLEGAL.sub("", value))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Bookings" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+
+def stream_xlsx(rows: Iterator[list]) -> Iterator[bytes]:
+    buffer = Buffer()
+
+    # Without tell() on the buffer zipfile writes each entry's sizes after
+    # its data, so the archive can be sent as it is written
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        yield buffer.drain()
+
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b"<sheetData>"
+            )
+            sheet.write(xlsx_row(1, HEADER).encode())
+            number = 2
+
+            for chunk in chunked(rows):
+                sheet.write(
+                    "".join(
+                        xlsx_row(number + offset, row) for offset, row in enumerate(chunk)
+                    ).encode()
+                )
+                number += len(chunk)
+                yield buffer.drain()
+
+            sheet.write(b"</sheetData></worksheet>")
+
+    yield buffer.drain()
+
+
+def response(rows: Iterator[list], export_format: str, filename: str) -> StreamingHttpResponse:
+    """Stream rows as a download in export_format, csv or xlsx."""
+    stream = stream_xlsx if export_format == "xlsx" else stream_csv
+
+    response = StreamingHttpResponse(stream(rows), content_type=FORMATS[export_format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -1,15 +1,58 @@
+import uuid
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 from crispy_forms.bootstrap import FormActions
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import ButtonHolder, Div, Field, Fieldset, Layout, Submit
 from django.core.exceptions import ValidationError
-from django.forms import EmailField, Form, ModelForm
-
+from django.db import IntegrityError, transaction
+from django.forms import (
+    ChoiceField,
+    DateField,
+    DateInput,
+    EmailField,
+    Form,
+    HiddenInput,
+    ModelForm,
+    UUIDField,
+)
+
+from .caching import get_sellable_choices
 from .models import DrillNight, StripeCheckoutSession, TransactionRecord
 
 
+class SellableDrillNightField(ChoiceField):
+    """Offers the cached list of sellable drill nights and cleans to a DrillNight."""
+
+    def __init__(self, **kwargs):
+        super().__init__(choices=self.get_choices, **kwargs)
+
+    @staticmethod
+    def get_choices():
+        return [("", "---------")] + get_sellable_choices()
+
+    def clean(self, value):
+        value = super().clean(value)
+
+        # The chosen night is checked against the database as the cached list
+        # may be slightly behind
+        try:
+            return DrillNight.sellable.get(pk=value)
+        except DrillNight.DoesNotExist:
+            raise ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+
+
 class PurchaseForm(ModelForm):
+
+    drill_night = SellableDrillNightField(label="Drill night")
+    # A new key each time the form is shown, sent back with every submission of it
+    idempotency_key = UUIDField(required=False, widget=HiddenInput, initial=uuid.uuid4)
+
     class Meta:
         model = TransactionRecord
         fields = ["name", "email", "drill_night", "quantity", "dietary_notes"]
@@ -24,12 +67,10 @@ class PurchaseForm(ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # Only show sellable drill nights
-        self.fields["drill_night"].queryset = DrillNight.sellable.all()
-
         self.helper = FormHelper()
         self.helper.form_method = "POST"
         self.helper.layout = Layout(
+            Field("idempotency_key"),
             Div(
                 Div(
                     Div(
@@ -65,11 +106,56 @@ class PurchaseForm(ModelForm):
             ),
         )
 
+    def earlier_booking(self) -> Optional[TransactionRecord]:
+        """The booking made by an earlier submission of this form, if any."""
+        try:
+            key = self.fields["idempotency_key"].clean(self.data.get("idempotency_key"))
+        except ValidationError:
+            return None
+
+        if key is None:
+            return None
+
+        return (
+            TransactionRecord.objects.select_related("stripecheckoutsession")
+            .filter(idempotency_key=key)
+            .first()
+        )
+
     def save(self, commit: bool = True):
-        obj = super().save(commit=commit)
+        self.instance.idempotency_key = self.cleaned_data.get("idempotency_key")
+
+        if not commit:
+            return super().save(commit=commit)
+
+        # Hold the seats and create the records in one short transaction, the
+        # reservation raises DrillNightSoldOutError if the night is full, or
+        # DrillNightUnavailableError if its pending changes are unknown. The
+        # record is inserted first, so of submissions racing with the same
+        # key all but one fail on its unique constraint before taking meals
+        reserved_in_redis = False
+
+        try:
+            with transaction.atomic():
+                obj = super().save(commit=commit)
+                reserved_in_redis = self.instance.drill_night.reserve_meals(self.instance.quantity)
+                StripeCheckoutSession.objects.create(transaction_record=obj)
+        except Exception as error:
+            # Redis isn't rolled back with the transaction, so give the meals back
+            if reserved_in_redis:
+                DrillNight.objects.adjust_meals(
+                    self.instance.drill_night_id, reserved=-self.instance.quantity
+                )
 
-        if commit:
-            StripeCheckoutSession.objects.create(transaction_record=obj)
+            if not isinstance(error, IntegrityError):
+                raise
+
+            earlier = self.earlier_booking()
+
+            if earlier is None:
+                raise
+
+            self.instance = obj = earlier
 
         return obj
 
@@ -100,3 +186,31 @@ class RefundForm(ModelForm):
         # Always return a value to use as the new cleaned data, even if
         # this method didn't change it.
         return data
+
+
+class BookingsExportForm(Form):
+
+    start = DateField(label="First night", widget=DateInput(attrs={"type": "date"}))
+    end = DateField(label="Last night", widget=DateInput(attrs={"type": "date"}))
+    format = ChoiceField(choices=[("csv", "CSV"), ("xlsx", "Excel (XLSX)")])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.helper = FormHelper()
+        self.helper.form_method = "GET"
+        self.helper.layout = Layout(
+            Field("start"),
+            Field("end"),
+            Field("format"),
+            Submit("submit", "Export"),
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        if cleaned_data.get("start") and cleaned_data.get("end"):
+            if cleaned_data["start"] > cleaned_data["end"]:
+                raise ValidationError("The first night must be before the last")
+
+        return cleaned_data
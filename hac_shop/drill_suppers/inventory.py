@@ -0,0 +1,302 @@
+"""
+Remaining meal inventory for capacity limited drill nights, held in Redis.
+
+Purchases decrement the remaining meals with a Lua script, so concurrent
+buyers never queue on the drill night row in Postgres. Each change is also
+recorded as a pending delta which the sync_inventory command writes behind
+into the DrillNight counters, and the database stays the durable record.
+Deltas are only removed from Redis once the update writing them commits.
+
+Every function returns None when Redis can't be used (a non Redis cache,
+the feature turned off or the server unavailable) and the caller falls back
+to updating the database directly.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+PENDING_NIGHTS_KEY = "drill_suppers:inventory:pending"
+
+# How long a night is held by a flush, in case its process dies part way
+FLUSH_LOCK_SECONDS = 60
+
+# Returns the meals left after the reservation, -1 if there are not enough
+# left or -2 if the night isn't tracked yet
+RESERVE_SCRIPT = """
+local remaining = redis.call('GET', KEYS[1])
+if not remaining then
+    return -2
+end
+local quantity = tonumber(ARGV[1])
+if tonumber(remaining) < quantity then
+    return -1
+end
+remaining = redis.call('DECRBY', KEYS[1], quantity)
+redis.call('HINCRBY', KEYS[2], 'reserved', quantity)
+redis.call('SADD', KEYS[3], ARGV[2])
+return remaining
+"""
+
+# Returns the meals left before and after the change, or -2 if the night
+# isn't tracked
+ADJUST_SCRIPT = """
+local remaining = redis.call('GET', KEYS[1])
+if not remaining then
+    return -2
+end
+local sold = tonumber(ARGV[1])
+local reserved = tonumber(ARGV[2])
+local after = redis.call('DECRBY', KEYS[1], sold + reserved)
+redis.call('HINCRBY', KEYS[2], 'sold', sold)
+redis.call('HINCRBY', KEYS[2], 'reserved', reserved)
+redis.call('SADD', KEYS[3], ARGV[3])
+return {tonumber(remaining), after}
+"""
+
+# Removes the deltas a flush wrote into the database, keeping any recorded
+# since it read them, and releases the night
+WRITTEN_SCRIPT = """
+local sold = redis.call('HINCRBY', KEYS[1], 'sold', -tonumber(ARGV[1]))
+local reserved = redis.call('HINCRBY', KEYS[1], 'reserved', -tonumber(ARGV[2]))
+if sold == 0 and reserved == 0 then
+    redis.call('DEL', KEYS[1])
+    redis.call('SREM', KEYS[2], ARGV[3])
+end
+redis.call('DEL', KEYS[3])
+return 1
+"""
+
+# Sets the meals left from the database counters, less anything reserved
+# or sold since they were last written
+SEED_SCRIPT = """
+local pending = redis.call('HMGET', KEYS[2], 'sold', 'reserved')
+local remaining = tonumber(ARGV[1]) - (tonumber(pending[1]) or 0) - (tonumber(pending[2]) or 0)
+if ARGV[3] == '1' then
+    redis.call('SET', KEYS[1], remaining, 'EX', ARGV[2])
+else
+    redis.call('SET', KEYS[1], remaining, 'EX', ARGV[2], 'NX')
+end
+return tonumber(redis.call('GET', KEYS[1]))
+"""
+
+
+def remaining_key(pk) -> str:
+    return f"drill_suppers:inventory:{pk}:remaining"
+
+
+def pending_key(pk) -> str:
+    return f"drill_suppers:inventory:{pk}:pending"
+
+
+def flushing_key(pk) -> str:
+    return f"drill_suppers:inventory:{pk}:flushing"
+
+
+def get_client():
+    if not settings.DRILL_SUPPERS_REDIS_INVENTORY:
+        return None
+
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        # The configured cache isn't backed by Redis
+        return None
+
+
+def _run(script: str, keys: list, args: list):
+    client = get_client()
+
+    if client is None:
+        return None
+
+    try:
+        return client.register_script(script)(keys=keys, args=args)
+    except RedisError:
+        logger.warning("Redis inventory unavailable, using the database", exc_info=True)
+        return None
+
+
+def seed(drill_night, overwrite: bool = False) -> Optional[int]:
+    """Start tracking a night in Redis, returning the meals left."""
+    if drill_night.capacity is None or get_client() is None:
+        return None
+
+    # Anything pending stays in Redis until its write commits, and is taken
+    # off the database counters by the script
+    drill_night.refresh_from_db(
+        fields=["capacity", "cut_off_time", "meals_sold", "meals_reserved"]
+    )
+
+    remaining = drill_night.capacity - drill_night.meals_sold - drill_night.meals_reserved
+    expires = drill_night.cut_off_time + timedelta(days=1) - datetime.now(timezone.utc)
+
+    if expires.total_seconds() <= 0:
+        return None
+
+    return _run(
+        SEED_SCRIPT,
+        keys=[remaining_key(drill_night.pk), pending_key(drill_night.pk)],
+        args=[remaining, int(expires.total_seconds()), "1" if overwrite else "0"],
+    )
+
+
+def forget(pk) -> None:
+    """Stop tracking a night, any pending changes are still written behind."""
+    client = get_client()
+
+    if client is None:
+        return
+
+    try:
+        client.delete(remaining_key(pk))
+    except RedisError:
+        logger.warning("Redis inventory unavailable, nothing forgotten", exc_info=True)
+
+
+def remaining(pks: list) -> dict:
+    """The meals left for each of the nights tracked in Redis, by pk, in one round trip."""
+    client = get_client()
+
+    if client is None or not pks:
+        return {}
+
+    try:
+        values = client.mget([remaining_key(pk) for pk in pks])
+    except RedisError:
+        logger.warning("Redis inventory unavailable, using the database", exc_info=True)
+        return {}
+
+    return {pk: int(value) for pk, value in zip(pks, values) if value is not None}
+
+
+def pending(pks: list) -> Optional[dict]:
+    """The sold and reserved changes not yet written behind for each of the nights, by pk.
+
+    Unlike the other functions this returns None only when Redis is in use
+    but can't be reached, as the changes held there are then unknown.
+    """
+    client = get_client()
+
+    if client is None or not pks:
+        return {}
+
+    try:
+        pipeline = client.pipeline(transaction=False)
+
+        for pk in pks:
+            pipeline.hmget(pending_key(pk), "sold", "reserved")
+
+        values = pipeline.execute()
+    except RedisError:
+        logger.warning("Redis inventory unavailable, pending changes unknown", exc_info=True)
+        return None
+
+    return {
+        pk: (int(sold or 0), int(reserved or 0))
+        for pk, (sold, reserved) in zip(pks, values)
+        if int(sold or 0) or int(reserved or 0)
+    }
+
+
+def reserve(drill_night, quantity: int) -> Optional[int]:
+    """Take meals from a night, returning the meals left or -1 if sold out."""
+    if drill_night.capacity is None:
+        return None
+
+    keys = [remaining_key(drill_night.pk), pending_key(drill_night.pk), PENDING_NIGHTS_KEY]
+    remaining = _run(RESERVE_SCRIPT, keys=keys, args=[quantity, drill_night.pk])
+
+    if remaining == -2 and seed(drill_night) is not None:
+        remaining = _run(RESERVE_SCRIPT, keys=keys, args=[quantity, drill_night.pk])
+
+    if remaining is None or remaining == -2:
+        return None
+
+    return remaining
+
+
+def adjust(pk, sold: int = 0, reserved: int = 0) -> Optional[Tuple[int, int]]:
+    """Change the counters of a tracked night, returning the meals left before and after."""
+    result = _run(
+        ADJUST_SCRIPT,
+        keys=[remaining_key(pk), pending_key(pk), PENDING_NIGHTS_KEY],
+        args=[sold, reserved, pk],
+    )
+
+    if result is None or result == -2:
+        return None
+
+    return tuple(result)
+
+
+def flush(pk=None) -> int:
+    """Write pending changes behind into the database, returning the nights updated."""
+    client = get_client()
+
+    if client is None:
+        return 0
+
+    try:
+        pks = [pk] if pk is not None else client.smembers(PENDING_NIGHTS_KEY)
+    except RedisError:
+        logger.warning("Redis inventory unavailable, nothing flushed", exc_info=True)
+        return 0
+
+    flushed = 0
+
+    for night_pk in pks:
+        if isinstance(night_pk, bytes):
+            night_pk = night_pk.decode()
+
+        if flush_night(client, night_pk):
+            flushed += 1
+
+    return flushed
+
+
+def flush_night(client, pk) -> bool:
+    """Write a night's pending changes behind, removing them from Redis once they commit."""
+    from .models import DrillNight
+
+    try:
+        # Another flush holding the night would write the same deltas again
+        if not client.set(flushing_key(pk), 1, nx=True, ex=FLUSH_LOCK_SECONDS):
+            return False
+
+        pending = client.hgetall(pending_key(pk))
+    except RedisError:
+        logger.warning("Redis inventory unavailable, nothing flushed", exc_info=True)
+        return False
+
+    sold = int(pending.get(b"sold", 0))
+    reserved = int(pending.get(b"reserved", 0))
+
+    def written(sold: int = sold, reserved: int = reserved):
+        _run(
+            WRITTEN_SCRIPT,
+            keys=[pending_key(pk), PENDING_NIGHTS_KEY, flushing_key(pk)],
+            args=[sold, reserved, pk],
+        )
+
+    if not sold and not reserved:
+        written()
+        return False
+
+    try:
+        with transaction.atomic():
+            DrillNight.objects.update_meals(pk, sold=sold, reserved=reserved, reopen=False)
+            transaction.on_commit(written)
+    except Exception:
+        # The deltas are still pending, so only release the night
+        written(0, 0)
+        raise
+
+    return True
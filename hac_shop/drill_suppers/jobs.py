@@ -0,0 +1,182 @@
+"""
+A job queue kept in the database and run by the worker process.
+
+enqueue() records a call to a module level function as a Job row in the
+same transaction as the work that asked for it, so a job only ever runs
+for changes that were committed. Workers claim jobs with SELECT ... FOR
+UPDATE SKIP LOCKED, so any number of them can run on any number of nodes
+without taking the same job.
+
+A job that raises is retried with exponential backoff until it has been
+tried max_attempts times, after which it is marked dead and left for
+someone to look at. A job whose worker died part way through is put back
+on the queue once its lock is older than DRILL_SUPPERS_JOB_LOCK_TIMEOUT
+seconds, so job functions should be safe to run more than once.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(
+    function: Callable,
+    *args,
+    priority: int = 0,
+    run_at: Optional[datetime] = None,
+    max_attempts: int = 5,
+    **kwargs,
+) -> Job:
+    """Queue a call to function, whose arguments must be JSON serializable."""
+    return Job.objects.create(
+        function=f"{function.__module__}.{function.__qualname__}",
+        args=list(args),
+        kwargs=kwargs,
+        priority=priority,
+        run_at=run_at or datetime.now(timezone.utc),
+        max_attempts=max_attempts,
+    )
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def backoff(attempts: int) -> timedelta:
+    seconds = settings.DRILL_SUPPERS_JOB_BACKOFF * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, settings.DRILL_SUPPERS_JOB_MAX_BACKOFF))
+
+
+def claim(worker: str, batch_size: int = 1) -> List[Job]:
+    """Take the next jobs that are due, most important first."""
+    now = datetime.now(timezone.utc)
+
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.Status.QUEUED, run_at__lte=now)
+            .order_by("-priority", "run_at")[:batch_size]
+        )
+
+        if not jobs:
+            return []
+
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=Job.Status.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+        )
+
+    for job in jobs:
+        job.attempts += 1
+
+    return jobs
+
+
+def run(job: Job) -> bool:
+    """Run a claimed job, returning whether it succeeded."""
+    try:
+        import_string(job.function)(*job.args, **job.kwargs)
+    except Exception as error:
+        now = datetime.now(timezone.utc)
+
+        if job.attempts >= job.max_attempts:
+            logger.exception("Job %s %s failed for the last time", job.pk, job.function)
+            changes = dict(status=Job.Status.DEAD, finished_at=now)
+        else:
+            logger.warning("Job %s %s failed, retrying", job.pk, job.function, exc_info=True)
+            changes = dict(status=Job.Status.QUEUED, run_at=now + backoff(job.attempts))
+
+        Job.objects.filter(pk=job.pk).update(
+            last_error=f"{type(error).__name__}: {error}",
+            locked_by="",
+            locked_at=None,
+            **changes,
+        )
+        return False
+
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.Status.DONE,
+        finished_at=datetime.now(timezone.utc),
+        locked_by="",
+        locked_at=None,
+    )
+    return True
+
+
+def requeue_stale() -> int:
+    """Put back jobs whose worker stopped without finishing them, returning how many."""
+    stale = Job.objects.filter(
+        status=Job.Status.RUNNING,
+        locked_at__lt=datetime.now(timezone.utc)
+        - timedelta(seconds=settings.DRILL_SUPPERS_JOB_LOCK_TIMEOUT),
+    )
+
+    dead = stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.Status.DEAD,
+        finished_at=datetime.now(timezone.utc),
+        last_error="The worker stopped before the job finished",
+    )
+    requeued = stale.update(status=Job.Status.QUEUED, locked_by="", locked_at=None)
+
+    return dead + requeued
+
+
+def purge() -> int:
+    """Delete finished jobs older than DRILL_SUPPERS_JOB_RETENTION_DAYS."""
+    deleted, _ = Job.objects.filter(
+        status=Job.Status.DONE,
+        finished_at__lt=datetime.now(timezone.utc)
+        - timedelta(days=settings.DRILL_SUPPERS_JOB_RETENTION_DAYS),
+    ).delete()
+
+    return deleted
+
+
+def work(
+    batch_size: int = 1,
+    burst: bool = False,
+    idle_seconds: float = 1.0,
+    should_stop: Callable[[], bool] = lambda: False,
+) -> int:
+    """Run jobs until stopped, or until the queue is empty in burst mode.
+
+    Returns the number of jobs run.
+    """
+    worker = worker_name()
+    ran = 0
+    housekeeping_at = 0.0
+
+    while not should_stop():
+        if time.monotonic() >= housekeeping_at:
+            requeue_stale()
+            purge()
+            housekeeping_at = time.monotonic() + 60
+
+        jobs = claim(worker, batch_size)
+
+        for job in jobs:
+            run(job)
+            ran += 1
+
+        if not jobs:
+            if burst:
+                break
+
+            # Drop the connection if it has broken or outlived CONN_MAX_AGE
+            close_old_connections()
+            time.sleep(idle_seconds)
+
+    return ran
@@ -0,0 +1,294 @@
+"""
+Live updates of a drill night's bookings for the kitchen report.
+
+When bookings for a night are made or change status, publish() adds the
+changed rows and the night's new meal totals to a Redis stream for that
+night, capped at STREAM_LENGTH entries, and announces the night on a
+pub/sub channel. Each process listens to the channel on one connection in
+one thread and wakes the long-poll requests waiting on the night, which
+read what they missed from the stream. An open report costs an idle
+coroutine in an async worker, and each change costs two queries however
+many screens show it, and none while no report for the night is open, as
+open reports keep their night marked as watched.
+
+Without Redis the updates are kept in the memory of the process, which is
+enough for the development server.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Iterable, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "drill_suppers:live:"
+STREAM_LENGTH = 1000
+# Streams for nights with no changes for this long are removed by Redis
+STREAM_EXPIRE_SECONDS = 60 * 60 * 48
+# How long a night stays watched after a report last asked for its changes,
+# beyond the long-poll timeout
+WATCH_SECONDS = 60
+
+_local_streams = defaultdict(lambda: deque(maxlen=STREAM_LENGTH))
+_local_watched = {}
+_local_sequence = 0
+_local_lock = threading.Lock()
+
+
+def stream_key(drill_night_id) -> str:
+    return f"drill_suppers:live:{drill_night_id}:stream"
+
+
+def watch_key(drill_night_id) -> str:
+    return f"drill_suppers:live:{drill_night_id}:watched"
+
+
+def get_client():
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        # The configured cache isn't backed by Redis
+        return None
+
+
+def parse_id(entry_id: str) -> Tuple[int, int]:
+    milliseconds, sequence = entry_id.split("-")
+    return int(milliseconds), int(sequence)
+
+
+def send(drill_night_id, update: dict) -> None:
+    """Add an update to a night's stream and wake the requests waiting on it."""
+    client = get_client()
+    data = json.dumps(update)
+
+    if client is None:
+        global _local_sequence
+        with _local_lock:
+            _local_sequence += 1
+            _local_streams[str(drill_night_id)].append((f"{_local_sequence}-0", data))
+        listener.wake(str(drill_night_id))
+        return
+
+    try:
+        pipeline = client.pipeline(transaction=False)
+        pipeline.xadd(
+            stream_key(drill_night_id),
+            {"update": data},
+            maxlen=STREAM_LENGTH,
+            approximate=True,
+        )
+        pipeline.expire(stream_key(drill_night_id), STREAM_EXPIRE_SECONDS)
+        pipeline.publish(f"{CHANNEL_PREFIX}{drill_night_id}", "")
+        pipeline.execute()
+    except RedisError:
+        logger.warning("Redis unavailable, live update dropped", exc_info=True)
+
+
+def read(drill_night_id, after: str) -> Tuple[str, list]:
+    """Return the id of the latest update and the updates since after."""
+    client = get_client()
+
+    if client is None:
+        with _local_lock:
+            entries = [
+                (entry_id, data)
+                for entry_id, data in _local_streams[str(drill_night_id)]
+                if parse_id(entry_id) > parse_id(after)
+            ]
+    else:
+        try:
+            streams = client.xread({stream_key(drill_night_id): after}, count=STREAM_LENGTH)
+        except RedisError:
+            logger.warning("Redis unavailable, no live updates", exc_info=True)
+            return after, []
+
+        entries = [
+            (entry_id.decode(), fields[b"update"])
+            for _, stream in streams
+            for entry_id, fields in stream
+        ]
+
+    if not entries:
+        return after, []
+
+    return entries[-1][0], [json.loads(data) for _, data in entries]
+
+
+def latest_id(drill_night_id) -> str:
+    """The id of the latest update, for a report to follow the updates from."""
+    client = get_client()
+
+    if client is None:
+        with _local_lock:
+            stream = _local_streams[str(drill_night_id)]
+            return stream[-1][0] if stream else "0-0"
+
+    try:
+        entries = client.xrevrange(stream_key(drill_night_id), count=1)
+    except RedisError:
+        return "0-0"
+
+    return entries[0][0].decode() if entries else "0-0"
+
+
+def watch(drill_night_id, seconds: float) -> None:
+    """Mark a night as shown on an open report for the next seconds."""
+    client = get_client()
+
+    if client is None:
+        with _local_lock:
+            _local_watched[str(drill_night_id)] = time.monotonic() + seconds
+        return
+
+    try:
+        client.set(watch_key(drill_night_id), 1, ex=max(int(seconds), 1))
+    except RedisError:
+        logger.warning("Redis unavailable, night not watched", exc_info=True)
+
+
+def watched(drill_night_id) -> bool:
+    client = get_client()
+
+    if client is None:
+        with _local_lock:
+            return _local_watched.get(str(drill_night_id), 0) > time.monotonic()
+
+    try:
+        return bool(client.exists(watch_key(drill_night_id)))
+    except RedisError:
+        # Left to send() to report
+        return True
+
+
+def publish(drill_night_id, record_ids: Iterable) -> None:
+    """Send the given records of a night, and its meal totals, to the open reports."""
+    from .models import TransactionRecord
+
+    # A report opened later renders the bookings from the database
+    if not watched(drill_night_id):
+        return
+
+    records = [
+        {**record, "id": str(record["id"])}
+        for record in TransactionRecord.objects.filter(pk__in=list(record_ids)).values(
+            "id", "name", "email", "quantity", "status", "dietary_notes"
+        )
+    ]
+    totals = TransactionRecord.booking_totals(drill_night_id)
+
+    send(
+        drill_night_id,
+        {
+            "records": records,
+            "totals": {
+                status: totals[status] for status in TransactionRecord.PaymentStatus.values
+            },
+        },
+    )
+
+
+def changed(drill_night_id, record_ids: Iterable) -> None:
+    """Publish changes to a night's bookings once the transaction making them commits."""
+    record_ids = list(record_ids)
+
+    def publish_changes():
+        try:
+            publish(drill_night_id, record_ids)
+        except Exception:
+            # The report can always be refreshed, a booking mustn't fail for it
+            logger.exception("Live update for drill night %s failed", drill_night_id)
+
+    transaction.on_commit(publish_changes)
+
+
+class Listener:
+    """Wakes the requests waiting on a night when an update is announced."""
+
+    def __init__(self):
+        self.waiters = defaultdict(set)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.listen, name="drill-suppers-live", daemon=True
+                )
+                self.thread.start()
+
+    def listen(self) -> None:
+        while True:
+            client = get_client()
+
+            if client is None:
+                # Updates are sent straight to wake() within the process
+                return
+
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+
+                for message in pubsub.listen():
+                    self.wake(message["channel"].decode()[len(CHANNEL_PREFIX):])
+            except RedisError:
+                logger.warning("Redis unavailable, live updates paused", exc_info=True)
+                time.sleep(1)
+
+    def wake(self, drill_night_id: str) -> None:
+        with self.lock:
+            waiters = list(self.waiters.get(drill_night_id, ()))
+
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    @contextmanager
+    def waiting(self, drill_night_id: str):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+
+        with self.lock:
+            self.waiters[drill_night_id].add(waiter)
+
+        try:
+            yield waiter[1]
+        finally:
+            with self.lock:
+                self.waiters[drill_night_id].discard(waiter)
+
+                if not self.waiters[drill_night_id]:
+                    del self.waiters[drill_night_id]
+
+
+listener = Listener()
+
+
+async def changes(drill_night_id, after: str, timeout: float) -> Tuple[str, list]:
+    """Wait up to timeout seconds for updates to a night since after."""
+    drill_night_id = str(drill_night_id)
+    listener.start()
+    read_updates = sync_to_async(read, thread_sensitive=False)
+    await sync_to_async(watch, thread_sensitive=False)(drill_night_id, timeout + WATCH_SECONDS)
+
+    # Waiting starts before the first read, so no update can slip between them
+    with listener.waiting(drill_night_id) as event:
+        latest, updates = await read_updates(drill_night_id, after)
+
+        if updates:
+            return latest, updates
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return after, []
+
+        return await read_updates(drill_night_id, after)
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from hac_shop.drill_suppers.models import DrillNight
+
+
+def create_price(drill_night: DrillNight):
+    try:
+        return drill_night.get_stripe_price_id()
+    except stripe.error.StripeError as error:
+        return error
+    finally:
+        # Each thread opens its own database connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the Stripe prices for the drill nights on sale, so the first "
+        "checkout for each night doesn't wait for one to be made"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Prices to create at once",
+        )
+
+    def handle(self, *args, **options):
+        drill_nights = list(DrillNight.sellable.filter(stripe_price_id=""))
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            results = list(pool.map(create_price, drill_nights))
+
+        failed = 0
+        for drill_night, result in zip(drill_nights, results):
+            if isinstance(result, stripe.error.StripeError):
+                failed += 1
+                self.stderr.write(f"{drill_night}: {result}")
+
+        self.stdout.write(
+            f"Created {len(drill_nights) - failed} Stripe prices, {failed} failed"
+        )
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from hac_shop.drill_suppers import inventory
+from hac_shop.drill_suppers.models import DrillNight, TransactionRecord
+
+
+class Command(BaseCommand):
+    help = "Recalculate the meals sold and reserved counters on every drill night"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drill nights with incorrect counters, without fixing them",
+        )
+
+    def totals(self) -> dict:
+        return {
+            row["drill_night"]: row
+            for row in TransactionRecord.objects.values("drill_night").annotate(
+                sold=models.Sum(
+                    "quantity",
+                    filter=models.Q(status=TransactionRecord.PaymentStatus.PAID),
+                ),
+                reserved=models.Sum(
+                    "quantity",
+                    filter=models.Q(
+                        status=TransactionRecord.PaymentStatus.AWAITING_CHECKOUT
+                    ),
+                ),
+            )
+        }
+
+    def handle(self, *args, **options):
+        drill_nights = DrillNight.objects.only(
+            "id", "date_time", "annotation", "meals_sold", "meals_reserved"
+        )
+
+        with transaction.atomic():
+            if not options["check"]:
+                # Every night is locked before the bookings are added up, so no
+                # status change can commit in between and be overwritten. A
+                # check only reads, and mustn't hold up purchases
+                drill_nights = drill_nights.select_for_update()
+
+            drill_nights = list(drill_nights)
+            totals = self.totals()
+
+            # Changes held in Redis are already in the bookings but not yet in
+            # the counters, and the next flush adds them on
+            pending = inventory.pending([drill_night.pk for drill_night in drill_nights])
+
+            if pending is None:
+                raise CommandError("Redis is unavailable, so the pending changes are unknown")
+
+            incorrect = []
+
+            for drill_night in drill_nights:
+                row = totals.get(drill_night.pk, {})
+                pending_sold, pending_reserved = pending.get(drill_night.pk, (0, 0))
+                sold = (row.get("sold") or 0) - pending_sold
+                reserved = (row.get("reserved") or 0) - pending_reserved
+
+                if (drill_night.meals_sold, drill_night.meals_reserved) == (sold, reserved):
+                    continue
+
+                self.stdout.write(
+                    f"{drill_night}: sold {drill_night.meals_sold} -> {sold}, "
+                    f"reserved {drill_night.meals_reserved} -> {reserved}"
+                )
+
+                drill_night.meals_sold = sold
+                drill_night.meals_reserved = reserved
+                incorrect.append(drill_night)
+
+            if options["check"]:
+                if incorrect:
+                    raise CommandError(
+                        f"{len(incorrect)} drill nights have incorrect meal counters"
+                    )
+            else:
+                DrillNight.objects.bulk_update(
+                    incorrect, ["meals_sold", "meals_reserved"], batch_size=500
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(incorrect)} drill nights "
+                f"{'need' if options['check'] else 'had'} their counters rebuilt"
+            )
+        )
@@ -0,0 +1,58 @@
+import csv
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+
+from hac_shop.drill_suppers.reconciliation import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Settle transactions from the checkout sessions Stripe has created since "
+        "the last run, and report any that don't match"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            type=datetime.fromisoformat,
+            help="Start from sessions created at this date and time instead of the last run",
+        )
+        parser.add_argument("--report", help="Write the discrepancies to this CSV file")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Keep running, reconciling every given number of seconds",
+        )
+
+    def handle(self, *args, **options):
+        since = options["since"]
+        if since and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+
+        while True:
+            run = reconcile(since)
+            since = None
+
+            self.stdout.write(
+                f"Checked {run.sessions_seen} sessions in {run.api_calls} API calls, "
+                f"{run.marked_paid} marked paid, {run.marked_cancelled} cancelled, "
+                f"{len(run.discrepancies)} discrepancies"
+            )
+
+            for discrepancy in run.discrepancies:
+                self.stdout.write(
+                    f"  {discrepancy['session_id']}: {discrepancy['problem']}"
+                )
+
+            if options["report"] and run.discrepancies:
+                with open(options["report"], "w", newline="") as report:
+                    writer = csv.DictWriter(report, fieldnames=run.discrepancies[0].keys())
+                    writer.writeheader()
+                    writer.writerows(run.discrepancies)
+
+            if not options["interval"]:
+                return
+
+            time.sleep(options["interval"])
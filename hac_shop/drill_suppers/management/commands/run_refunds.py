@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from hac_shop.drill_suppers.models import RefundBatch
+from hac_shop.drill_suppers.refunds import run_batch
+
+
+class Command(BaseCommand):
+    help = "Resume refund batches that were interrupted before they finished"
+
+    def add_arguments(self, parser):
+        parser.add_argument("batch", nargs="*", help="Only run these batches")
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Try the refunds that failed again",
+        )
+
+    def handle(self, *args, **options):
+        batches = RefundBatch.objects.order_by("created_at")
+
+        if options["batch"]:
+            batches = batches.filter(pk__in=options["batch"])
+        elif not options["retry_failed"]:
+            batches = batches.filter(finished_at__isnull=True)
+
+        for batch in batches:
+            progress = run_batch(batch, retry_failed=options["retry_failed"])
+            self.stdout.write(
+                f"{batch.pk}: {progress['refunded']} refunded, {progress['failed']} failed, "
+                f"{progress['skipped']} skipped"
+            )
@@ -0,0 +1,40 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from hac_shop.drill_suppers.jobs import work
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs, start more workers to run more at once"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1,
+            help="Jobs to claim at a time",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Stop once there are no jobs due, instead of waiting for more",
+        )
+
+    def handle(self, *args, **options):
+        stopping = []
+
+        def stop(signum, frame):
+            # Finish the job in hand before exiting
+            stopping.append(signum)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        ran = work(
+            batch_size=options["batch_size"],
+            burst=options["burst"],
+            should_stop=lambda: bool(stopping),
+        )
+
+        self.stdout.write(f"Ran {ran} jobs")
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from hac_shop.drill_suppers.reservations import sweep
+
+
+class Command(BaseCommand):
+    help = "Cancel reservations that have expired without completing the checkout"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Keep running, sweeping every given number of seconds",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            swept = sweep(options["batch_size"])
+            elapsed = time.perf_counter() - started
+
+            self.stdout.write(
+                f"Swept {swept} expired reservations in {elapsed:.2f}s "
+                f"({swept / elapsed:.1f}/s)"
+            )
+
+            if not options["interval"]:
+                return
+
+            time.sleep(options["interval"])
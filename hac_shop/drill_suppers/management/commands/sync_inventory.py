@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from hac_shop.drill_suppers import inventory
+from hac_shop.drill_suppers.models import DrillNight
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the meals sold and reserved in Redis behind into the database, "
+        "then reset the meals left in Redis from the database to correct any drift"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Keep running, syncing every given number of seconds",
+        )
+
+    def handle(self, *args, **options):
+        if inventory.get_client() is None:
+            self.stdout.write("The Redis inventory isn't in use, nothing to sync")
+            return
+
+        while True:
+            flushed = inventory.flush()
+
+            seeded = 0
+            for drill_night in DrillNight.sellable.filter(capacity__isnull=False):
+                if inventory.seed(drill_night, overwrite=True) is not None:
+                    seeded += 1
+
+            self.stdout.write(
+                f"Wrote {flushed} drill nights behind, reset {seeded} in Redis"
+            )
+
+            if not options["interval"]:
+                return
+
+            time.sleep(options["interval"])
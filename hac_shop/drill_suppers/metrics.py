@@ -0,0 +1,244 @@
+"""
+Latency, error and concurrency metrics for the calls made to Stripe.
+
+stripe_client and stripe_async time every attempt at a Stripe call with
+track(), which counts it into a latency histogram per endpoint, counts
+errors by type and retries, and keeps a gauge of the calls in flight. With
+a Redis cache the figures are kept in one Redis hash shared by every
+worker, otherwise in the memory of the process. render() writes them in
+the Prometheus text format for the metrics view.
+
+Recording a call never waits on Redis: the figures are added up in the
+process and a background thread writes them every FLUSH_SECONDS in one
+round trip, so async views can record from the event loop.
+
+When sentry_sdk is installed each call is also a span in the request's
+transaction, so Stripe's share of a slow request can be told apart from
+database and template time.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from redis.exceptions import RedisError
+
+try:
+    import sentry_sdk
+except ImportError:
+    sentry_sdk = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "drill_suppers:metrics:stripe"
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Seconds between writes of the figures added up in the process
+FLUSH_SECONDS = 1
+
+_local_metrics = defaultdict(float)
+_pending = defaultdict(float)
+_local_lock = threading.Lock()
+_flusher = None
+
+
+def get_client():
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        # The configured cache isn't backed by Redis
+        return None
+
+
+def increment(amounts: dict) -> None:
+    """Add to several metrics at once, they are written by the flusher thread."""
+    with _local_lock:
+        for field, amount in amounts.items():
+            _pending[field] += amount
+
+    start_flusher()
+
+
+def flush() -> None:
+    """Write the figures added up in the process since the last flush."""
+    with _local_lock:
+        amounts = dict(_pending)
+        _pending.clear()
+
+    if not amounts:
+        return
+
+    client = get_client()
+
+    if client is None:
+        with _local_lock:
+            for field, amount in amounts.items():
+                _local_metrics[field] += amount
+        return
+
+    try:
+        pipeline = client.pipeline(transaction=False)
+        for field, amount in amounts.items():
+            pipeline.hincrbyfloat(METRICS_KEY, field, amount)
+        pipeline.execute()
+    except RedisError:
+        logger.debug("Redis unavailable, Stripe metrics dropped", exc_info=True)
+
+
+def flush_forever() -> None:
+    while True:
+        time.sleep(FLUSH_SECONDS)
+
+        try:
+            flush()
+        except Exception:
+            logger.warning("Stripe metrics not written", exc_info=True)
+
+
+def start_flusher() -> None:
+    global _flusher
+
+    # Threads don't survive a fork, so each worker process starts its own
+    if _flusher is not None and _flusher.is_alive():
+        return
+
+    with _local_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=flush_forever, name="stripe-metrics", daemon=True)
+            _flusher.start()
+
+
+atexit.register(flush)
+
+
+def read() -> dict:
+    flush()
+    client = get_client()
+
+    if client is None:
+        with _local_lock:
+            return dict(_local_metrics)
+
+    try:
+        return {
+            field.decode(): float(value)
+            for field, value in client.hgetall(METRICS_KEY).items()
+        }
+    except RedisError:
+        logger.warning("Redis unavailable, no Stripe metrics", exc_info=True)
+        return {}
+
+
+def reset() -> None:
+    client = get_client()
+
+    with _local_lock:
+        _pending.clear()
+
+    if client is None:
+        with _local_lock:
+            _local_metrics.clear()
+    else:
+        client.delete(METRICS_KEY)
+
+
+def bucket(seconds: float) -> str:
+    return next((str(le) for le in BUCKETS if seconds <= le), "+Inf")
+
+
+@contextmanager
+def track(endpoint: str):
+    """Time one attempt at a Stripe call to endpoint, counting any error it raises."""
+    increment({f"in_flight|{endpoint}": 1})
+    started = time.perf_counter()
+    outcome = {}
+
+    span = (
+        sentry_sdk.start_span(op="http.client", description=f"Stripe {endpoint}")
+        if sentry_sdk
+        else nullcontext()
+    )
+
+    try:
+        with span:
+            yield
+    except Exception as error:
+        outcome[f"errors|{endpoint}|{type(error).__name__}"] = 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        increment(
+            {
+                f"in_flight|{endpoint}": -1,
+                f"count|{endpoint}": 1,
+                f"sum|{endpoint}": elapsed,
+                f"bucket|{endpoint}|{bucket(elapsed)}": 1,
+                **outcome,
+            }
+        )
+
+
+def retried(endpoint: str) -> None:
+    increment({f"retries|{endpoint}": 1})
+
+
+def rejected(endpoint: str) -> None:
+    """Count a call refused because the circuit breaker is open."""
+    increment({f"rejected|{endpoint}": 1})
+
+
+def render() -> str:
+    """The metrics in the Prometheus text exposition format."""
+    metrics = defaultdict(dict)
+
+    for field, value in read().items():
+        kind, endpoint, *label = field.split("|")
+        metrics[kind][(endpoint, *label)] = value
+
+    lines = [
+        "# HELP stripe_request_duration_seconds Time taken by each attempt at a Stripe call",
+        "# TYPE stripe_request_duration_seconds histogram",
+    ]
+
+    for (endpoint,), count in sorted(metrics["count"].items()):
+        cumulative = 0
+        for le in [*map(str, BUCKETS), "+Inf"]:
+            cumulative += metrics["bucket"].get((endpoint, le), 0)
+            lines.append(
+                f'stripe_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {cumulative:g}'
+            )
+        lines.append(
+            f'stripe_request_duration_seconds_sum{{endpoint="{endpoint}"}} {metrics["sum"][(endpoint,)]:g}'
+        )
+        lines.append(f'stripe_request_duration_seconds_count{{endpoint="{endpoint}"}} {count:g}')
+
+    lines += [
+        "# HELP stripe_request_errors_total Stripe call attempts that raised, by error",
+        "# TYPE stripe_request_errors_total counter",
+    ]
+    for (endpoint, error), count in sorted(metrics["errors"].items()):
+        lines.append(
+            f'stripe_request_errors_total{{endpoint="{endpoint}",error="{error}"}} {count:g}'
+        )
+
+    for kind, name, help_text, metric_type in [
+        ("retries", "stripe_request_retries_total", "Stripe calls retried after a failure", "counter"),
+        (
+            "rejected",
+            "stripe_breaker_rejections_total",
+            "Stripe calls refused while the circuit breaker was open",
+            "counter",
+        ),
+        ("in_flight", "stripe_requests_in_flight", "Stripe calls waiting on a response", "gauge"),
+    ]:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for (endpoint,), value in sorted(metrics[kind].items()):
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {value:g}')
+
+    return "\n".join(lines) + "\n"
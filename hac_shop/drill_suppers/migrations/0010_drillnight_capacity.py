@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0009_alter_drillnight_annotation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drillnight',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum number of meals that can be sold, leave blank for no limit', null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+
+def populate_meal_counters(apps, schema_editor):
+    DrillNight = apps.get_model('drill_suppers', 'DrillNight')
+    TransactionRecord = apps.get_model('drill_suppers', 'TransactionRecord')
+
+    totals = TransactionRecord.objects.values('drill_night').annotate(
+        sold=models.Sum('quantity', filter=models.Q(status='paid')),
+        reserved=models.Sum('quantity', filter=models.Q(status='awaiting_checkout')),
+    )
+
+    for row in totals:
+        DrillNight.objects.filter(pk=row['drill_night']).update(
+            meals_sold=row['sold'] or 0,
+            meals_reserved=row['reserved'] or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0010_drillnight_capacity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drillnight',
+            name='meals_reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='drillnight',
+            name='meals_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_meal_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0011_drillnight_meal_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drillnight',
+            index=models.Index(condition=models.Q(('on_sale', True)), fields=['cut_off_time', 'date_time'], name='drillnight_sellable_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionrecord',
+            index=models.Index(fields=['drill_night', 'status'], include=('quantity',), name='transaction_night_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionrecord',
+            index=models.Index(fields=['status'], name='transaction_status_idx'),
+        ),
+    ]
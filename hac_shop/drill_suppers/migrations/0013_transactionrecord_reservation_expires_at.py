@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:26
+
+from django.db import migrations, models
+import hac_shop.drill_suppers.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0012_drill_supper_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionrecord',
+            name='reservation_expires_at',
+            field=models.DateTimeField(default=hac_shop.drill_suppers.models.reservation_expiry, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='transactionrecord',
+            index=models.Index(condition=models.Q(('status', 'awaiting_checkout')), fields=['reservation_expires_at'], name='transaction_reservation_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0013_transactionrecord_reservation_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripecheckoutsession',
+            name='payment_intent',
+            field=models.CharField(blank=True, db_index=True, max_length=256, null=True),
+        ),
+        migrations.AlterField(
+            model_name='stripecheckoutsession',
+            name='session_id',
+            field=models.CharField(blank=True, db_index=True, max_length=256, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('drill_suppers', '0014_stripecheckoutsession_payment_intent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefundBatch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'refund batches',
+            },
+        ),
+        migrations.CreateModel(
+            name='RefundBatchItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('refunded', 'Refunded'), ('failed', 'Failed')], default='pending', max_length=31)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='drill_suppers.refundbatch')),
+                ('transaction_record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='drill_suppers.transactionrecord')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='refundbatchitem',
+            constraint=models.UniqueConstraint(fields=('batch', 'transaction_record'), name='unique_refund_batch_item'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0016_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drillnight',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0017_drillnight_stripe_price_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_gte', models.DateTimeField(blank=True, null=True)),
+                ('next_created_gte', models.DateTimeField(blank=True, null=True)),
+                ('api_calls', models.PositiveIntegerField(default=0)),
+                ('sessions_seen', models.PositiveIntegerField(default=0)),
+                ('marked_paid', models.PositiveIntegerField(default=0)),
+                ('marked_cancelled', models.PositiveIntegerField(default=0)),
+                ('discrepancies', models.JSONField(blank=True, default=list)),
+            ],
+            options={
+                'get_latest_by': 'started_at',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0018_reconciliationrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionrecord',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0019_transactionrecord_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drillnight',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='transactionrecord',
+            index=models.Index(fields=['drill_night', 'updated_at'], name='transaction_night_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0020_conditional_get'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drillnight',
+            name='admissions_per_minute',
+            field=models.PositiveIntegerField(blank=True, help_text='Buyers let through the waiting room each minute, leave blank for the default', null=True),
+        ),
+        migrations.AddField(
+            model_name='drillnight',
+            name='waiting_room',
+            field=models.BooleanField(default=False, help_text='Queue buyers in a waiting room while the night is on sale, for events expecting a rush'),
+        ),
+    ]
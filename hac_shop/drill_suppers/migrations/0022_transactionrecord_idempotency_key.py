@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0021_drillnight_waiting_room'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionrecord',
+            name='idempotency_key',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
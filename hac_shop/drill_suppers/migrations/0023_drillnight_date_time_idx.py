@@ -0,0 +1,17 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0022_transactionrecord_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drillnight',
+            index=models.Index(fields=['date_time'], name='drillnight_date_time_idx'),
+        ),
+    ]
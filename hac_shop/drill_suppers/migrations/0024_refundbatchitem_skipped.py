@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drill_suppers', '0023_drillnight_date_time_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='refundbatchitem',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('refunded', 'Refunded'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='pending', max_length=31),
+        ),
+    ]
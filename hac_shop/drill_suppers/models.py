@@ -1,15 +1,21 @@
+import hashlib
 import uuid
+from collections import defaultdict
 import pytz
 from datetime import datetime, timedelta, timezone, tzinfo
 
 import stripe
+from asgiref.sync import sync_to_async
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest
 from django.db.models import fields
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 
+from . import caching, inventory, live, stripe_async, stripe_client
+
 SERVER_URL = settings.STRIPE_CALLBACK_URL
 
 HAC_TIMEZONE = settings.HAC_TIMEZONE
@@ -18,15 +24,65 @@ class AfterDrillNightCutOffError(Exception):
     pass
 
 
+class DrillNightSoldOutError(Exception):
+    pass
+
+
+class DrillNightUnavailableError(Exception):
+    pass
+
+
 class DrillNightManager(models.Manager):
-    def get_queryset(self):
-        # Only allow dill nights that are on sale, the cut_off time is in the future
-        # and the drill night is within the next 4 weeks
-        return (
-            super()
-            .get_queryset()
-            .annotate(meals_sold=models.Sum('transactionrecord__quantity', filter=models.Q(transactionrecord__status='paid')))
-        )
+    def adjust_meals(self, pk, sold: int = 0, reserved: int = 0) -> None:
+        if pk not in inventory.remaining([pk]):
+            self.update_meals(pk, sold=sold, reserved=reserved)
+            return
+
+        # Redis isn't rolled back with the database, so tracked nights are
+        # only changed once the transaction commits
+        transaction.on_commit(lambda: self.adjust_tracked_meals(pk, sold=sold, reserved=reserved))
+
+    def adjust_tracked_meals(self, pk, sold: int = 0, reserved: int = 0) -> None:
+        # Nights tracked in Redis have the change written behind later by the
+        # sync_inventory command
+        change = inventory.adjust(pk, sold=sold, reserved=reserved)
+
+        if change is None:
+            self.update_meals(pk, sold=sold, reserved=reserved)
+        elif change[0] <= 0 < change[1]:
+            reopened = self.filter(
+                pk=pk, on_sale=False, cut_off_time__gt=datetime.now(timezone.utc)
+            ).update(on_sale=True)
+
+            if reopened:
+                caching.invalidate_sellable_nights()
+
+    def update_meals(self, pk, sold: int = 0, reserved: int = 0, reopen: bool = True) -> None:
+        # Apply a change to the meal counters in a single UPDATE so concurrent
+        # status changes never lose each other's writes
+        updates = {
+            "meals_sold": Greatest(models.F("meals_sold") + sold, 0),
+            "meals_reserved": Greatest(models.F("meals_reserved") + reserved, 0),
+        }
+
+        if reopen and sold + reserved < 0:
+            # Meals have been freed, so re-open a night that was closed because
+            # it was full as long as it can still be sold
+            updates["on_sale"] = models.Case(
+                models.When(
+                    on_sale=False,
+                    capacity__isnull=False,
+                    capacity__lte=models.F("meals_sold") + models.F("meals_reserved"),
+                    cut_off_time__gt=datetime.now(timezone.utc),
+                    then=models.Value(True),
+                ),
+                default=models.F("on_sale"),
+            )
+
+        self.filter(pk=pk).update(**updates)
+
+        if "on_sale" in updates:
+            caching.invalidate_sellable_nights()
 
 class OnSaleManager(models.Manager):
     def get_queryset(self):
@@ -55,9 +111,46 @@ class DrillNight(models.Model):
     annotation = models.CharField(null=True, blank=True, max_length=50, help_text="To describe special events like Gun Salutes")
 
     on_sale = models.BooleanField(default=True)
+    capacity = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Maximum number of meals that can be sold, leave blank for no limit",
+    )
+
+    waiting_room = models.BooleanField(
+        default=False,
+        help_text="Queue buyers in a waiting room while the night is on sale, for events expecting a rush",
+    )
+    admissions_per_minute = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Buyers let through the waiting room each minute, leave blank for the default",
+    )
+
+    # Maintained by TransactionRecord.update_status, rebuild them with the
+    # rebuild_meal_counters management command
+    meals_sold = models.PositiveIntegerField(default=0, editable=False)
+    meals_reserved = models.PositiveIntegerField(default=0, editable=False)
+
+    # Created on the first sale, or ahead of time by prewarm_stripe_prices,
+    # and cleared whenever the name or price shown at checkout changes
+    stripe_price_id = models.CharField(max_length=255, blank=True, editable=False)
+
+    # When the night was last saved, for conditional GETs of the pages showing it
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['date_time']
+        indexes = [
+            # Covers the OnSaleManager filters for the few nights still on sale
+            models.Index(
+                fields=["cut_off_time", "date_time"],
+                condition=models.Q(on_sale=True),
+                name="drillnight_sellable_idx",
+            ),
+            # The admin's date hierarchy and sorting by date, without a scan
+            models.Index(fields=["date_time"], name="drillnight_date_time_idx"),
+        ]
 
     def __str__(self) -> str:
 
@@ -66,6 +159,138 @@ class DrillNight(models.Model):
         else:
             return self.datetime_string
 
+    # The fields stripe_product() is made from
+    STRIPE_PRODUCT_FIELDS = ("date_time", "price", "annotation")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        # Remember what the Stripe price was made from, see save(). Only the
+        # values are kept, the product is compared when the night is saved
+        if set(cls.STRIPE_PRODUCT_FIELDS) <= set(field_names):
+            instance._loaded_stripe_fields = instance.stripe_product_fields()
+
+        return instance
+
+    def stripe_product_fields(self) -> dict:
+        return {name: getattr(self, name) for name in self.STRIPE_PRODUCT_FIELDS}
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # The meal counters are only changed with UPDATE expressions, and the
+        # Stripe price is set by get_stripe_price_id, so saving a stale copy
+        # of a drill night must never write them back
+        if update_fields is None and not self._state.adding:
+            update_fields = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ("meals_sold", "meals_reserved", "stripe_price_id")
+            ]
+
+            # A new price is needed when what's shown at checkout changes
+            loaded_stripe_fields = getattr(self, "_loaded_stripe_fields", None)
+
+            if loaded_stripe_fields not in (None, self.stripe_product_fields()) and (
+                DrillNight(**loaded_stripe_fields).stripe_product() != self.stripe_product()
+            ):
+                self.stripe_price_id = ""
+                update_fields.append("stripe_price_id")
+
+            self._loaded_stripe_fields = self.stripe_product_fields()
+
+        super().save(force_insert, force_update, using, update_fields)
+
+    def reserve_meals(self, quantity: int) -> bool:
+        """Take meals from the night, returning whether they were taken in Redis.
+
+        Meals taken in Redis aren't given back if the transaction rolls back,
+        the caller has to release them.
+        """
+        # Hot nights are reserved in Redis without touching the database row
+        remaining = inventory.reserve(self, quantity)
+
+        if remaining is not None:
+            if remaining < 0:
+                raise DrillNightSoldOutError
+
+            if remaining == 0:
+                DrillNight.objects.filter(pk=self.pk, on_sale=True).update(on_sale=False)
+                caching.invalidate_sellable_nights()
+                self.on_sale = False
+
+            return True
+
+        # Meals taken in Redis and not yet written behind count against the
+        # capacity too, and while Redis can't be reached they are unknown
+        pending = inventory.pending([self.pk]) if self.capacity is not None else {}
+
+        if pending is None:
+            raise DrillNightUnavailableError
+
+        unflushed = sum(pending.get(self.pk, (0, 0)))
+
+        # The capacity check and the increment happen in one conditional UPDATE,
+        # so purchases across all workers can never take more than the capacity
+        drill_night = DrillNight.objects.filter(pk=self.pk)
+
+        reserved = drill_night.filter(
+            models.Q(capacity__isnull=True)
+            | models.Q(
+                capacity__gte=models.F("meals_sold")
+                + models.F("meals_reserved")
+                + unflushed
+                + quantity
+            )
+        ).update(meals_reserved=models.F("meals_reserved") + quantity)
+
+        if not reserved:
+            raise DrillNightSoldOutError
+
+        # Close the night as soon as the last meal is taken
+        closed = drill_night.filter(
+            on_sale=True,
+            capacity__isnull=False,
+            capacity__lte=models.F("meals_sold") + models.F("meals_reserved") + unflushed,
+        ).update(on_sale=False)
+
+        if closed:
+            caching.invalidate_sellable_nights()
+            self.on_sale = False
+
+        return False
+
+    def stripe_product(self) -> tuple:
+        """The product name and unit amount in pence shown at checkout."""
+        title = self.annotation if self.annotation else "Drill Night"
+        return f"{title} on {self.datetime_string}", int(self.price * 100)
+
+    def get_stripe_price_id(self) -> str:
+        """The Stripe Price for a meal on this night, creating it the first time."""
+        if self.stripe_price_id:
+            return self.stripe_price_id
+
+        name, unit_amount = self.stripe_product()
+        # Concurrent first sales get the same Price back from Stripe
+        digest = hashlib.sha1(f"{name}:{unit_amount}".encode()).hexdigest()[:16]
+
+        price = stripe_client.create_price(
+            currency="GBP",
+            unit_amount=unit_amount,
+            tax_behavior="inclusive",
+            product_data={"name": name},
+            idempotency_key=f"price-{self.pk}-{digest}",
+        )
+
+        # Only kept if no other price was set, and what's shown at checkout
+        # hasn't changed, since this copy of the night was loaded
+        if DrillNight.objects.filter(
+            pk=self.pk, stripe_price_id="", **self.stripe_product_fields()
+        ).update(stripe_price_id=price.id):
+            self.stripe_price_id = price.id
+
+        return price.id
+
     def is_before_cut_off_time(self) -> bool:
         return datetime.now(HAC_TIMEZONE) < self.cut_off_time.replace(tzinfo=HAC_TIMEZONE)
 
@@ -93,6 +318,16 @@ class DrillNight(models.Model):
         return reverse("drill_suppers:drill_night_report", args=[self.id])
 
 
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def reservation_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(
+        minutes=settings.DRILL_SUPPERS_RESERVATION_MINUTES
+    )
+
+
 class TransactionRecord(models.Model):
     class PaymentStatus(models.TextChoices):
         AWAITING_CHECKOUT = (
@@ -127,23 +362,147 @@ class TransactionRecord(models.Model):
     )
     dietary_notes = models.TextField(blank=True, null=True)
 
+    # Meals awaiting checkout are held until this time, after which the
+    # sweep_reservations command cancels the record and frees them
+    reservation_expires_at = models.DateTimeField(default=reservation_expiry, editable=False)
+
+    # Also set by every queryset update of the status, as the report cache
+    # is keyed on it
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Sent with the purchase form, so a repeated submission of the same form
+    # finds this booking instead of making another
+    idempotency_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Meal totals per night by status can be read from the index alone
+            models.Index(
+                fields=["drill_night", "status"],
+                include=["quantity"],
+                name="transaction_night_status_idx",
+            ),
+            models.Index(fields=["status"], name="transaction_status_idx"),
+            # The latest change to a night's bookings, for conditional GETs
+            models.Index(
+                fields=["drill_night", "updated_at"], name="transaction_night_updated_idx"
+            ),
+            models.Index(
+                fields=["reservation_expires_at"],
+                condition=models.Q(status="awaiting_checkout"),
+                name="transaction_reservation_idx",
+            ),
+        ]
+
     def __str__(self) -> str:
         return f"{self.name} - {self.drill_night}"
 
     def get_absolute_url(self):
         return reverse("drill_suppers:detail", args=[self.id])
 
+    @classmethod
+    def meal_counts(cls, status: str, quantity: int) -> tuple:
+        """Return how many meals a record counts as (sold, reserved) in a status."""
+        return (
+            quantity if status == cls.PaymentStatus.PAID else 0,
+            quantity if status == cls.PaymentStatus.AWAITING_CHECKOUT else 0,
+        )
+
+    @classmethod
+    def booking_totals(cls, drill_night_id) -> dict:
+        """The bookings for a night, their latest change and the meals in each status."""
+        return cls.objects.filter(drill_night_id=drill_night_id).aggregate(
+            bookings=models.Count("pk"),
+            last_modified=models.Max("updated_at"),
+            **{
+                status: Coalesce(models.Sum("quantity", filter=models.Q(status=status)), 0)
+                for status in cls.PaymentStatus.values
+            },
+        )
+
+    @classmethod
+    def delete_bookings(cls, queryset) -> None:
+        """Delete records and give back the meals they had sold or were holding."""
+        with transaction.atomic():
+            records = list(
+                queryset.select_for_update().values_list("pk", "drill_night_id", "status", "quantity")
+            )
+            cls.objects.filter(pk__in=[record[0] for record in records]).delete()
+
+            changes = defaultdict(lambda: (0, 0))
+            for _pk, drill_night_id, status, quantity in records:
+                sold, reserved = cls.meal_counts(status, quantity)
+                total_sold, total_reserved = changes[drill_night_id]
+                changes[drill_night_id] = (total_sold - sold, total_reserved - reserved)
+
+            for drill_night_id, (sold, reserved) in changes.items():
+                live.changed(drill_night_id, [])
+
+                if sold or reserved:
+                    DrillNight.objects.adjust_meals(drill_night_id, sold=sold, reserved=reserved)
+
+    def update_status(self, status: str) -> bool:
+        """Move the record to a new status and update the drill night counters.
+
+        The change only applies if the record is still in the status it was
+        loaded with, so repeating a transition never counts the meals twice.
+        Returns whether this call made the change.
+        """
+        previous = self.status
+
+        if previous == status:
+            return False
+
+        with transaction.atomic():
+            updated = TransactionRecord.objects.filter(
+                pk=self.pk, status=previous
+            ).update(status=status, updated_at=utc_now())
+
+            if updated:
+                live.changed(self.drill_night_id, [self.pk])
+                sold_before, reserved_before = self.meal_counts(previous, self.quantity)
+                sold_after, reserved_after = self.meal_counts(status, self.quantity)
+
+                if (sold_before, reserved_before) != (sold_after, reserved_after):
+                    DrillNight.objects.adjust_meals(
+                        self.drill_night_id,
+                        sold=sold_after - sold_before,
+                        reserved=reserved_after - reserved_before,
+                    )
+
+        if updated:
+            self.status = status
+        else:
+            self.refresh_from_db(fields=["status"])
+
+        return bool(updated)
+
     def refund(self, ignore_checks=False):
 
         if not self.drill_night.is_before_cut_off_time() and not ignore_checks:
             raise AfterDrillNightCutOffError
 
-        session = self.stripecheckoutsession.get_session()
+        # The payment intent is stored once the checkout completes, only ask
+        # Stripe for it when the webhook hasn't recorded it
+        payment_intent = self.stripecheckoutsession.payment_intent
 
-        stripe.Refund.create(payment_intent=session.payment_intent)
+        if not payment_intent:
+            payment_intent = self.stripecheckoutsession.get_session().payment_intent
 
-        self.status = TransactionRecord.PaymentStatus.REFUNDED
-        self.save()
+        stripe_client.create_refund(
+            payment_intent=payment_intent, idempotency_key=f"refund-{self.id}"
+        )
+
+        self.update_status(TransactionRecord.PaymentStatus.REFUNDED)
+
+    def refund_later(self, ignore_checks=False):
+        """Queue the refund for the worker instead of waiting on Stripe."""
+        from . import jobs, refunds
+
+        if not self.drill_night.is_before_cut_off_time() and not ignore_checks:
+            raise AfterDrillNightCutOffError
+
+        return jobs.enqueue(refunds.refund_job, str(self.pk), priority=5)
 
 
 class StripeCheckoutSession(models.Model):
@@ -152,20 +511,26 @@ class StripeCheckoutSession(models.Model):
         TransactionRecord, on_delete=models.CASCADE
     )
 
-    session_id = models.CharField(max_length=256, null=True, blank=True)
+    session_id = models.CharField(max_length=256, null=True, blank=True, db_index=True)
     checkout_url = models.TextField(null=True, blank=True)
+    payment_intent = models.CharField(max_length=256, null=True, blank=True, db_index=True)
 
     def get_session(self):
-        return stripe.checkout.Session.retrieve(self.session_id)
+        return stripe_client.retrieve_checkout_session(self.session_id)
 
-    def generate_session(self) -> None:
+    def session_params(self) -> dict:
 
-        if self.session_id and self.checkout_url:
-            return
+        # Close the checkout when the reservation runs out, Stripe only accepts
+        # an expiry at least 30 minutes away
+        expiry = {}
+        expires_at = self.transaction_record.reservation_expires_at
+        if expires_at - datetime.now(timezone.utc) >= timedelta(minutes=30):
+            expiry["expires_at"] = int(expires_at.timestamp())
 
-        title = self.transaction_record.drill_night.annotation if self.transaction_record.drill_night.annotation else "Drill Night"
-
-        checkout_session = stripe.checkout.Session.create(
+        return dict(
+            # The same key for every attempt, so a retried request can't
+            # create a second session for the purchase
+            idempotency_key=f"checkout-session-{self.transaction_record.id}",
             success_url=f"{SERVER_URL}/supper/{self.transaction_record.id}/purchased?session_id={{CHECKOUT_SESSION_ID}}",
             cancel_url=f"{SERVER_URL}/supper/{self.transaction_record.id}/cancel?session_id={{CHECKOUT_SESSION_ID}}",
             mode="payment",
@@ -173,23 +538,199 @@ class StripeCheckoutSession(models.Model):
             customer_email=self.transaction_record.email,
             line_items=[
                 {
-                    "price_data": {
-                        "currency": "GBP",
-                        "product_data": {
-                            "name": f"{title} on {self.transaction_record.drill_night.datetime_string}",
-                        },
-                        "tax_behavior": "inclusive",
-                        "unit_amount": int(self.transaction_record.drill_night.price * 100),
-                    },
+                    "price": self.transaction_record.drill_night.get_stripe_price_id(),
                     "quantity": self.transaction_record.quantity,
                 },
             ],
+            **expiry,
         )
 
+    def set_session(self, checkout_session) -> None:
         self.session_id = checkout_session.id
         self.checkout_url = checkout_session.url
 
         self.save()
 
+    def find_session(self):
+        """The session Stripe made for the purchase in an earlier attempt, if any."""
+        # Sessions are listed from when the reservation was made
+        created = self.transaction_record.reservation_expires_at - timedelta(
+            minutes=settings.DRILL_SUPPERS_RESERVATION_MINUTES + 5
+        )
+        params = {"limit": 100, "created": {"gte": int(created.timestamp())}}
+
+        while True:
+            page = stripe_client.list_checkout_sessions(**params)
+
+            for checkout_session in page.data:
+                if checkout_session.client_reference_id == str(self.transaction_record.id):
+                    return checkout_session
+
+            if not page.has_more:
+                return None
+
+            params["starting_after"] = page.data[-1].id
+
+    def generate_session(self) -> None:
+
+        if self.session_id and self.checkout_url:
+            return
+
+        try:
+            checkout_session = stripe_client.create_checkout_session(**self.session_params())
+        except stripe.error.IdempotencyError:
+            # An earlier attempt made the session with other params, such as an
+            # expiry that has since come too close to send
+            checkout_session = self.find_session()
+
+            if checkout_session is None:
+                raise
+
+        self.set_session(checkout_session)
+
+    async def agenerate_session(self) -> None:
+        # The same as generate_session, without blocking the event loop
+        # while Stripe creates the session
+        if self.session_id and self.checkout_url:
+            return
+
+        params = await sync_to_async(self.session_params)()
+
+        try:
+            checkout_session = await stripe_async.get_client().create_checkout_session(**params)
+        except stripe.error.IdempotencyError:
+            checkout_session = await sync_to_async(self.find_session)()
+
+            if checkout_session is None:
+                raise
+
+        await sync_to_async(self.set_session)(checkout_session)
+
     def verify_if_paid(self) -> bool:
         return self.get_session().payment_status == "paid"
+
+    async def averify_if_paid(self) -> bool:
+        checkout_session = await stripe_async.get_client().retrieve_checkout_session(
+            self.session_id
+        )
+        return checkout_session.payment_status == "paid"
+
+
+class RefundBatch(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "refund batches"
+
+    def __str__(self) -> str:
+        return f"Refund of {self.items.count()} transactions on {self.created_at:%d/%m/%Y %H:%M}"
+
+    def get_absolute_url(self):
+        return reverse("drill_suppers:refund_batch", args=[self.id])
+
+    def progress(self) -> dict:
+        """The number of items in each status."""
+        counts = dict(
+            self.items.values_list("status").annotate(count=models.Count("id"))
+        )
+        return {status: counts.get(status, 0) for status in RefundBatchItem.Status.values}
+
+
+class RefundBatchItem(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        REFUNDED = "refunded", "Refunded"
+        FAILED = "failed", "Failed"
+        SKIPPED = "skipped", "Skipped"  # Not paid for, so nothing to refund
+
+    batch = models.ForeignKey(RefundBatch, related_name="items", on_delete=models.CASCADE)
+    transaction_record = models.ForeignKey(TransactionRecord, on_delete=models.CASCADE)
+
+    status = models.CharField(
+        choices=Status.choices, max_length=31, default=Status.PENDING
+    )
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["batch", "transaction_record"], name="unique_refund_batch_item"
+            ),
+        ]
+
+
+class Job(models.Model):
+    """A call to make from a worker process, see the jobs module."""
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        DEAD = "dead", "Dead"  # Failed on every attempt, left for a person to look at
+
+    function = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(choices=Status.choices, max_length=31, default=Status.QUEUED)
+    # Higher priority jobs are run first
+    priority = models.SmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=utc_now)
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The order workers claim jobs in, covering only the queued ones
+            models.Index(
+                fields=["-priority", "run_at"],
+                condition=models.Q(status="queued"),
+                name="job_queued_idx",
+            ),
+            models.Index(
+                fields=["locked_at"],
+                condition=models.Q(status="running"),
+                name="job_running_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.function} ({self.status})"
+
+
+class ReconciliationRun(models.Model):
+    """One pass of the reconcile_stripe command over the checkout sessions in Stripe."""
+
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    # Sessions created from created_gte were listed, the next run starts
+    # from next_created_gte, the oldest session that could still change
+    created_gte = models.DateTimeField(null=True, blank=True)
+    next_created_gte = models.DateTimeField(null=True, blank=True)
+
+    api_calls = models.PositiveIntegerField(default=0)
+    sessions_seen = models.PositiveIntegerField(default=0)
+    marked_paid = models.PositiveIntegerField(default=0)
+    marked_cancelled = models.PositiveIntegerField(default=0)
+    discrepancies = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        get_latest_by = "started_at"
+
+    def __str__(self) -> str:
+        return f"Reconciliation at {self.started_at:%d/%m/%Y %H:%M}"
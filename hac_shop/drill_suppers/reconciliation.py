@@ -0,0 +1,204 @@
+"""
+Bringing the transaction records in line with the checkout sessions in
+Stripe, for payments whose webhook never arrived.
+
+Each run pages through the sessions Stripe has created since the cursor
+left by the previous run, matches them to their records by session_id and
+settles paid and expired sessions with one UPDATE per status change. The
+cursor moves up to the oldest session that was still open, so a run lists
+only the sessions created since, plus any that can still be paid for.
+
+Anything that can't be settled automatically, such as a session paid for
+after its reservation was cancelled, is recorded on the run as a
+discrepancy for someone to look at.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+from django.db import transaction
+
+from . import live, stripe_client
+from .models import (
+    DrillNight,
+    ReconciliationRun,
+    StripeCheckoutSession,
+    TransactionRecord,
+    utc_now,
+)
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+
+
+def discrepancy(session, problem: str, record_id=None, local_status=None) -> dict:
+    return {
+        "session_id": session.id,
+        "transaction_record": str(record_id) if record_id else None,
+        "local_status": local_status,
+        "stripe_status": session.status,
+        "stripe_payment_status": session.payment_status,
+        "problem": problem,
+    }
+
+
+def apply_transition(previous: str, status: str, records: dict) -> int:
+    """Move records, a dict of pk to (drill night, quantity), between statuses.
+
+    Only records still in the previous status are moved, and the drill
+    night counters are adjusted for those. Returns how many were moved.
+    """
+    with transaction.atomic():
+        pks = list(
+            TransactionRecord.objects.select_for_update()
+            .filter(pk__in=records, status=previous)
+            .values_list("pk", flat=True)
+        )
+
+        if not pks:
+            return 0
+
+        TransactionRecord.objects.filter(pk__in=pks).update(
+            status=status, updated_at=utc_now()
+        )
+
+        meals = defaultdict(lambda: [0, 0])
+        moved = defaultdict(list)
+        for pk in pks:
+            drill_night_id, quantity = records[pk]
+            moved[drill_night_id].append(pk)
+            sold_before, reserved_before = TransactionRecord.meal_counts(previous, quantity)
+            sold_after, reserved_after = TransactionRecord.meal_counts(status, quantity)
+            meals[drill_night_id][0] += sold_after - sold_before
+            meals[drill_night_id][1] += reserved_after - reserved_before
+
+        for drill_night_id, (sold, reserved) in meals.items():
+            DrillNight.objects.adjust_meals(drill_night_id, sold=sold, reserved=reserved)
+
+        for drill_night_id, night_pks in moved.items():
+            live.changed(drill_night_id, night_pks)
+
+    return len(pks)
+
+
+def reconcile_page(sessions: list, run: ReconciliationRun) -> None:
+    by_id = {session.id: session for session in sessions}
+
+    rows = StripeCheckoutSession.objects.filter(session_id__in=by_id).values_list(
+        "pk",
+        "session_id",
+        "payment_intent",
+        "transaction_record_id",
+        "transaction_record__status",
+        "transaction_record__drill_night_id",
+        "transaction_record__quantity",
+    )
+
+    to_paid, to_cancelled, payment_intents = {}, {}, []
+    matched = set()
+
+    for pk, session_id, payment_intent, record_id, status, drill_night_id, quantity in rows:
+        session = by_id[session_id]
+        matched.add(session_id)
+        paid = session.payment_status == "paid"
+
+        if paid and session.payment_intent and not payment_intent:
+            payment_intents.append(
+                StripeCheckoutSession(pk=pk, payment_intent=session.payment_intent)
+            )
+
+        if status == TransactionRecord.PaymentStatus.AWAITING_CHECKOUT:
+            if paid:
+                to_paid[record_id] = (drill_night_id, quantity)
+            elif session.status == "expired":
+                to_cancelled[record_id] = (drill_night_id, quantity)
+        elif status == TransactionRecord.PaymentStatus.CANCELLED and paid:
+            run.discrepancies.append(
+                discrepancy(session, "Paid for after the booking was cancelled", record_id, status)
+            )
+        elif status == TransactionRecord.PaymentStatus.PAID and not paid:
+            run.discrepancies.append(
+                discrepancy(session, "Marked as paid but Stripe has no payment", record_id, status)
+            )
+
+    for session_id in by_id.keys() - matched:
+        run.discrepancies.append(
+            discrepancy(by_id[session_id], "No transaction record for the session")
+        )
+
+    run.marked_paid += apply_transition(
+        TransactionRecord.PaymentStatus.AWAITING_CHECKOUT,
+        TransactionRecord.PaymentStatus.PAID,
+        to_paid,
+    )
+    run.marked_cancelled += apply_transition(
+        TransactionRecord.PaymentStatus.AWAITING_CHECKOUT,
+        TransactionRecord.PaymentStatus.CANCELLED,
+        to_cancelled,
+    )
+    StripeCheckoutSession.objects.bulk_update(payment_intents, ["payment_intent"])
+
+
+def cursor() -> Optional[datetime]:
+    """Where the next run starts, from the last run to finish."""
+    run = (
+        ReconciliationRun.objects.filter(finished_at__isnull=False)
+        .order_by("-started_at")
+        .first()
+    )
+    return run.next_created_gte if run else None
+
+
+def reconcile(since: Optional[datetime] = None) -> ReconciliationRun:
+    """Reconcile the sessions created since the cursor, or since the given time."""
+    run = ReconciliationRun.objects.create(created_gte=since or cursor())
+
+    params = {"limit": PAGE_SIZE}
+    if run.created_gte:
+        params["created"] = {"gte": int(run.created_gte.timestamp())}
+
+    newest = oldest_open = None
+    starting_after = None
+
+    while True:
+        page = stripe_client.list_checkout_sessions(
+            **params, **({"starting_after": starting_after} if starting_after else {})
+        )
+        run.api_calls += 1
+
+        if not page.data:
+            break
+
+        run.sessions_seen += len(page.data)
+        reconcile_page(page.data, run)
+
+        for session in page.data:
+            newest = max(newest or session.created, session.created)
+
+            if session.status == "open":
+                oldest_open = min(oldest_open or session.created, session.created)
+
+        if not page.has_more:
+            break
+
+        starting_after = page.data[-1].id
+
+    # An open session can still be paid for or expire, so the next run lists
+    # it again, otherwise it starts from the newest session seen
+    next_created = oldest_open or newest
+    run.next_created_gte = (
+        datetime.fromtimestamp(next_created, timezone.utc) if next_created else run.created_gte
+    )
+    run.finished_at = datetime.now(timezone.utc)
+    run.save()
+
+    if run.discrepancies:
+        logger.warning("Reconciliation found %d discrepancies", len(run.discrepancies))
+
+    return run
+
+
+def reconcile_job() -> None:
+    reconcile()
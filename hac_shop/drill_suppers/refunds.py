@@ -0,0 +1,165 @@
+"""
+Refunding many transactions at once, such as every booking for a cancelled
+drill night.
+
+A RefundBatch records one item per transaction, and run_batch() refunds
+the items still pending on a pool of threads while keeping under the
+DRILL_SUPPERS_REFUNDS_PER_SECOND limit on Stripe calls, which is shared by
+every batch the process runs. Each item records whether it was refunded,
+skipped as it wasn't paid for, or why it failed. Refunds are made under the same
+idempotency key as a single refund, so a batch interrupted part way
+through can be run again without refunding anyone twice.
+
+Batches and single refunds are run by the worker process, see the jobs
+module.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+import stripe
+from django.conf import settings
+from django.db import connection
+
+from . import jobs
+from .models import RefundBatch, RefundBatchItem, TransactionRecord
+
+logger = logging.getLogger(__name__)
+
+_rate_limiter: Optional["RateLimiter"] = None
+_rate_limiter_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Spaces out calls from any number of threads to a rate per second."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next_call = time.monotonic()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The rate limiter shared by every batch run in the process."""
+    global _rate_limiter
+
+    rate = settings.DRILL_SUPPERS_REFUNDS_PER_SECOND
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None or _rate_limiter.interval != 1 / rate:
+            _rate_limiter = RateLimiter(rate)
+
+        return _rate_limiter
+
+
+def create_batch(transaction_records, user=None) -> RefundBatch:
+    batch = RefundBatch.objects.create(created_by=user)
+    RefundBatchItem.objects.bulk_create(
+        RefundBatchItem(batch=batch, transaction_record_id=pk)
+        for pk in transaction_records.values_list("pk", flat=True)
+    )
+
+    return batch
+
+
+def refund_item(item: RefundBatchItem, rate_limiter: RateLimiter) -> None:
+    transaction_record = item.transaction_record
+    item.error = ""
+
+    try:
+        if transaction_record.status == TransactionRecord.PaymentStatus.REFUNDED:
+            item.status = RefundBatchItem.Status.REFUNDED
+        elif transaction_record.status != TransactionRecord.PaymentStatus.PAID:
+            item.status = RefundBatchItem.Status.SKIPPED
+            item.error = f"Not paid for, the booking is {transaction_record.get_status_display().lower()}"
+        else:
+            rate_limiter.wait()
+            transaction_record.refund(ignore_checks=True)
+            item.status = RefundBatchItem.Status.REFUNDED
+    except stripe.error.StripeError as error:
+        logger.warning("Refund of %s failed: %s", transaction_record.pk, error)
+        item.status = RefundBatchItem.Status.FAILED
+        item.error = error.user_message or str(error)
+    except Exception as error:
+        # Such as a booking without a checkout session, the rest of the batch goes on
+        logger.exception("Refund of %s failed", transaction_record.pk)
+        item.status = RefundBatchItem.Status.FAILED
+        item.error = f"{type(error).__name__}: {error}"
+    finally:
+        item.save(update_fields=["status", "error", "updated_at"])
+
+
+def refund_worker(items: queue.Queue, rate_limiter: RateLimiter) -> None:
+    try:
+        while True:
+            try:
+                item = items.get_nowait()
+            except queue.Empty:
+                return
+
+            refund_item(item, rate_limiter)
+    finally:
+        # Each thread of the pool opens its own database connection
+        connection.close()
+
+
+def run_batch(batch: RefundBatch, retry_failed: bool = False) -> dict:
+    """Refund the pending items of a batch, returning its progress."""
+    statuses = [RefundBatchItem.Status.PENDING]
+
+    if retry_failed:
+        statuses.append(RefundBatchItem.Status.FAILED)
+
+    # Everything the refunds need, loaded in one query
+    items = queue.Queue()
+    for item in batch.items.filter(status__in=statuses).select_related(
+        "transaction_record__drill_night",
+        "transaction_record__stripecheckoutsession",
+    ):
+        items.put(item)
+
+    rate_limiter = get_rate_limiter()
+    workers = min(settings.DRILL_SUPPERS_REFUND_WORKERS, items.qsize())
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for future in [
+            pool.submit(refund_worker, items, rate_limiter) for _ in range(workers)
+        ]:
+            future.result()
+
+    batch.finished_at = datetime.now(timezone.utc)
+    batch.save(update_fields=["finished_at"])
+
+    return batch.progress()
+
+
+def start_batch(batch: RefundBatch) -> None:
+    """Queue a batch to be run by a worker."""
+    jobs.enqueue(run_batch_job, str(batch.pk), priority=10)
+
+
+def run_batch_job(batch_id: str) -> None:
+    run_batch(RefundBatch.objects.get(pk=batch_id))
+
+
+def refund_job(transaction_record_id: str) -> None:
+    transaction_record = TransactionRecord.objects.select_related(
+        "drill_night", "stripecheckoutsession"
+    ).get(pk=transaction_record_id)
+
+    # The job may be run again after the refund was made
+    if transaction_record.status != TransactionRecord.PaymentStatus.REFUNDED:
+        transaction_record.refund(ignore_checks=True)
@@ -0,0 +1,130 @@
+"""
+Cancelling reservations whose buyer never completed the Stripe checkout.
+
+Expired records are claimed in batches with SELECT ... FOR UPDATE SKIP
+LOCKED, so any number of sweepers can run at once on different nodes
+without working on the same records. A claim pushes the records' expiry
+back for a few minutes and commits, so no lock is held while Stripe is
+called, and a sweeper that dies part way leaves them for the next.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import stripe
+from django.db import transaction
+
+from . import live, stripe_client
+from .models import DrillNight, TransactionRecord, utc_now
+
+logger = logging.getLogger(__name__)
+
+# How long claimed records are left to their sweeper before another takes them
+CLAIM_SECONDS = 5 * 60
+
+
+def expire_checkout_session(session_id: str) -> bool:
+    """Expire a Stripe checkout session, returning whether it had been paid for."""
+    try:
+        stripe_client.expire_checkout_session(session_id)
+    except stripe.error.InvalidRequestError:
+        # The session is no longer open, it was either paid or already expired
+        try:
+            checkout_session = stripe_client.retrieve_checkout_session(session_id)
+            return checkout_session.payment_status == "paid"
+        except stripe.error.InvalidRequestError:
+            logger.warning("Checkout session %s not found", session_id)
+
+    return False
+
+
+def claim(batch_size: int = 100) -> list:
+    """Claim a batch of expired reservations, returning their pks and session ids."""
+    now = datetime.now(timezone.utc)
+
+    with transaction.atomic():
+        expired = list(
+            TransactionRecord.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(
+                status=TransactionRecord.PaymentStatus.AWAITING_CHECKOUT,
+                reservation_expires_at__lt=now,
+            )
+            .order_by("reservation_expires_at")
+            .values_list("id", "stripecheckoutsession__session_id")[:batch_size]
+        )
+
+        TransactionRecord.objects.filter(pk__in=[pk for pk, _ in expired]).update(
+            reservation_expires_at=now + timedelta(seconds=CLAIM_SECONDS)
+        )
+
+    return expired
+
+
+def sweep_batch(batch_size: int = 100) -> int:
+    """Settle one batch of expired reservations, returning how many were swept.
+
+    Each reservation is cancelled and its meals freed, unless Stripe shows it
+    was paid for just before expiring in which case it is marked as paid.
+    """
+    expired = claim(batch_size)
+
+    if not expired:
+        return 0
+
+    paid = {
+        pk for pk, session_id in expired if session_id and expire_checkout_session(session_id)
+    }
+
+    with transaction.atomic():
+        # Records the webhook settled while Stripe was being called are left alone
+        settling = (
+            TransactionRecord.objects.select_for_update(of=("self",))
+            .filter(
+                pk__in=[pk for pk, _ in expired],
+                status=TransactionRecord.PaymentStatus.AWAITING_CHECKOUT,
+            )
+            .values_list("id", "drill_night_id", "quantity")
+        )
+
+        statuses = defaultdict(list)
+        meals = defaultdict(lambda: defaultdict(int))
+        swept = defaultdict(list)
+
+        for pk, drill_night_id, quantity in settling:
+            if pk in paid:
+                status = TransactionRecord.PaymentStatus.PAID
+            else:
+                status = TransactionRecord.PaymentStatus.CANCELLED
+
+            statuses[status].append(pk)
+            meals[drill_night_id][status] += quantity
+            swept[drill_night_id].append(pk)
+
+        for status, pks in statuses.items():
+            TransactionRecord.objects.filter(pk__in=pks).update(
+                status=status, updated_at=utc_now()
+            )
+
+        for drill_night_id, quantities in meals.items():
+            DrillNight.objects.adjust_meals(
+                drill_night_id,
+                sold=quantities[TransactionRecord.PaymentStatus.PAID],
+                reserved=-sum(quantities.values()),
+            )
+
+        for drill_night_id, pks in swept.items():
+            live.changed(drill_night_id, pks)
+
+    return len(expired)
+
+
+def sweep(batch_size: int = 100) -> int:
+    """Settle expired reservations until none are left, returning how many."""
+    total = 0
+
+    while True:
+        swept = sweep_batch(batch_size)
+        total += swept
+
+        if swept < batch_size:
+            return total
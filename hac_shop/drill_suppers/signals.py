@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import caching, inventory, live
+from .models import DrillNight, TransactionRecord
+
+# Both run once the change commits, before which a concurrent request would
+# only put the old values back in Redis and the cache
+
+
+@receiver(post_save, sender=DrillNight)
+def update_inventory(sender, instance: DrillNight, created: bool, **kwargs):
+    # Keep the meals left in Redis in step with capacity changes
+    if instance.capacity is None:
+        transaction.on_commit(lambda: inventory.forget(instance.pk))
+    else:
+        transaction.on_commit(lambda: inventory.seed(instance, overwrite=True))
+
+
+@receiver(post_save, sender=DrillNight)
+@receiver(post_delete, sender=DrillNight)
+def invalidate_sellable_nights(sender, instance: DrillNight, **kwargs):
+    transaction.on_commit(caching.invalidate_sellable_nights)
+
+
+@receiver(post_save, sender=TransactionRecord)
+def publish_booking(sender, instance: TransactionRecord, **kwargs):
+    # Status changes made with UPDATE publish themselves, see live.changed
+    live.changed(instance.drill_night_id, [instance.pk])
@@ -0,0 +1,133 @@
+"""
+A minimal asyncio client for the Stripe endpoints used by the async views.
+
+The stripe library only makes blocking requests, so checkout sessions are
+created and retrieved here over a pooled httpx.AsyncClient instead. One
+client is shared by everything running on the process's event loop, and
+the responses are read by the library's own APIRequestor, so they become
+the same StripeObjects and raise the same errors as the library's do.
+Requests share the retries and circuit breaker of stripe_client.
+"""
+import asyncio
+from typing import Optional
+
+import httpx
+import stripe
+from django.conf import settings
+from stripe.api_requestor import APIRequestor, _api_encode
+from stripe.util import convert_to_stripe_object
+
+from . import metrics, stripe_client
+
+_client: Optional["AsyncStripeClient"] = None
+
+
+class AsyncStripeClient:
+    def __init__(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.requestor = APIRequestor(client=stripe_client.get_client())
+        self.http = httpx.AsyncClient(
+            base_url=stripe.api_base,
+            limits=httpx.Limits(
+                max_connections=settings.STRIPE_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.STRIPE_ASYNC_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(
+                settings.STRIPE_READ_TIMEOUT, connect=settings.STRIPE_CONNECT_TIMEOUT
+            ),
+        )
+
+    async def request(
+        self,
+        endpoint: str,
+        method: str,
+        url: str,
+        params: Optional[dict] = None,
+        idempotency_key: Optional[str] = None,
+    ):
+        for attempt in range(settings.STRIPE_MAX_NETWORK_RETRIES + 1):
+            if await stripe_client.abreaker_open():
+                metrics.rejected(endpoint)
+                raise stripe_client.StripeUnavailableError(
+                    "Stripe is unavailable, try again shortly"
+                )
+
+            if attempt:
+                metrics.retried(endpoint)
+
+            try:
+                with metrics.track(endpoint):
+                    return await self.send(method, url, params, idempotency_key)
+            except stripe.error.StripeError as error:
+                if not stripe_client.is_retryable(error):
+                    raise
+
+                await stripe_client.arecord_failure()
+                last_error = error
+
+            if attempt < settings.STRIPE_MAX_NETWORK_RETRIES:
+                await asyncio.sleep(stripe_client.backoff(attempt))
+
+        raise stripe_client.StripeUnavailableError(str(last_error)) from last_error
+
+    async def send(
+        self,
+        method: str,
+        url: str,
+        params: Optional[dict] = None,
+        idempotency_key: Optional[str] = None,
+    ):
+        # Stripe takes the same form encoded parameters as the stripe library sends
+        encoded = str(httpx.QueryParams(list(_api_encode(params or {}))))
+
+        try:
+            if method == "GET":
+                response = await self.http.get(
+                    url, params=encoded or None, auth=(stripe.api_key, "")
+                )
+            else:
+                headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+                if idempotency_key:
+                    headers["Idempotency-Key"] = idempotency_key
+
+                response = await self.http.request(
+                    method,
+                    url,
+                    content=encoded,
+                    auth=(stripe.api_key, ""),
+                    headers=headers,
+                )
+        except httpx.TransportError as error:
+            raise stripe.error.APIConnectionError(str(error)) from error
+
+        # A body that isn't JSON raises APIError, which is retried
+        stripe_response = self.requestor.interpret_response(
+            response.content, response.status_code, response.headers
+        )
+
+        return convert_to_stripe_object(stripe_response.data, stripe.api_key)
+
+    async def create_checkout_session(self, idempotency_key: Optional[str] = None, **params):
+        return await self.request(
+            "checkout.sessions.create",
+            "POST",
+            "/v1/checkout/sessions",
+            params,
+            idempotency_key=idempotency_key,
+        )
+
+    async def retrieve_checkout_session(self, session_id: str):
+        return await self.request(
+            "checkout.sessions.retrieve", "GET", f"/v1/checkout/sessions/{session_id}"
+        )
+
+
+def get_client() -> AsyncStripeClient:
+    """Return the client for the running event loop, creating it on first use."""
+    global _client
+
+    if _client is None or _client.loop is not asyncio.get_running_loop():
+        _client = AsyncStripeClient()
+
+    return _client
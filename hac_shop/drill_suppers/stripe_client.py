@@ -0,0 +1,223 @@
+"""
+The layer every Stripe API call from the drill suppers app goes through.
+
+Each process gets one HTTP client holding a pool of keep-alive connections
+to Stripe, so calls reuse an open TLS connection instead of handshaking
+each time. Pool size, timeouts and the retry budget come from settings, and
+the client records how often a pooled connection was reused and how long
+calls took, see stats().
+
+Calls that fail for a reason worth retrying (a network error, a 409 lock
+timeout, a 429, a 5xx or a response that can't be read) are retried with bounded exponential backoff under
+the caller's idempotency key. Those failures also feed a circuit breaker
+kept in the cache, so every worker stops calling Stripe for a while once it
+keeps failing, and StripeUnavailableError is raised straight away instead.
+"""
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from stripe.http_client import RequestsClient
+
+from . import metrics
+
+BREAKER_FAILURES_KEY = "drill_suppers:stripe:failures"
+BREAKER_OPEN_KEY = "drill_suppers:stripe:open"
+
+_client: Optional["PooledRequestsClient"] = None
+
+
+class StripeUnavailableError(stripe.error.StripeError):
+    """Stripe is failing, either the circuit breaker is open or retries ran out."""
+
+
+class PooledRequestsClient(RequestsClient):
+    def __init__(self) -> None:
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.STRIPE_POOL_SIZE,
+            max_retries=0,
+        )
+
+        session = requests.Session()
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+
+        super().__init__(
+            timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+            session=session,
+        )
+
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def request(self, method, url, headers, post_data=None):
+        started = time.perf_counter()
+
+        try:
+            return super().request(method, url, headers, post_data)
+        finally:
+            elapsed = time.perf_counter() - started
+
+            with self.lock:
+                self.requests += 1
+                self.seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+    def stats(self) -> dict:
+        pools = self.adapter.poolmanager.pools
+        pools = [pools[key] for key in pools.keys()]
+
+        # urllib3 counts every request and every new connection per pool
+        connections = sum(pool.num_connections for pool in pools)
+        pooled_requests = sum(pool.num_requests for pool in pools)
+
+        return {
+            "requests": self.requests,
+            "connections_opened": connections,
+            "pool_hit_rate": (
+                1 - connections / pooled_requests if pooled_requests else None
+            ),
+            "mean_seconds": self.seconds / self.requests if self.requests else None,
+            "max_seconds": self.max_seconds,
+        }
+
+
+def get_client() -> PooledRequestsClient:
+    """Return the client for this process, installing it for the stripe library."""
+    global _client
+
+    # A forked worker must not share its parent's sockets
+    if _client is None or _client.pid != os.getpid():
+        _client = PooledRequestsClient()
+        stripe.default_http_client = _client
+        # Retries are made by call(), so the breaker sees every failure
+        stripe.max_network_retries = 0
+
+    return _client
+
+
+def stats() -> dict:
+    return get_client().stats()
+
+
+def is_retryable(error: stripe.error.StripeError) -> bool:
+    # The stripe library raises APIError for server errors and unreadable responses
+    return isinstance(error, (stripe.error.APIConnectionError, stripe.error.APIError)) or (
+        error.http_status is not None
+        and (error.http_status in (409, 429) or error.http_status >= 500)
+    )
+
+
+def breaker_open() -> bool:
+    return bool(cache.get(BREAKER_OPEN_KEY))
+
+
+def record_failure() -> None:
+    """Count a failed call, opening the breaker for every worker when there are too many."""
+    cache.add(BREAKER_FAILURES_KEY, 0, settings.STRIPE_BREAKER_WINDOW)
+
+    try:
+        failures = cache.incr(BREAKER_FAILURES_KEY)
+    except ValueError:
+        # The count expired between add and incr
+        return
+
+    if failures >= settings.STRIPE_BREAKER_FAILURES:
+        cache.set(BREAKER_OPEN_KEY, True, settings.STRIPE_BREAKER_RESET_SECONDS)
+        cache.delete(BREAKER_FAILURES_KEY)
+
+
+async def abreaker_open() -> bool:
+    # The cache blocks, so it is read in a thread, one that needn't wait for
+    # the thread the ORM runs in
+    return await sync_to_async(breaker_open, thread_sensitive=False)()
+
+
+async def arecord_failure() -> None:
+    await sync_to_async(record_failure, thread_sensitive=False)()
+
+
+def backoff(attempt: int) -> float:
+    """Seconds to wait before a retry, doubling each time with jitter."""
+    delay = min(
+        settings.STRIPE_RETRY_BACKOFF * 2 ** attempt, settings.STRIPE_RETRY_MAX_BACKOFF
+    )
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def call(endpoint: str, method, *args, **params):
+    """Call a stripe library method through the breaker, retrying retryable failures.
+
+    Each attempt is timed and counted under endpoint, see the metrics module.
+    """
+    get_client()
+
+    for attempt in range(settings.STRIPE_MAX_NETWORK_RETRIES + 1):
+        if breaker_open():
+            metrics.rejected(endpoint)
+            raise StripeUnavailableError("Stripe is unavailable, try again shortly")
+
+        if attempt:
+            metrics.retried(endpoint)
+
+        try:
+            with metrics.track(endpoint):
+                return method(*args, **params)
+        except stripe.error.StripeError as error:
+            if not is_retryable(error):
+                raise
+
+            record_failure()
+            last_error = error
+
+        if attempt < settings.STRIPE_MAX_NETWORK_RETRIES:
+            time.sleep(backoff(attempt))
+
+    raise StripeUnavailableError(str(last_error)) from last_error
+
+
+def create_checkout_session(idempotency_key: Optional[str] = None, **params):
+    return call(
+        "checkout.sessions.create",
+        stripe.checkout.Session.create,
+        idempotency_key=idempotency_key,
+        **params,
+    )
+
+
+def retrieve_checkout_session(session_id: str):
+    return call(
+        "checkout.sessions.retrieve", stripe.checkout.Session.retrieve, session_id
+    )
+
+
+def expire_checkout_session(session_id: str):
+    return call("checkout.sessions.expire", stripe.checkout.Session.expire, session_id)
+
+
+def list_checkout_sessions(**params):
+    return call("checkout.sessions.list", stripe.checkout.Session.list, **params)
+
+
+def create_price(idempotency_key: Optional[str] = None, **params):
+    return call(
+        "prices.create", stripe.Price.create, idempotency_key=idempotency_key, **params
+    )
+
+
+def create_refund(idempotency_key: Optional[str] = None, **params):
+    return call(
+        "refunds.create", stripe.Refund.create, idempotency_key=idempotency_key, **params
+    )
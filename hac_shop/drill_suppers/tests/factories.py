@@ -1,5 +1,10 @@
+import hashlib
+import hmac
+import json
 import random
-from datetime import timedelta
+import time
+import uuid
+from datetime import timedelta, timezone
 
 from factory import Factory, Faker, LazyAttribute, LazyFunction, SubFactory
 from factory.django import DjangoModelFactory
@@ -36,8 +41,26 @@ class StripeCheckoutSessionObjectFactory(Factory):
         model = MockStripeSessionObject
 
 
+def signed_stripe_event(event_type: str, data_object: dict, secret: str):
+    """Build a webhook payload and Stripe-Signature header as Stripe would send them."""
+    payload = json.dumps(
+        {
+            "id": f"evt_{uuid.uuid4().hex}",
+            "object": "event",
+            "type": event_type,
+            "data": {"object": data_object},
+        }
+    )
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+
+    return payload, f"t={timestamp},v1={signature}"
+
+
 class DrillNightFactory(DjangoModelFactory):
-    date_time = Faker("future_datetime")
+    date_time = Faker("future_datetime", end_date="+27d", tzinfo=timezone.utc)
     cut_off_time = LazyAttribute(lambda o: o.date_time - timedelta(hours=2))
 
     class Meta:
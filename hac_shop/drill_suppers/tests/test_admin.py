@@ -0,0 +1,131 @@
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from hac_shop.drill_suppers.models import DrillNight, Job, TransactionRecord
+from hac_shop.drill_suppers.tests.factories import (
+    DrillNightFactory,
+    TransactionRecordFactory,
+)
+from hac_shop.utils.pagination import EstimatedCountPaginator
+
+pytestmark = pytest.mark.django_db
+
+
+class TestDrillNightAdmin:
+    def changelist_queries(self, admin_client) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = admin_client.get(reverse("admin:drill_suppers_drillnight_changelist"))
+
+        assert response.status_code == 200
+        return len(queries)
+
+    def test_constant_queries(self, admin_client):
+
+        for drill_night in DrillNightFactory.create_batch(3):
+            TransactionRecordFactory(
+                drill_night=drill_night, status=TransactionRecord.PaymentStatus.PAID
+            )
+        few = self.changelist_queries(admin_client)
+
+        for drill_night in DrillNightFactory.create_batch(30):
+            TransactionRecordFactory(
+                drill_night=drill_night, status=TransactionRecord.PaymentStatus.PAID
+            )
+
+        assert self.changelist_queries(admin_client) == few
+
+    def test_paid_bookings(self, admin_client, drill_night):
+
+        TransactionRecordFactory.create_batch(
+            2, drill_night=drill_night, status=TransactionRecord.PaymentStatus.PAID
+        )
+        TransactionRecordFactory(
+            drill_night=drill_night, status=TransactionRecord.PaymentStatus.CANCELLED
+        )
+
+        response = admin_client.get(reverse("admin:drill_suppers_drillnight_changelist"))
+
+        (row,) = response.context["cl"].result_list
+        assert row.paid_bookings == 2
+        assert '<td class="field-paid_bookings">2</td>' in response.content.decode()
+
+    def test_date_hierarchy_years(self, admin_client):
+
+        for year in (2019, 2021):
+            DrillNightFactory(date_time=datetime(year, 6, 1, 20, tzinfo=timezone.utc))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = admin_client.get(reverse("admin:drill_suppers_drillnight_changelist"))
+
+        # Every year from the first night to the last, without a DISTINCT scan
+        for year in (2019, 2020, 2021):
+            assert f"?date_time__year={year}" in response.content.decode()
+        assert not any("DISTINCT" in query["sql"] for query in queries)
+
+
+class TestEstimatedCountPaginator:
+    def test_exact_count_without_statistics(self):
+
+        DrillNightFactory.create_batch(3)
+
+        # Only Postgres keeps an estimate of the rows in each table
+        assert EstimatedCountPaginator(DrillNight.objects.all(), 2).count == 3
+
+    def test_estimate_used_for_large_tables(self):
+
+        DrillNightFactory.create_batch(3)
+
+        with mock.patch.object(EstimatedCountPaginator, "estimated_count", return_value=50000):
+            assert EstimatedCountPaginator(DrillNight.objects.all(), 2).count == 50000
+
+        with mock.patch.object(EstimatedCountPaginator, "estimated_count", return_value=500):
+            assert EstimatedCountPaginator(DrillNight.objects.all(), 2).count == 3
+
+
+class TestTransactionRecordAdmin:
+    def test_counted_fields_read_only(self, admin_client, transaction_record):
+
+        response = admin_client.get(
+            reverse("admin:drill_suppers_transactionrecord_change", args=[transaction_record.pk])
+        )
+
+        form = response.context["adminform"].form
+        assert {"drill_night", "status", "quantity"}.isdisjoint(form.fields)
+        assert "name" in form.fields
+
+    def test_delete_gives_back_meals(self, admin_client, drill_night):
+
+        paid = TransactionRecordFactory(drill_night=drill_night, quantity=2)
+        paid.update_status(TransactionRecord.PaymentStatus.PAID)
+        awaiting = TransactionRecordFactory(drill_night=drill_night, quantity=3)
+        DrillNight.objects.update_meals(drill_night.pk, reserved=3)
+
+        admin_client.post(
+            reverse("admin:drill_suppers_transactionrecord_delete", args=[paid.pk]),
+            {"post": "yes"},
+        )
+        admin_client.post(
+            reverse("admin:drill_suppers_transactionrecord_changelist"),
+            {"action": "delete_selected", "_selected_action": [awaiting.pk], "post": "yes"},
+        )
+
+        drill_night.refresh_from_db()
+        assert not TransactionRecord.objects.exists()
+        assert (drill_night.meals_sold, drill_night.meals_reserved) == (0, 0)
+
+
+class TestJobAdmin:
+    def test_call_read_only(self, admin_client):
+
+        job = Job.objects.create(function="time.sleep", args=[0], kwargs={})
+
+        response = admin_client.get(reverse("admin:drill_suppers_job_change", args=[job.pk]))
+
+        form = response.context["adminform"].form
+        assert {"function", "args", "kwargs"}.isdisjoint(form.fields)
+        assert admin_client.get(reverse("admin:drill_suppers_job_add")).status_code == 403
@@ -0,0 +1,117 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from django.urls import reverse
+
+from hac_shop.drill_suppers.caching import (
+    get_availability,
+    get_sellable_choices,
+    sellable_timeout,
+)
+from hac_shop.drill_suppers.forms import PurchaseForm
+from hac_shop.drill_suppers.models import DrillNight
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def sellable_drill_night(drill_night: DrillNight) -> DrillNight:
+    drill_night.date_time = datetime.now(timezone.utc) + timedelta(weeks=1)
+    drill_night.cut_off_time = datetime.now(timezone.utc) + timedelta(minutes=5)
+    drill_night.save()
+    return drill_night
+
+
+class TestSellableChoices:
+    def test_cached(self, sellable_drill_night: DrillNight, django_assert_num_queries):
+
+        assert get_sellable_choices() == [
+            (sellable_drill_night.pk, str(sellable_drill_night))
+        ]
+
+        # Rendering the purchase form uses the cached choices
+        with django_assert_num_queries(0):
+            PurchaseForm().as_p()
+
+    def test_invalidated_on_save(
+        self, sellable_drill_night: DrillNight, django_capture_on_commit_callbacks
+    ):
+
+        assert len(get_sellable_choices()) == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            sellable_drill_night.on_sale = False
+            sellable_drill_night.save()
+
+            # Until the save commits, other requests would cache the old list again
+            assert len(get_sellable_choices()) == 1
+
+        assert get_sellable_choices() == []
+
+    def test_invalidated_when_sold_out(self, sellable_drill_night: DrillNight):
+
+        sellable_drill_night.capacity = 1
+        sellable_drill_night.save()
+
+        assert len(get_sellable_choices()) == 1
+
+        sellable_drill_night.reserve_meals(1)
+
+        assert get_sellable_choices() == []
+
+    def test_timeout(self, sellable_drill_night: DrillNight):
+
+        # Never kept beyond the next cut-off time
+        assert 0 < sellable_timeout([sellable_drill_night]) <= 5 * 60
+
+
+class TestAvailability:
+    def test_cached(self, sellable_drill_night: DrillNight, django_assert_num_queries):
+
+        sellable_drill_night.capacity = 10
+        sellable_drill_night.save()
+        sellable_drill_night.reserve_meals(3)
+
+        body, etag, expires = get_availability()
+        (night,) = json.loads(body)["drill_nights"]
+        assert night["id"] == sellable_drill_night.pk
+        assert night["price"] == "5.00"
+        assert night["remaining"] == 7
+
+        with django_assert_num_queries(0):
+            assert get_availability()[1] == etag
+
+    def test_timeout(self, sellable_drill_night: DrillNight, settings):
+
+        settings.DRILL_SUPPERS_AVAILABILITY_MAX_AGE = 3600
+
+        # Never kept beyond the next cut-off time
+        _, _, expires = get_availability()
+        assert expires <= sellable_drill_night.cut_off_time
+
+    def test_invalidated_on_save(
+        self, sellable_drill_night: DrillNight, django_capture_on_commit_callbacks
+    ):
+
+        etag = get_availability()[1]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            sellable_drill_night.annotation = "Gun Salute"
+            sellable_drill_night.save()
+
+        assert get_availability()[1] != etag
+
+    def test_view(self, client, sellable_drill_night: DrillNight):
+
+        url = reverse("drill_suppers:availability")
+        response = client.get(url)
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/json"
+        assert "public" in response["Cache-Control"]
+        assert 0 < int(response["Cache-Control"].rsplit("max-age=", 1)[1]) <= 60
+        assert "Cookie" not in response.get("Vary", "")
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == 304
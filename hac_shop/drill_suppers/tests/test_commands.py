@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+import stripe
+from django.core.management import CommandError, call_command
+from django.db.models import QuerySet
+
+from hac_shop.drill_suppers.management.commands.rebuild_meal_counters import Command
+from hac_shop.drill_suppers.models import DrillNight, TransactionRecord
+from hac_shop.drill_suppers.tests.factories import (
+    DrillNightFactory,
+    MockStripeSessionObject,
+    StripeCheckoutSessionFactory,
+    TransactionRecordFactory,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+class TestRebuildMealCounters:
+    def test_rebuild(self, drill_night: DrillNight):
+
+        TransactionRecordFactory(
+            drill_night=drill_night,
+            quantity=2,
+            status=TransactionRecord.PaymentStatus.PAID,
+        )
+        TransactionRecordFactory(drill_night=drill_night, quantity=3)
+        TransactionRecordFactory(
+            drill_night=drill_night,
+            quantity=4,
+            status=TransactionRecord.PaymentStatus.REFUNDED,
+        )
+
+        with pytest.raises(CommandError):
+            call_command("rebuild_meal_counters", "--check")
+
+        call_command("rebuild_meal_counters")
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_sold == 2
+        assert drill_night.meals_reserved == 3
+
+        call_command("rebuild_meal_counters", "--check")
+
+    def test_check_takes_no_locks(self, drill_night: DrillNight):
+
+        with mock.patch.object(
+            QuerySet, "select_for_update", autospec=True, side_effect=QuerySet.select_for_update
+        ) as select_for_update:
+            call_command("rebuild_meal_counters", "--check")
+
+        select_for_update.assert_not_called()
+
+    def test_locks_before_adding_up(self, drill_night: DrillNight):
+        calls = []
+
+        def select_for_update(queryset, *args, **kwargs):
+            calls.append("lock")
+            return real_select_for_update(queryset, *args, **kwargs)
+
+        def totals(command):
+            calls.append("add up")
+            return real_totals(command)
+
+        real_select_for_update = QuerySet.select_for_update
+        real_totals = Command.totals
+        with mock.patch.object(QuerySet, "select_for_update", select_for_update), mock.patch.object(
+            Command, "totals", totals
+        ):
+            call_command("rebuild_meal_counters")
+
+        assert calls == ["lock", "add up"]
+
+
+class TestSweepReservations:
+    @mock.patch("stripe.checkout.Session.retrieve")
+    @mock.patch("stripe.checkout.Session.expire")
+    def test_sweep(
+        self,
+        expire_mock,
+        retrieve_mock,
+        drill_night: DrillNight,
+        stripe_checkout_session_object: MockStripeSessionObject,
+    ):
+
+        expired = datetime.now(timezone.utc) - timedelta(minutes=1)
+
+        drill_night.reserve_meals(6)
+        abandoned = StripeCheckoutSessionFactory(
+            session_id="abandoned",
+            transaction_record__drill_night=drill_night,
+            transaction_record__quantity=2,
+            transaction_record__reservation_expires_at=expired,
+        ).transaction_record
+        paid = StripeCheckoutSessionFactory(
+            session_id="paid",
+            transaction_record__drill_night=drill_night,
+            transaction_record__quantity=3,
+            transaction_record__reservation_expires_at=expired,
+        ).transaction_record
+        held = TransactionRecordFactory(drill_night=drill_night, quantity=1)
+
+        # The paid session can no longer be expired
+        def expire(session_id):
+            if session_id == "paid":
+                raise stripe.error.InvalidRequestError("Not open", None)
+
+        expire_mock.side_effect = expire
+        stripe_checkout_session_object.payment_status = "paid"
+        retrieve_mock.return_value = stripe_checkout_session_object
+
+        call_command("sweep_reservations", "--batch-size", "1")
+
+        abandoned.refresh_from_db()
+        paid.refresh_from_db()
+        held.refresh_from_db()
+        assert abandoned.status == TransactionRecord.PaymentStatus.CANCELLED
+        assert paid.status == TransactionRecord.PaymentStatus.PAID
+        assert held.status == TransactionRecord.PaymentStatus.AWAITING_CHECKOUT
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_sold == 3
+        assert drill_night.meals_reserved == 1
+
+    @mock.patch("stripe.checkout.Session.expire")
+    def test_settled_while_expiring(self, expire_mock, drill_night: DrillNight):
+
+        drill_night.reserve_meals(2)
+        transaction_record = StripeCheckoutSessionFactory(
+            session_id="settled",
+            transaction_record__drill_night=drill_night,
+            transaction_record__quantity=2,
+            transaction_record__reservation_expires_at=datetime.now(timezone.utc)
+            - timedelta(minutes=1),
+        ).transaction_record
+
+        # The webhook arrives while the sweeper is calling Stripe
+        expire_mock.side_effect = lambda session_id: transaction_record.update_status(
+            TransactionRecord.PaymentStatus.PAID
+        )
+
+        call_command("sweep_reservations")
+
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.PAID
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_sold == 2
+        assert drill_night.meals_reserved == 0
+
+
+# The prices are saved from other threads, which only see committed rows
+@pytest.mark.django_db(transaction=True)
+class TestPrewarmStripePrices:
+    def test_prewarm(self, stripe_price_create):
+
+        on_sale = DrillNightFactory(
+            date_time=datetime.now(timezone.utc) + timedelta(weeks=1),
+            cut_off_time=datetime.now(timezone.utc) + timedelta(days=6),
+        )
+        later = DrillNightFactory(
+            date_time=datetime.now(timezone.utc) + timedelta(weeks=8),
+            cut_off_time=datetime.now(timezone.utc) + timedelta(weeks=8),
+        )
+
+        call_command("prewarm_stripe_prices", "--workers", "1")
+
+        on_sale.refresh_from_db()
+        later.refresh_from_db()
+        assert on_sale.stripe_price_id == "price_test"
+        assert later.stripe_price_id == ""
+
+        # Nothing left to do the second time
+        call_command("prewarm_stripe_prices")
+        stripe_price_create.assert_called_once()
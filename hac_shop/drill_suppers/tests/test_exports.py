@@ -0,0 +1,132 @@
+import csv
+import io
+import zipfile
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+
+import pytest
+from django.urls import reverse
+
+from hac_shop.drill_suppers import exports
+from hac_shop.drill_suppers.tests.factories import (
+    DrillNightFactory,
+    TransactionRecordFactory,
+)
+
+pytestmark = pytest.mark.django_db
+
+SHEET = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def read_csv(response) -> list:
+    content = b"".join(response.streaming_content).decode("utf-8-sig")
+    return list(csv.reader(io.StringIO(content)))
+
+
+def read_xlsx(response) -> list:
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+    sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+
+    return [
+        [
+            cell.findtext(f"{SHEET}is/{SHEET}t") or cell.findtext(f"{SHEET}v")
+            for cell in row
+        ]
+        for row in sheet.iter(f"{SHEET}row")
+    ]
+
+
+@pytest.fixture
+def drill_nights():
+    march = DrillNightFactory(date_time=datetime(2022, 3, 1, 19, tzinfo=timezone.utc))
+    april = DrillNightFactory(date_time=datetime(2022, 4, 5, 18, tzinfo=timezone.utc))
+
+    TransactionRecordFactory(drill_night=march, name="Bob", quantity=2)
+    TransactionRecordFactory(drill_night=march, name="=HYPERLINK()", quantity=1)
+    TransactionRecordFactory(drill_night=april, name="Alice", quantity=3)
+
+    return march, april
+
+
+class TestExports:
+    def test_csv(self, drill_nights):
+
+        rows = read_csv(exports.response(exports.bookings(), "csv", "bookings"))
+
+        assert rows[0] == exports.HEADER
+        assert [row[2] for row in rows[1:]] == ["'=HYPERLINK()", "Bob", "Alice"]
+        # Drill nights are shown in UK time
+        assert rows[3][0] == "2022-04-05 19:00"
+        assert rows[3][4] == "3"
+        assert rows[3][5] == "Awaiting Checkout"
+
+    def test_xlsx(self, drill_nights):
+
+        rows = read_xlsx(exports.response(exports.bookings(), "xlsx", "bookings"))
+
+        assert rows[0] == exports.HEADER
+        assert [row[2] for row in rows[1:]] == ["=HYPERLINK()", "Bob", "Alice"]
+        assert rows[3][4] == "3"
+
+    def test_many_chunks(self, drill_nights, monkeypatch):
+
+        monkeypatch.setattr(exports, "CHUNK_SIZE", 2)
+        march, _ = drill_nights
+        TransactionRecordFactory.create_batch(5, drill_night=march)
+
+        response = exports.response(exports.bookings(), "xlsx", "bookings")
+        assert len(read_xlsx(response)) == 9
+
+    def test_date_range(self, drill_nights):
+
+        rows = list(
+            exports.bookings(start=datetime(2022, 4, 1).date(), end=datetime(2022, 4, 30).date())
+        )
+
+        assert [row[2] for row in rows] == ["Alice"]
+
+
+class TestExportViews:
+    def test_drill_night_export(self, admin_client, drill_nights):
+
+        march, _ = drill_nights
+        response = admin_client.get(
+            reverse("drill_suppers:drill_night_export", args=[march.pk]), {"format": "xlsx"}
+        )
+
+        assert response.status_code == 200
+        assert response["Content-Disposition"] == 'attachment; filename="bookings-2022-03-01.xlsx"'
+        assert len(read_xlsx(response)) == 3
+
+    def test_bookings_export(self, admin_client, drill_nights):
+
+        url = reverse("drill_suppers:bookings_export")
+
+        assert admin_client.get(url).status_code == 200
+
+        response = admin_client.get(
+            url, {"start": "2022-03-01", "end": "2022-03-31", "format": "csv"}
+        )
+        assert response.status_code == 200
+        assert len(read_csv(response)) == 3
+
+        response = admin_client.get(
+            url, {"start": "2022-03-31", "end": "2022-03-01", "format": "csv"}
+        )
+        assert response.status_code == 400
+
+    def test_staff_only(self, client, drill_nights):
+
+        response = client.get(reverse("drill_suppers:bookings_export"))
+
+        assert response.status_code == 302
+
+    def test_admin_action(self, admin_client, drill_nights):
+
+        _, april = drill_nights
+        response = admin_client.post(
+            reverse("admin:drill_suppers_drillnight_changelist"),
+            {"action": "export_csv", "_selected_action": [april.pk]},
+        )
+
+        assert [row[2] for row in read_csv(response)[1:]] == ["Alice"]
@@ -0,0 +1,220 @@
+from unittest import mock
+
+import pytest
+from django.core.management import CommandError, call_command
+from redis.exceptions import RedisError
+
+from hac_shop.drill_suppers import inventory
+from hac_shop.drill_suppers.forms import PurchaseForm
+from hac_shop.drill_suppers.models import (
+    DrillNight,
+    DrillNightSoldOutError,
+    DrillNightUnavailableError,
+    TransactionRecord,
+)
+from hac_shop.drill_suppers.tests.factories import TransactionRecordFactory
+
+fakeredis = pytest.importorskip("fakeredis")
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def redis():
+    client = fakeredis.FakeRedis()
+
+    with mock.patch("hac_shop.drill_suppers.inventory.get_client", return_value=client):
+        yield client
+
+
+class TestInventory:
+    def test_reserve(self, redis, drill_night: DrillNight):
+
+        drill_night.capacity = 5
+        drill_night.save()
+
+        assert inventory.reserve(drill_night, 3) == 2
+        assert inventory.reserve(drill_night, 3) == -1
+        assert inventory.reserve(drill_night, 2) == 0
+
+        # The database is only updated when the changes are written behind
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 0
+
+        assert inventory.flush() == 1
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 5
+
+        # Nothing is applied twice
+        assert inventory.flush() == 0
+
+    def test_reserve_meals(self, redis, drill_night: DrillNight):
+
+        drill_night.capacity = 2
+        drill_night.save()
+
+        drill_night.reserve_meals(2)
+
+        drill_night.refresh_from_db()
+        assert drill_night.on_sale == False
+
+        with pytest.raises(DrillNightSoldOutError):
+            drill_night.reserve_meals(1)
+
+    def test_update_status(self, redis, drill_night: DrillNight, django_capture_on_commit_callbacks):
+
+        drill_night.capacity = 2
+        drill_night.save()
+
+        drill_night.reserve_meals(2)
+        transaction_record = TransactionRecordFactory(drill_night=drill_night, quantity=2)
+
+        # Freeing the meals puts them back on sale once the change commits
+        with django_capture_on_commit_callbacks(execute=True):
+            transaction_record.update_status(TransactionRecord.PaymentStatus.CANCELLED)
+
+        drill_night.refresh_from_db()
+        assert drill_night.on_sale == True
+        assert inventory.reserve(drill_night, 2) == 0
+
+        inventory.flush()
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 2
+
+    def test_flush_rolled_back(self, redis, drill_night: DrillNight):
+
+        drill_night.capacity = 5
+        drill_night.save()
+
+        inventory.reserve(drill_night, 3)
+
+        with mock.patch.object(DrillNight.objects, "update_meals", side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                inventory.flush()
+
+        # The deltas are kept for the next flush, and a seed still counts them
+        assert inventory.seed(drill_night, overwrite=True) == 2
+        assert inventory.flush() == 1
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 3
+
+    def test_flush_keeps_later_deltas(self, redis, drill_night: DrillNight, django_capture_on_commit_callbacks):
+
+        drill_night.capacity = 5
+        drill_night.save()
+
+        inventory.reserve(drill_night, 3)
+
+        # Reserved while the write is waiting to commit
+        with django_capture_on_commit_callbacks(execute=True):
+            assert inventory.flush() == 1
+            inventory.reserve(drill_night, 1)
+
+        assert inventory.flush() == 1
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 4
+
+    def test_purchase_rolled_back(self, redis, drill_night: DrillNight, django_capture_on_commit_callbacks):
+
+        drill_night.capacity = 5
+        drill_night.save()
+
+        form = PurchaseForm(
+            {
+                "name": "Member",
+                "email": "member@example.com",
+                "drill_night": drill_night.pk,
+                "quantity": 3,
+            }
+        )
+        assert form.is_valid()
+
+        with django_capture_on_commit_callbacks(execute=True), mock.patch(
+            "hac_shop.drill_suppers.forms.StripeCheckoutSession.objects.create",
+            side_effect=RuntimeError,
+        ):
+            with pytest.raises(RuntimeError):
+                form.save()
+
+        # The meals taken in Redis were given back
+        assert inventory.reserve(drill_night, 5) == 0
+
+    def test_seed_corrects_drift(self, redis, drill_night: DrillNight):
+
+        drill_night.capacity = 10
+        drill_night.save()
+
+        inventory.reserve(drill_night, 4)
+        redis.set(inventory.remaining_key(drill_night.pk), 1)
+
+        # Pending reservations are taken off the database counters
+        assert inventory.seed(drill_night, overwrite=True) == 6
+
+    def test_rebuild_leaves_pending(self, redis, drill_night: DrillNight):
+
+        drill_night.capacity = 5
+        drill_night.save()
+
+        drill_night.reserve_meals(2)
+        TransactionRecordFactory(drill_night=drill_night, quantity=2)
+
+        # The reservation is in the bookings but is written behind by the flush
+        call_command("rebuild_meal_counters", "--check")
+        inventory.flush()
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 2
+
+    def test_reserve_meals_counts_pending(self, redis, drill_night: DrillNight):
+
+        drill_night.capacity = 3
+        drill_night.save()
+
+        inventory.reserve(drill_night, 2)
+
+        # Falling back to the database while the reservation is still in Redis
+        with mock.patch.object(inventory, "reserve", return_value=None):
+            with pytest.raises(DrillNightSoldOutError):
+                drill_night.reserve_meals(2)
+
+            drill_night.reserve_meals(1)
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 1
+        assert drill_night.on_sale == False
+
+    def test_pending_unknown(self, drill_night: DrillNight):
+
+        drill_night.capacity = 2
+        drill_night.save()
+
+        client = mock.Mock()
+        client.register_script.side_effect = RedisError
+        client.pipeline.return_value.execute.side_effect = RedisError
+
+        with mock.patch("hac_shop.drill_suppers.inventory.get_client", return_value=client):
+            with pytest.raises(DrillNightUnavailableError):
+                drill_night.reserve_meals(1)
+
+            with pytest.raises(CommandError):
+                call_command("rebuild_meal_counters")
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 0
+
+    def test_redis_unavailable(self, drill_night: DrillNight):
+
+        drill_night.capacity = 2
+        drill_night.save()
+
+        assert inventory.reserve(drill_night, 1) is None
+
+        # Falls back to the database counters
+        drill_night.reserve_meals(2)
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 2
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+
+from hac_shop.drill_suppers import jobs
+from hac_shop.drill_suppers.models import Job, TransactionRecord
+from hac_shop.drill_suppers.tests.factories import StripeCheckoutSessionFactory
+
+pytestmark = pytest.mark.django_db
+
+calls = []
+
+
+def record_call(value, *, suffix=""):
+    calls.append(f"{value}{suffix}")
+
+
+def fail():
+    raise RuntimeError("Stripe is down")
+
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    calls.clear()
+
+
+class TestJobs:
+    def test_work(self):
+
+        jobs.enqueue(record_call, "low")
+        jobs.enqueue(record_call, "high", priority=10, suffix="!")
+        later = jobs.enqueue(
+            record_call, "later", run_at=datetime.now(timezone.utc) + timedelta(hours=1)
+        )
+
+        assert jobs.work(burst=True) == 2
+
+        # The most important first, and nothing before it is due
+        assert calls == ["high!", "low"]
+        assert Job.objects.filter(status=Job.Status.DONE).count() == 2
+        later.refresh_from_db()
+        assert later.status == Job.Status.QUEUED
+
+    def test_retry_then_dead(self, settings):
+
+        settings.DRILL_SUPPERS_JOB_BACKOFF = 10
+        job = jobs.enqueue(fail, max_attempts=2)
+
+        assert jobs.work(burst=True) == 1
+
+        job.refresh_from_db()
+        assert job.status == Job.Status.QUEUED
+        assert job.attempts == 1
+        assert job.last_error == "RuntimeError: Stripe is down"
+        assert job.run_at > datetime.now(timezone.utc) + timedelta(seconds=5)
+
+        # Not due again until the backoff has passed
+        assert jobs.work(burst=True) == 0
+
+        Job.objects.filter(pk=job.pk).update(run_at=datetime.now(timezone.utc))
+        assert jobs.work(burst=True) == 1
+
+        job.refresh_from_db()
+        assert job.status == Job.Status.DEAD
+        assert job.attempts == 2
+
+    def test_requeue_stale(self, settings):
+
+        job = jobs.enqueue(record_call, "again")
+        jobs.claim("crashed-worker")
+
+        assert jobs.requeue_stale() == 0
+
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=datetime.now(timezone.utc)
+            - timedelta(seconds=settings.DRILL_SUPPERS_JOB_LOCK_TIMEOUT + 1)
+        )
+        assert jobs.requeue_stale() == 1
+
+        assert jobs.work(burst=True) == 1
+        assert calls == ["again"]
+
+    @mock.patch("stripe.Refund.create")
+    def test_refund_later(self, refund_create_mock):
+
+        checkout_session = StripeCheckoutSessionFactory(
+            payment_intent="pi_test",
+            transaction_record__status=TransactionRecord.PaymentStatus.PAID,
+        )
+        transaction_record = checkout_session.transaction_record
+
+        transaction_record.refund_later(ignore_checks=True)
+        refund_create_mock.assert_not_called()
+
+        jobs.work(burst=True)
+
+        refund_create_mock.assert_called_once()
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.REFUNDED
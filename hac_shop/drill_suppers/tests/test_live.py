@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+
+from hac_shop.drill_suppers import live
+from hac_shop.drill_suppers.models import DrillNight, TransactionRecord
+from hac_shop.drill_suppers.tests.factories import TransactionRecordFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def clear_streams():
+    live._local_streams.clear()
+    live._local_watched.clear()
+
+
+class TestLive:
+    def test_status_change_published(
+        self, drill_night: DrillNight, django_capture_on_commit_callbacks
+    ):
+
+        # Shown on an open report
+        live.watch(drill_night.pk, 60)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            record = TransactionRecordFactory(drill_night=drill_night)
+        after = live.latest_id(drill_night.pk)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            record.update_status(TransactionRecord.PaymentStatus.PAID)
+
+        latest, (update,) = live.read(drill_night.pk, after)
+        assert latest == live.latest_id(drill_night.pk)
+        assert update["records"] == [
+            {
+                "id": str(record.pk),
+                "name": record.name,
+                "email": record.email,
+                "quantity": record.quantity,
+                "status": "paid",
+                "dietary_notes": record.dietary_notes,
+            }
+        ]
+        assert update["totals"]["paid"] == record.quantity
+        assert update["totals"]["awaiting_checkout"] == 0
+
+    def test_not_published_before_commit(self, drill_night: DrillNight):
+
+        live.watch(drill_night.pk, 60)
+        TransactionRecordFactory(drill_night=drill_night)
+
+        assert live.read(drill_night.pk, "0-0") == ("0-0", [])
+
+    def test_unwatched_not_published(
+        self, drill_night: DrillNight, django_assert_num_queries, django_capture_on_commit_callbacks
+    ):
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            TransactionRecordFactory(drill_night=drill_night)
+
+        # No report is open, so the bookings aren't even loaded
+        with django_assert_num_queries(0):
+            for callback in callbacks:
+                callback()
+
+        assert live.read(drill_night.pk, "0-0") == ("0-0", [])
+        assert live.latest_id(drill_night.pk) == "0-0"
+
+    def test_waiter_woken(self):
+
+        def send_later():
+            time.sleep(0.1)
+            live.send(1, {"records": [], "totals": {}})
+
+        threading.Thread(target=send_later).start()
+        started = time.monotonic()
+        latest, updates = async_to_sync(live.changes)(1, "0-0", timeout=5)
+
+        assert time.monotonic() - started < 2
+        assert updates == [{"records": [], "totals": {}}]
+        assert latest == live.latest_id(1)
+
+    def test_wait_times_out(self):
+
+        assert async_to_sync(live.changes)(1, "0-0", timeout=0.05) == ("0-0", [])
+
+
+class TestDrillNightLiveView:
+    def test_updates(self, admin_client, drill_night: DrillNight):
+
+        live.send(drill_night.pk, {"records": [], "totals": {"paid": 2}})
+        response = admin_client.get(
+            reverse("drill_suppers:drill_night_live", args=[drill_night.pk]),
+            {"after": "0-0"},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "after": live.latest_id(drill_night.pk),
+            "updates": [{"records": [], "totals": {"paid": 2}}],
+        }
+
+    def test_staff_only(self, client, drill_night: DrillNight):
+
+        response = client.get(reverse("drill_suppers:drill_night_live", args=[drill_night.pk]))
+
+        assert response.status_code == 403
+
+    def test_invalid_after(self, admin_client, drill_night: DrillNight):
+
+        response = admin_client.get(
+            reverse("drill_suppers:drill_night_live", args=[drill_night.pk]),
+            {"after": "$"},
+        )
+
+        assert response.status_code == 400
@@ -0,0 +1,103 @@
+from unittest import mock
+
+import pytest
+import stripe
+from django.core.cache import cache
+from django.urls import reverse
+
+from hac_shop.drill_suppers import metrics, stripe_client
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class TestMetrics:
+    @mock.patch("stripe.checkout.Session.create")
+    def test_call_recorded(self, create_mock, settings):
+
+        settings.STRIPE_RETRY_BACKOFF = 0
+        create_mock.side_effect = [stripe.error.APIConnectionError("reset"), "cs_test"]
+
+        stripe_client.create_checkout_session(mode="payment")
+
+        recorded = metrics.read()
+        assert recorded["count|checkout.sessions.create"] == 2
+        assert recorded["errors|checkout.sessions.create|APIConnectionError"] == 1
+        assert recorded["retries|checkout.sessions.create"] == 1
+        assert recorded["in_flight|checkout.sessions.create"] == 0
+        assert recorded["bucket|checkout.sessions.create|0.05"] == 2
+
+    def test_breaker_rejection_recorded(self):
+
+        cache.set(stripe_client.BREAKER_OPEN_KEY, True)
+
+        with pytest.raises(stripe_client.StripeUnavailableError):
+            stripe_client.retrieve_checkout_session("cs_test")
+
+        assert metrics.read()["rejected|checkout.sessions.retrieve"] == 1
+
+    def test_recorded_without_waiting_on_redis(self):
+
+        client = mock.Mock()
+
+        with mock.patch.object(metrics, "get_client", return_value=client), mock.patch.object(
+            metrics, "start_flusher"
+        ):
+            for _ in range(3):
+                with metrics.track("refunds.create"):
+                    pass
+
+            client.pipeline.assert_not_called()
+
+            # Written together by the flusher thread
+            metrics.flush()
+
+        client.pipeline.assert_called_once()
+        client.pipeline.return_value.execute.assert_called_once()
+
+    def test_render(self):
+
+        with metrics.track("refunds.create"):
+            pass
+
+        with pytest.raises(ValueError), metrics.track("refunds.create"):
+            raise ValueError
+
+        text = metrics.render()
+        assert 'stripe_request_duration_seconds_bucket{endpoint="refunds.create",le="0.05"} 2' in text
+        assert 'stripe_request_duration_seconds_bucket{endpoint="refunds.create",le="+Inf"} 2' in text
+        assert 'stripe_request_duration_seconds_count{endpoint="refunds.create"} 2' in text
+        assert 'stripe_request_errors_total{endpoint="refunds.create",error="ValueError"} 1' in text
+        assert 'stripe_requests_in_flight{endpoint="refunds.create"} 0' in text
+
+
+class TestStripeMetricsView:
+    def test_staff(self, admin_client):
+
+        response = admin_client.get(reverse("drill_suppers:stripe_metrics"))
+
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+
+    def test_token(self, client, settings):
+
+        settings.DRILL_SUPPERS_METRICS_TOKEN = "secret"
+        url = reverse("drill_suppers:stripe_metrics")
+
+        assert client.get(url).status_code == 401
+        assert client.get(url, HTTP_AUTHORIZATION="Bearer wrong").status_code == 401
+        assert client.get(url, HTTP_AUTHORIZATION="Bearer secret").status_code == 200
+
+    def test_no_token_configured(self, client):
+
+        response = client.get(
+            reverse("drill_suppers:stripe_metrics"), HTTP_AUTHORIZATION="Bearer "
+        )
+
+        assert response.status_code == 401
@@ -2,14 +2,20 @@ from datetime import datetime, timedelta, timezone
 from unittest import mock
 
 import pytest
+import stripe
+from stripe.util import convert_to_stripe_object
 
 from hac_shop.drill_suppers.models import (
     AfterDrillNightCutOffError,
     DrillNight,
+    DrillNightSoldOutError,
     StripeCheckoutSession,
     TransactionRecord,
 )
-from hac_shop.drill_suppers.tests.factories import MockStripeSessionObject
+from hac_shop.drill_suppers.tests.factories import (
+    MockStripeSessionObject,
+    TransactionRecordFactory,
+)
 
 pytestmark = pytest.mark.django_db
 
@@ -69,6 +75,69 @@ class TestDrillNight:
 
         assert DrillNight.sellable.filter(pk=drill_night.pk).exists() == True
 
+    def test_reserve_meals(self, drill_night: DrillNight):
+
+        # Nights without a capacity are never sold out
+        drill_night.reserve_meals(100)
+
+        drill_night.capacity = 105
+        drill_night.save()
+
+        with pytest.raises(DrillNightSoldOutError):
+            drill_night.reserve_meals(6)
+
+        drill_night.reserve_meals(4)
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 104
+        assert drill_night.on_sale == True
+
+        # Taking the last meal closes the night
+        drill_night.reserve_meals(1)
+
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 105
+        assert drill_night.on_sale == False
+
+    def test_stripe_price(self, drill_night: DrillNight, stripe_price_create):
+
+        assert drill_night.get_stripe_price_id() == "price_test"
+        assert drill_night.get_stripe_price_id() == "price_test"
+        stripe_price_create.assert_called_once()
+        assert stripe_price_create.call_args.kwargs["unit_amount"] == int(
+            drill_night.price * 100
+        )
+
+        # Kept when other fields change
+        drill_night = DrillNight.objects.get(pk=drill_night.pk)
+        drill_night.capacity = 50
+        drill_night.save()
+        assert DrillNight.objects.get(pk=drill_night.pk).stripe_price_id == "price_test"
+
+        # A new price is made when the one shown at checkout changes
+        drill_night.annotation = "Gun Salute"
+        drill_night.save()
+        drill_night = DrillNight.objects.get(pk=drill_night.pk)
+        assert drill_night.stripe_price_id == ""
+
+        stripe_price_create.return_value.id = "price_gun_salute"
+        assert drill_night.get_stripe_price_id() == "price_gun_salute"
+        assert stripe_price_create.call_args.kwargs["product_data"]["name"].startswith(
+            "Gun Salute on"
+        )
+
+    def test_stripe_price_changed_meanwhile(self, drill_night: DrillNight, stripe_price_create):
+
+        stale = DrillNight.objects.get(pk=drill_night.pk)
+
+        # The price shown at checkout changes while the stale copy makes its price
+        drill_night = DrillNight.objects.get(pk=drill_night.pk)
+        drill_night.price += 1
+        drill_night.save()
+
+        assert stale.get_stripe_price_id() == "price_test"
+        assert DrillNight.objects.get(pk=drill_night.pk).stripe_price_id == ""
+
 
 class TestTransactionRecord:
     def test_user_get_absolute_url(self, transaction_record: TransactionRecord):
@@ -76,6 +145,36 @@ class TestTransactionRecord:
             transaction_record.get_absolute_url() == f"/supper/{transaction_record.id}/"
         )
 
+    def test_update_status(self, drill_night: DrillNight):
+
+        drill_night.capacity = 4
+        drill_night.cut_off_time = datetime.now(timezone.utc) + timedelta(hours=1)
+        drill_night.save()
+
+        drill_night.reserve_meals(2)
+        drill_night.reserve_meals(2)
+        first = TransactionRecordFactory(drill_night=drill_night, quantity=2)
+        second = TransactionRecordFactory(drill_night=drill_night, quantity=2)
+
+        assert first.update_status(TransactionRecord.PaymentStatus.PAID) == True
+
+        drill_night.refresh_from_db()
+        assert (drill_night.meals_sold, drill_night.meals_reserved) == (2, 2)
+        assert drill_night.on_sale == False
+
+        # A stale copy of the record can't apply the same transition twice
+        stale = TransactionRecord.objects.get(pk=first.pk)
+        stale.status = TransactionRecord.PaymentStatus.AWAITING_CHECKOUT
+        assert stale.update_status(TransactionRecord.PaymentStatus.PAID) == False
+        assert stale.status == TransactionRecord.PaymentStatus.PAID
+
+        # Freeing meals re-opens a night that was closed because it was full
+        assert second.update_status(TransactionRecord.PaymentStatus.CANCELLED) == True
+
+        drill_night.refresh_from_db()
+        assert (drill_night.meals_sold, drill_night.meals_reserved) == (2, 0)
+        assert drill_night.on_sale == True
+
     @mock.patch("stripe.Refund.create")
     @mock.patch("stripe.checkout.Session.retrieve")
     def test_refundd(
@@ -137,6 +236,48 @@ class TestStripeCheckoutSession:
         assert stripe_checkout_session.session_id is original_session_id
         assert stripe_checkout_session.checkout_url is original_checkout_url
 
+    @mock.patch("stripe.checkout.Session.list")
+    @mock.patch("stripe.checkout.Session.create")
+    def test_generate_session_made_earlier(
+        self,
+        create_mock,
+        list_mock,
+        stripe_checkout_session: StripeCheckoutSession,
+    ):
+
+        # The first attempt's response was lost, and the retry sends other params
+        create_mock.side_effect = stripe.error.IdempotencyError("Keys for idempotent requests...")
+        reference = str(stripe_checkout_session.transaction_record.id)
+        list_mock.side_effect = [
+            convert_to_stripe_object(
+                {
+                    "object": "list",
+                    "has_more": True,
+                    "data": [{"id": "cs_other", "object": "checkout.session", "client_reference_id": "other"}],
+                }
+            ),
+            convert_to_stripe_object(
+                {
+                    "object": "list",
+                    "has_more": False,
+                    "data": [
+                        {
+                            "id": "cs_earlier",
+                            "object": "checkout.session",
+                            "client_reference_id": reference,
+                            "url": "https://checkout.stripe.com/earlier",
+                        }
+                    ],
+                }
+            ),
+        ]
+
+        stripe_checkout_session.generate_session()
+
+        assert stripe_checkout_session.session_id == "cs_earlier"
+        assert stripe_checkout_session.checkout_url == "https://checkout.stripe.com/earlier"
+        assert list_mock.call_args.kwargs["starting_after"] == "cs_other"
+
     @mock.patch("stripe.checkout.Session.retrieve")
     def test_verify_if_paid(
         self,
@@ -0,0 +1,100 @@
+import httpx
+import pytest
+import stripe
+
+from hac_shop.drill_suppers import reconciliation, stripe_client
+from hac_shop.drill_suppers.models import DrillNight, TransactionRecord
+from hac_shop.drill_suppers.tests.factories import StripeCheckoutSessionFactory
+from scripts import fake_stripe_server
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def fake_stripe(settings, monkeypatch) -> str:
+    url = fake_stripe_server.start()
+    monkeypatch.setattr(stripe, "api_base", url)
+    monkeypatch.setattr(stripe_client, "_client", None)
+    monkeypatch.setattr(stripe, "default_http_client", None)
+    return url
+
+
+def checkout(drill_night: DrillNight, status=TransactionRecord.PaymentStatus.AWAITING_CHECKOUT):
+    checkout_session = StripeCheckoutSessionFactory(
+        transaction_record__drill_night=drill_night,
+        transaction_record__status=status,
+        transaction_record__quantity=1,
+    )
+    stripe_session = stripe_client.create_checkout_session(mode="payment")
+    checkout_session.session_id = stripe_session.id
+    checkout_session.save()
+    return checkout_session
+
+
+class TestReconcile:
+    def test_reconcile(self, fake_stripe: str, drill_night: DrillNight):
+
+        paid = checkout(drill_night)
+        expired = checkout(drill_night)
+        still_open = checkout(drill_night)
+        cancelled_then_paid = checkout(
+            drill_night, status=TransactionRecord.PaymentStatus.CANCELLED
+        )
+        unknown = stripe_client.create_checkout_session(mode="payment")
+        DrillNight.objects.filter(pk=drill_night.pk).update(meals_reserved=3)
+
+        for checkout_session in [paid, cancelled_then_paid]:
+            httpx.post(f"{fake_stripe}/_fake/checkout/sessions/{checkout_session.session_id}/pay")
+        stripe_client.expire_checkout_session(expired.session_id)
+
+        run = reconciliation.reconcile()
+
+        assert run.sessions_seen == 5
+        assert run.api_calls == 1
+        assert (run.marked_paid, run.marked_cancelled) == (1, 1)
+        assert {
+            (discrepancy["session_id"], discrepancy["problem"])
+            for discrepancy in run.discrepancies
+        } == {
+            (cancelled_then_paid.session_id, "Paid for after the booking was cancelled"),
+            (unknown.id, "No transaction record for the session"),
+        }
+
+        for checkout_session, status in [
+            (paid, TransactionRecord.PaymentStatus.PAID),
+            (expired, TransactionRecord.PaymentStatus.CANCELLED),
+            (still_open, TransactionRecord.PaymentStatus.AWAITING_CHECKOUT),
+        ]:
+            checkout_session.refresh_from_db()
+            assert checkout_session.transaction_record.status == status
+
+        assert paid.payment_intent
+        drill_night.refresh_from_db()
+        assert (drill_night.meals_sold, drill_night.meals_reserved) == (1, 1)
+
+        # The next run starts from the session still open, and settles it
+        assert run.next_created_gte is not None
+        assert reconciliation.cursor() == run.next_created_gte
+
+        httpx.post(f"{fake_stripe}/_fake/checkout/sessions/{still_open.session_id}/pay")
+        run = reconciliation.reconcile()
+
+        assert run.marked_paid == 1
+        still_open.transaction_record.refresh_from_db()
+        assert still_open.transaction_record.status == TransactionRecord.PaymentStatus.PAID
+
+        # Nothing is settled twice
+        run = reconciliation.reconcile()
+        assert (run.marked_paid, run.marked_cancelled) == (0, 0)
+
+    def test_pages(self, fake_stripe: str, drill_night: DrillNight, monkeypatch):
+
+        monkeypatch.setattr(reconciliation, "PAGE_SIZE", 2)
+
+        for _ in range(5):
+            checkout(drill_night)
+
+        run = reconciliation.reconcile()
+
+        assert run.sessions_seen == 5
+        assert run.api_calls == 3
@@ -0,0 +1,146 @@
+from unittest import mock
+
+import pytest
+import stripe
+from django.urls import reverse
+
+from hac_shop.drill_suppers import refunds
+from hac_shop.drill_suppers.models import (
+    Job,
+    RefundBatch,
+    RefundBatchItem,
+    TransactionRecord,
+)
+from hac_shop.drill_suppers.tests.factories import (
+    StripeCheckoutSessionFactory,
+    TransactionRecordFactory,
+)
+
+# The refunds are made from other threads, which only see committed rows
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def paid_transaction_records(count: int):
+    sessions = StripeCheckoutSessionFactory.create_batch(
+        count, transaction_record__status=TransactionRecord.PaymentStatus.PAID
+    )
+
+    for session in sessions:
+        session.payment_intent = f"pi_{session.transaction_record.pk}"
+        session.save()
+
+    return TransactionRecord.objects.filter(
+        pk__in=[session.transaction_record.pk for session in sessions]
+    )
+
+
+class TestRefundBatch:
+    @mock.patch("stripe.Refund.create")
+    def test_run_batch(self, refund_create_mock, settings):
+
+        settings.STRIPE_MAX_NETWORK_RETRIES = 0
+        # SQLite locks its tables against writes from a second thread
+        settings.DRILL_SUPPERS_REFUND_WORKERS = 1
+        settings.DRILL_SUPPERS_REFUNDS_PER_SECOND = 1000
+
+        transaction_records = paid_transaction_records(6)
+        failing = transaction_records[0]
+
+        def create_refund(payment_intent, idempotency_key):
+            if payment_intent == f"pi_{failing.pk}":
+                raise stripe.error.InvalidRequestError("Charge already refunded", None)
+
+        refund_create_mock.side_effect = create_refund
+
+        batch = refunds.create_batch(transaction_records)
+        assert refunds.run_batch(batch) == {"pending": 0, "refunded": 5, "failed": 1, "skipped": 0}
+        assert batch.finished_at is not None
+
+        assert (
+            TransactionRecord.objects.filter(
+                status=TransactionRecord.PaymentStatus.REFUNDED
+            ).count()
+            == 5
+        )
+        failed_item = batch.items.get(status=RefundBatchItem.Status.FAILED)
+        assert failed_item.transaction_record == failing
+        assert failed_item.error == "Charge already refunded"
+
+        # Running it again only retries the failure, under the same key
+        refund_create_mock.reset_mock()
+        refund_create_mock.side_effect = None
+
+        assert refunds.run_batch(batch) == {"pending": 0, "refunded": 5, "failed": 1, "skipped": 0}
+        refund_create_mock.assert_not_called()
+
+        assert refunds.run_batch(batch, retry_failed=True)["refunded"] == 6
+        refund_create_mock.assert_called_once_with(
+            payment_intent=f"pi_{failing.pk}", idempotency_key=f"refund-{failing.pk}"
+        )
+
+    @mock.patch("stripe.Refund.create")
+    def test_unrefundable_items(self, refund_create_mock, settings):
+
+        settings.DRILL_SUPPERS_REFUND_WORKERS = 1
+        settings.DRILL_SUPPERS_REFUNDS_PER_SECOND = 1000
+
+        cancelled = StripeCheckoutSessionFactory(
+            transaction_record__status=TransactionRecord.PaymentStatus.CANCELLED
+        ).transaction_record
+        # Paid for, but its checkout session is missing
+        no_session = TransactionRecordFactory(status=TransactionRecord.PaymentStatus.PAID)
+
+        batch = refunds.create_batch(
+            TransactionRecord.objects.filter(pk__in=[cancelled.pk, no_session.pk])
+        )
+        assert refunds.run_batch(batch) == {"pending": 0, "refunded": 0, "failed": 1, "skipped": 1}
+        refund_create_mock.assert_not_called()
+
+        assert batch.items.get(transaction_record=cancelled).error == (
+            "Not paid for, the booking is cancelled"
+        )
+        assert batch.items.get(transaction_record=no_session).error.startswith(
+            "RelatedObjectDoesNotExist"
+        )
+
+    def test_rate_limiter_shared(self, settings):
+
+        settings.DRILL_SUPPERS_REFUNDS_PER_SECOND = 10
+
+        assert refunds.get_rate_limiter() is refunds.get_rate_limiter()
+
+    def test_rate_limiter(self):
+
+        rate_limiter = refunds.RateLimiter(100)
+
+        with mock.patch("time.sleep") as sleep_mock:
+            for _ in range(5):
+                rate_limiter.wait()
+
+        # Every call after the first waits its turn
+        assert sleep_mock.call_count == 4
+
+    def test_admin_action(self, admin_client):
+
+        transaction_records = paid_transaction_records(2)
+
+        response = admin_client.post(
+            reverse("admin:drill_suppers_transactionrecord_changelist"),
+            {
+                "action": "refund",
+                "_selected_action": [record.pk for record in transaction_records],
+            },
+        )
+
+        # The batch is left for the worker
+        job = Job.objects.get()
+        assert job.function == "hac_shop.drill_suppers.refunds.run_batch_job"
+        batch = RefundBatch.objects.get(pk=job.args[0])
+
+        assert response.status_code == 302
+        assert response.url == batch.get_absolute_url()
+        assert batch.items.count() == 2
+
+        response = admin_client.get(response.url)
+        assert response.status_code == 200
+        assert response.context["progress"]["pending"] == 2
@@ -0,0 +1,180 @@
+from unittest import mock
+
+import httpx
+import pytest
+import stripe
+from asgiref.sync import async_to_sync
+
+from hac_shop.drill_suppers import stripe_async, stripe_client
+from scripts import fake_stripe_server
+
+
+class TestStripeClient:
+    def test_connections_reused(self, settings, monkeypatch):
+
+        settings.STRIPE_MAX_NETWORK_RETRIES = 0
+        monkeypatch.setattr(stripe, "api_base", fake_stripe_server.start())
+        monkeypatch.setattr(stripe_client, "_client", None)
+        monkeypatch.setattr(stripe, "default_http_client", None)
+        monkeypatch.setattr(stripe, "max_network_retries", 0)
+
+        for _ in range(3):
+            checkout_session = stripe_client.create_checkout_session(mode="payment")
+            stripe_client.retrieve_checkout_session(checkout_session.id)
+
+        stats = stripe_client.stats()
+        assert stats["requests"] == 6
+        assert stats["connections_opened"] == 1
+        assert stats["pool_hit_rate"] > 0.8
+        assert stripe.default_http_client is stripe_client.get_client()
+
+    @mock.patch("stripe.checkout.Session.create")
+    def test_retries_with_idempotency_key(self, create_mock, settings):
+
+        settings.STRIPE_RETRY_BACKOFF = 0
+        create_mock.side_effect = [
+            stripe.error.APIConnectionError("reset"),
+            stripe.error.APIError("server error", http_status=500),
+            "cs_test",
+        ]
+
+        assert (
+            stripe_client.create_checkout_session(idempotency_key="key", mode="payment")
+            == "cs_test"
+        )
+        assert create_mock.call_count == 3
+        assert {call.kwargs["idempotency_key"] for call in create_mock.call_args_list} == {
+            "key"
+        }
+
+    @mock.patch("stripe.checkout.Session.create")
+    def test_no_retry_on_invalid_request(self, create_mock, settings):
+
+        create_mock.side_effect = stripe.error.InvalidRequestError("bad", "mode")
+
+        with pytest.raises(stripe.error.InvalidRequestError):
+            stripe_client.create_checkout_session(mode="payment")
+
+        assert create_mock.call_count == 1
+        assert not stripe_client.breaker_open()
+
+    @mock.patch("stripe.checkout.Session.create")
+    def test_breaker_opens(self, create_mock, settings):
+
+        settings.STRIPE_RETRY_BACKOFF = 0
+        settings.STRIPE_MAX_NETWORK_RETRIES = 1
+        settings.STRIPE_BREAKER_FAILURES = 4
+        create_mock.side_effect = stripe.error.RateLimitError("slow down", http_status=429)
+
+        for _ in range(2):
+            with pytest.raises(stripe_client.StripeUnavailableError):
+                stripe_client.create_checkout_session(mode="payment")
+
+        assert stripe_client.breaker_open()
+
+        with pytest.raises(stripe_client.StripeUnavailableError):
+            stripe_client.create_checkout_session(mode="payment")
+
+        assert create_mock.call_count == 4
+
+
+class TestAsyncStripeClient:
+    def retrieve(self, *responses):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return responses[len(requests) - 1]
+
+        async def retrieve():
+            client = stripe_async.AsyncStripeClient()
+            client.http = httpx.AsyncClient(
+                base_url=stripe.api_base, transport=httpx.MockTransport(handler)
+            )
+            return await client.retrieve_checkout_session("cs_test")
+
+        return async_to_sync(retrieve)(), len(requests)
+
+    def test_unreadable_response_retried(self, settings):
+
+        settings.STRIPE_RETRY_BACKOFF = 0
+
+        checkout_session, requests = self.retrieve(
+            httpx.Response(200, text="<html>Bad gateway</html>"),
+            httpx.Response(200, json={"id": "cs_test", "object": "checkout.session"}),
+        )
+
+        assert checkout_session.id == "cs_test"
+        assert requests == 2
+
+    def test_errors_match_the_library(self):
+
+        with pytest.raises(stripe.error.InvalidRequestError):
+            self.retrieve(
+                httpx.Response(
+                    404,
+                    json={"error": {"message": "No such session", "param": "id"}},
+                )
+            )
+
+        assert not stripe_client.breaker_open()
+
+
+class TestAgainstFakeStripe:
+    @pytest.fixture
+    def fake_stripe(self, settings, monkeypatch):
+        def start(**options):
+            monkeypatch.setattr(stripe, "api_base", fake_stripe_server.start(**options))
+            monkeypatch.setattr(stripe_client, "_client", None)
+            monkeypatch.setattr(stripe, "default_http_client", None)
+            settings.STRIPE_RETRY_BACKOFF = 0
+
+        return start
+
+    def test_checkout_and_refund(self, fake_stripe):
+
+        fake_stripe()
+
+        checkout_session = stripe_client.create_checkout_session(
+            idempotency_key="checkout", mode="payment", client_reference_id="1"
+        )
+        # A retry under the same key gets the same session back
+        assert (
+            stripe_client.create_checkout_session(
+                idempotency_key="checkout", mode="payment", client_reference_id="1"
+            ).id
+            == checkout_session.id
+        )
+
+        stripe_client.expire_checkout_session(checkout_session.id)
+        assert stripe_client.retrieve_checkout_session(checkout_session.id).status == "expired"
+
+        with pytest.raises(stripe.error.InvalidRequestError):
+            stripe_client.expire_checkout_session(checkout_session.id)
+
+        with pytest.raises(stripe.error.InvalidRequestError):
+            stripe_client.create_refund(payment_intent=checkout_session.payment_intent)
+
+        sessions = stripe.checkout.Session.list(limit=1)
+        assert [session.id for session in sessions.data] == [checkout_session.id]
+
+    def test_injected_errors(self, fake_stripe, settings):
+
+        settings.STRIPE_MAX_NETWORK_RETRIES = 1
+        fake_stripe(error_rate=1)
+
+        with pytest.raises(stripe_client.StripeUnavailableError):
+            stripe_client.create_checkout_session(mode="payment")
+
+    def test_rate_limit(self, fake_stripe, settings):
+
+        settings.STRIPE_MAX_NETWORK_RETRIES = 0
+        fake_stripe(rate_limit=2)
+
+        stripe_client.create_checkout_session(mode="payment")
+        stripe_client.create_checkout_session(mode="payment")
+
+        with pytest.raises(stripe_client.StripeUnavailableError) as error:
+            stripe_client.create_checkout_session(mode="payment")
+
+        assert isinstance(error.value.__cause__, stripe.error.RateLimitError)
@@ -0,0 +1,106 @@
+from unittest import mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory
+from django.urls import reverse
+
+from hac_shop.drill_suppers import async_views, throttling
+from hac_shop.drill_suppers.models import TransactionRecord
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def rate_limits(settings):
+    settings.DRILL_SUPPERS_RATE_LIMITS = {
+        "purchase": (2, 60),
+        "purchase_ip": (4, 60),
+        "refund": (1, 60),
+        "refund_ip": (2, 60),
+    }
+
+
+class TestThrottling:
+    def test_bucket_refills(self):
+
+        with mock.patch("time.time", return_value=1000):
+            assert throttling.take("purchase", {"ip": "10.0.0.1"}) == 0
+            assert throttling.take("purchase", {"ip": "10.0.0.1"}) == 0
+            assert throttling.take("purchase", {"ip": "10.0.0.1"}) == pytest.approx(30)
+
+        # One request back every 30 seconds
+        with mock.patch("time.time", return_value=1030):
+            assert throttling.take("purchase", {"ip": "10.0.0.1"}) == 0
+
+    def test_every_bucket_needs_a_token(self):
+
+        for number in range(2):
+            throttling.take("purchase", {"ip": f"10.0.0.{number}", "email": "a@example.com"})
+
+        # The email has run out, and a refused request takes nothing from the IP
+        assert throttling.take("purchase", {"ip": "10.0.0.9", "email": "a@example.com"})
+        assert throttling.take("purchase", {"ip": "10.0.0.9"}) == 0
+        assert throttling.take("purchase", {"ip": "10.0.0.9"}) == 0
+
+    def test_client_ip(self, rf: RequestFactory, settings):
+
+        request = rf.get("/", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2", REMOTE_ADDR="10.0.0.1")
+        assert throttling.client_ip(request) == "10.0.0.1"
+
+        # A client can put anything before the address the proxy appends
+        settings.DRILL_SUPPERS_TRUSTED_PROXIES = 1
+        assert throttling.client_ip(request) == "2.2.2.2"
+
+    def test_purchase_limited(self, client):
+
+        url = reverse("drill_suppers:index")
+        data = {"name": "Bot", "email": "bot@example.com"}
+
+        assert client.post(url, data).status_code == 200
+        assert client.post(url, data).status_code == 200
+
+        response = client.post(url, data)
+        assert response.status_code == 429
+        assert response["Retry-After"] == "30"
+
+        # Loading the form isn't limited
+        assert client.get(url).status_code == 200
+
+    def test_shared_address_limited_loosely(self, client):
+
+        url = reverse("drill_suppers:index")
+
+        # Buyers behind one address each have their own limit, up to the
+        # address's much larger one
+        statuses = [
+            client.post(url, {"email": f"member-{number}@example.com"}).status_code
+            for number in range(5)
+        ]
+
+        assert statuses == [200, 200, 200, 200, 429]
+
+    def test_disabled(self, client, settings):
+
+        settings.DRILL_SUPPERS_RATE_LIMITS_ENABLED = False
+        url = reverse("drill_suppers:index")
+
+        for _ in range(5):
+            assert client.post(url, {"email": "load-test@example.com"}).status_code == 200
+
+    def test_refund_limited(self, client, transaction_record: TransactionRecord):
+
+        url = reverse("drill_suppers:refund", args=[transaction_record.pk])
+
+        assert client.post(url, {"confirm_email": "wrong@example.com"}).status_code == 200
+        assert client.post(url, {"confirm_email": "wrong@example.com"}).status_code == 429
+
+    def test_async_purchase_limited(self, rf: RequestFactory):
+
+        statuses = []
+        for _ in range(3):
+            request = rf.post("/supper/", {"email": "bot@example.com"})
+            request.session = mock.Mock(session_key=None)
+            statuses.append(async_to_sync(async_views.transaction_record_create)(request).status_code)
+
+        assert statuses == [200, 200, 429]
@@ -1,20 +1,30 @@
+import uuid
+from datetime import datetime, timedelta, timezone
 from unittest import mock
 
 import pytest
-from django.conf import settings
+import stripe
+from asgiref.sync import async_to_sync
 from django.contrib import messages
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.messages.middleware import MessageMiddleware
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.http import HttpRequest
-from django.test import RequestFactory
+from django.test import AsyncClient, RequestFactory
 from django.urls import reverse
 from faker import Faker
 
+from hac_shop.drill_suppers import async_views, live
 from hac_shop.drill_suppers.forms import PurchaseForm
-from hac_shop.drill_suppers.models import StripeCheckoutSession, TransactionRecord
-from hac_shop.drill_suppers.tests.factories import MockStripeSessionObject
+from hac_shop.drill_suppers.models import Job, StripeCheckoutSession, TransactionRecord
+from hac_shop.drill_suppers.tests.factories import (
+    MockStripeSessionObject,
+    StripeCheckoutSessionFactory,
+    TransactionRecordFactory,
+    signed_stripe_event,
+)
 from hac_shop.drill_suppers.views import (
+    StripeWebhook,
     TransactionRecordCancelled,
     TransactionRecordCreate,
     TransactionRecordPurchased,
@@ -68,6 +78,141 @@ class TestCreateTransactionRecordView:
             == response.url
         )
 
+    @mock.patch("stripe.checkout.Session.create")
+    def test_post_sold_out(
+        self,
+        create_mock,
+        transaction_record: TransactionRecord,
+        rf: RequestFactory,
+    ):
+
+        drill_night = transaction_record.drill_night
+        drill_night.date_time = datetime.now(timezone.utc) + timedelta(weeks=1)
+        drill_night.cut_off_time = datetime.now(timezone.utc) + timedelta(days=1)
+        drill_night.capacity = 2
+        drill_night.save()
+        drill_night.reserve_meals(2)
+
+        email = fake.email()
+
+        request = rf.post(
+            "/supper/",
+            {
+                "name": fake.first_name(),
+                "email": email,
+                "drill_night": drill_night.pk,
+                "quantity": 1,
+            },
+        )
+
+        response = TransactionRecordCreate.as_view()(request)
+
+        # The form is shown again and no checkout is started
+        assert response.status_code == 200
+        assert response.context_data["form"].errors["drill_night"]
+        assert not TransactionRecord.objects.filter(email=email).exists()
+        create_mock.assert_not_called()
+
+    @mock.patch("stripe.checkout.Session.create")
+    def test_post_stripe_unavailable(
+        self,
+        create_mock,
+        settings,
+        transaction_record: TransactionRecord,
+        rf: RequestFactory,
+    ):
+
+        settings.STRIPE_MAX_NETWORK_RETRIES = 0
+        settings.STRIPE_BREAKER_FAILURES = 1
+        create_mock.side_effect = stripe.error.APIConnectionError("timed out")
+
+        data = {
+            "name": fake.first_name(),
+            "email": fake.email(),
+            "drill_night": transaction_record.drill_night.pk,
+            "quantity": 1,
+        }
+
+        # The failed call cancels the purchase and opens the breaker
+        response = TransactionRecordCreate.as_view()(rf.post("/supper/", data))
+
+        assert response.status_code == 503
+        assert b"try again" in response.content
+        assert (
+            TransactionRecord.objects.get(email=data["email"]).status
+            == TransactionRecord.PaymentStatus.CANCELLED
+        )
+
+        # Later buyers are turned away without calling Stripe
+        data["email"] = fake.email()
+        response = TransactionRecordCreate.as_view()(rf.post("/supper/", data))
+
+        assert response.status_code == 503
+        assert not TransactionRecord.objects.filter(email=data["email"]).exists()
+        assert create_mock.call_count == 1
+
+    @mock.patch("stripe.checkout.Session.create")
+    def test_post_repeated(
+        self,
+        create_mock,
+        stripe_checkout_session_object: MockStripeSessionObject,
+        drill_night,
+        rf: RequestFactory,
+    ):
+
+        create_mock.return_value = stripe_checkout_session_object
+        drill_night.capacity = 3
+        drill_night.save()
+
+        data = {
+            "name": fake.first_name(),
+            "email": fake.email(),
+            "drill_night": drill_night.pk,
+            "quantity": 3,
+            "idempotency_key": uuid.uuid4(),
+        }
+
+        first = TransactionRecordCreate.as_view()(rf.post("/supper/", data))
+        # The night sold out with the first submission
+        second = TransactionRecordCreate.as_view()(rf.post("/supper/", data))
+
+        assert first.status_code == second.status_code == 302
+        assert second.url == first.url == stripe_checkout_session_object.url
+        assert TransactionRecord.objects.filter(email=data["email"]).count() == 1
+        assert create_mock.call_count == 1
+
+        # Once paid the buyer is shown their booking
+        transaction_record = TransactionRecord.objects.get(email=data["email"])
+        transaction_record.update_status(TransactionRecord.PaymentStatus.PAID)
+
+        third = TransactionRecordCreate.as_view()(rf.post("/supper/", data))
+
+        assert third.url == transaction_record.get_absolute_url()
+
+    def test_racing_submissions(self, drill_night):
+
+        drill_night.capacity = 5
+        drill_night.save()
+
+        data = {
+            "name": fake.first_name(),
+            "email": fake.email(),
+            "drill_night": drill_night.pk,
+            "quantity": 3,
+            "idempotency_key": uuid.uuid4(),
+        }
+
+        # Both checked for an earlier booking before either was saved
+        first, second = PurchaseForm(data), PurchaseForm(data)
+        assert first.is_valid() and second.is_valid()
+
+        assert first.save() == second.save()
+        assert TransactionRecord.objects.filter(email=data["email"]).count() == 1
+
+        # The second submission took no meals
+        drill_night.refresh_from_db()
+        assert drill_night.meals_reserved == 3
+
 
 class TestTransactionRecordPurchasedView:
     @mock.patch("stripe.checkout.Session.retrieve")
@@ -121,6 +266,28 @@ class TestTransactionRecordPurchasedView:
         assert response.status_code == 302
         assert response.url == transaction_record.get_absolute_url()
 
+    @mock.patch("stripe.checkout.Session.retrieve")
+    def test_get_after_webhook(
+        self,
+        retrieve_session_mock,
+        stripe_checkout_session: StripeCheckoutSession,
+        rf: RequestFactory,
+    ):
+
+        stripe_checkout_session.session_id = "cs_test"
+        stripe_checkout_session.save()
+
+        transaction_record = stripe_checkout_session.transaction_record
+        transaction_record.update_status(TransactionRecord.PaymentStatus.PAID)
+
+        request = rf.get(f"/supper/{transaction_record.id}/purchased?session_id=cs_test")
+        response = TransactionRecordPurchased.as_view()(request, pk=transaction_record.id)
+
+        # Stripe isn't asked again once the webhook has confirmed the payment
+        assert response.status_code == 302
+        assert response.url == transaction_record.get_absolute_url()
+        retrieve_session_mock.assert_not_called()
+
 
 class TestTransactionRecordCancelledView:
     @mock.patch("stripe.checkout.Session.retrieve")
@@ -155,21 +322,425 @@ class TestTransactionRecordCancelledView:
 
         assert response.status_code == 400
 
-        # with matching data but status is not paid return a 400
-        stripe_checkout_session_object.payment_status = "unpaid"
+        # with matching data but paid for in the meantime, isn't cancelled
+        stripe_checkout_session_object.payment_status = "paid"
         request = rf.get(
             f"/supper/{transaction_record.id}/purchased?session_id={transaction_record.stripecheckoutsession.session_id}"
         )
         response = view(request, pk=transaction_record.id)
 
+        assert response.status_code == 302
+        assert response.url == transaction_record.get_absolute_url()
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.AWAITING_CHECKOUT
+
+        # when all matching and not paid, cancels and redirects to the index
+        stripe_checkout_session_object.payment_status = "unpaid"
+        response = view(request, pk=transaction_record.id)
+
+        assert response.status_code == 302
+        assert response.url == "/supper/"
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.CANCELLED
+
+    @mock.patch("stripe.checkout.Session.retrieve")
+    def test_get_paid(
+        self,
+        retrieve_session_mock,
+        stripe_checkout_session: StripeCheckoutSession,
+        rf: RequestFactory,
+    ):
+
+        stripe_checkout_session.session_id = "cs_test"
+        stripe_checkout_session.save()
+        transaction_record = stripe_checkout_session.transaction_record
+        transaction_record.update_status(TransactionRecord.PaymentStatus.PAID)
+
+        request = rf.get(f"/supper/{transaction_record.id}/cancelled?session_id=cs_test")
+        response = TransactionRecordCancelled.as_view()(request, pk=transaction_record.id)
+
+        # A paid booking is never cancelled
+        assert response.status_code == 302
+        assert response.url == transaction_record.get_absolute_url()
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.PAID
+        retrieve_session_mock.assert_not_called()
+
+
+class TestTransactionRecordRefundView:
+    @mock.patch("stripe.Refund.create")
+    def test_post_stripe_unavailable(self, refund_create_mock, settings, client):
+
+        settings.STRIPE_MAX_NETWORK_RETRIES = 0
+        settings.STRIPE_BREAKER_FAILURES = 1
+        refund_create_mock.side_effect = stripe.error.APIConnectionError("timed out")
+
+        checkout_session = StripeCheckoutSessionFactory(
+            payment_intent="pi_test",
+            transaction_record__status=TransactionRecord.PaymentStatus.PAID,
+            transaction_record__drill_night__date_time=datetime.now(timezone.utc) + timedelta(weeks=1),
+            transaction_record__drill_night__cut_off_time=datetime.now(timezone.utc) + timedelta(days=1),
+        )
+        transaction_record = checkout_session.transaction_record
+
+        response = client.post(
+            reverse("drill_suppers:refund", args=[transaction_record.pk]),
+            {"confirm_email": transaction_record.email},
+            follow=True,
+        )
+
+        # The refund is queued for the worker rather than failing the request
+        assert response.redirect_chain == [(transaction_record.get_absolute_url(), 302)]
+        assert "queued" in str(list(response.context["messages"])[0])
+        assert Job.objects.filter(args=[str(transaction_record.pk)]).exists()
+
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.PAID
+
+
+class TestStripeWebhookView:
+    def post_event(self, rf, event_type, data_object, secret="whsec_test"):
+        payload, signature = signed_stripe_event(event_type, data_object, secret)
+
+        request = rf.post(
+            "/supper/stripe/webhook",
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature,
+        )
+
+        return StripeWebhook.as_view()(request)
+
+    def test_post(
+        self,
+        settings,
+        stripe_checkout_session: StripeCheckoutSession,
+        rf: RequestFactory,
+    ):
+
+        settings.STRIPE_WEBHOOK_SECRET = "whsec_test"
+
+        stripe_checkout_session.session_id = "cs_test"
+        stripe_checkout_session.save()
+        transaction_record = stripe_checkout_session.transaction_record
+
+        session = {
+            "id": "cs_test",
+            "object": "checkout.session",
+            "payment_status": "paid",
+            "payment_intent": "pi_test",
+        }
+
+        # Events with a bad signature are rejected
+        response = self.post_event(
+            rf, "checkout.session.completed", session, secret="whsec_wrong"
+        )
         assert response.status_code == 400
 
-        # when all matching a paid, redirects to success page
+        # Completing the checkout marks the record as paid, repeats are ignored
+        for _ in range(2):
+            response = self.post_event(rf, "checkout.session.completed", session)
+            assert response.status_code == 200
+
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.PAID
+
+        # A late expiry doesn't cancel a paid record
+        response = self.post_event(rf, "checkout.session.expired", session)
+
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.PAID
+
+        # Refunds are found by the payment intent
+        response = self.post_event(
+            rf,
+            "charge.refunded",
+            {"id": "ch_test", "object": "charge", "payment_intent": "pi_test"},
+        )
+
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.REFUNDED
+
+    def test_post_expired(
+        self,
+        settings,
+        stripe_checkout_session: StripeCheckoutSession,
+        rf: RequestFactory,
+    ):
+
+        settings.STRIPE_WEBHOOK_SECRET = "whsec_test"
+
+        stripe_checkout_session.session_id = "cs_test"
+        stripe_checkout_session.save()
+
+        response = self.post_event(
+            rf,
+            "checkout.session.expired",
+            {"id": "cs_test", "object": "checkout.session", "payment_status": "unpaid"},
+        )
+        assert response.status_code == 200
+
+        transaction_record = stripe_checkout_session.transaction_record
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.CANCELLED
+
+    def test_post_without_secret(
+        self,
+        settings,
+        stripe_checkout_session: StripeCheckoutSession,
+        rf: RequestFactory,
+    ):
+
+        settings.STRIPE_WEBHOOK_SECRET = ""
+
+        stripe_checkout_session.session_id = "cs_test"
+        stripe_checkout_session.save()
+
+        # An event signed with the empty secret would otherwise be accepted
+        response = self.post_event(
+            rf,
+            "checkout.session.completed",
+            {"id": "cs_test", "object": "checkout.session", "payment_status": "paid"},
+            secret="",
+        )
+
+        assert response.status_code == 400
+        transaction_record = stripe_checkout_session.transaction_record
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.AWAITING_CHECKOUT
+
+
+class TestAsyncViews:
+    @mock.patch("hac_shop.drill_suppers.stripe_async.get_client")
+    def test_create(
+        self,
+        get_client_mock,
+        stripe_checkout_session_object: MockStripeSessionObject,
+        drill_night,
+        rf: RequestFactory,
+    ):
+
+        client = get_client_mock.return_value
+        client.create_checkout_session = mock.AsyncMock(
+            return_value=stripe_checkout_session_object
+        )
+
+        drill_night.date_time = datetime.now(timezone.utc) + timedelta(weeks=1)
+        drill_night.cut_off_time = datetime.now(timezone.utc) + timedelta(days=1)
+        drill_night.save()
+
+        email = fake.email()
+        request = rf.post(
+            "/supper/",
+            {
+                "name": fake.first_name(),
+                "email": email,
+                "drill_night": drill_night.pk,
+                "quantity": 2,
+                "idempotency_key": uuid.uuid4(),
+            },
+        )
+
+        response = async_to_sync(async_views.transaction_record_create)(request)
+
+        assert response.status_code == 302
+        assert response.url == stripe_checkout_session_object.url
+
+        transaction_record = TransactionRecord.objects.get(email=email)
+        assert (
+            transaction_record.stripecheckoutsession.session_id
+            == stripe_checkout_session_object.id
+        )
+
+        # Submitting the form again starts no other checkout
+        response = async_to_sync(async_views.transaction_record_create)(request)
+
+        assert response.url == stripe_checkout_session_object.url
+        assert client.create_checkout_session.call_count == 1
+
+    @mock.patch("hac_shop.drill_suppers.stripe_async.get_client")
+    def test_purchased(
+        self,
+        get_client_mock,
+        stripe_checkout_session_object: MockStripeSessionObject,
+        stripe_checkout_session: StripeCheckoutSession,
+        rf: RequestFactory,
+    ):
+
         stripe_checkout_session_object.payment_status = "paid"
-        request = rf.get(
-            f"/supper/{transaction_record.id}/purchased?session_id={transaction_record.stripecheckoutsession.session_id}"
+        client = get_client_mock.return_value
+        client.retrieve_checkout_session = mock.AsyncMock(
+            return_value=stripe_checkout_session_object
+        )
+
+        stripe_checkout_session.session_id = "cs_test"
+        stripe_checkout_session.save()
+        transaction_record = stripe_checkout_session.transaction_record
+
+        request = rf.get(f"/supper/{transaction_record.id}/purchased?session_id=cs_test")
+        response = async_to_sync(async_views.transaction_record_purchased)(
+            request, pk=transaction_record.id
         )
-        response = view(request, pk=transaction_record.id)
 
         assert response.status_code == 302
-        assert response.url == "/supper/"
+        assert response.url == transaction_record.get_absolute_url()
+
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == TransactionRecord.PaymentStatus.PAID
+
+    @pytest.mark.parametrize(
+        "payment_status, status",
+        [
+            ("paid", TransactionRecord.PaymentStatus.AWAITING_CHECKOUT),
+            ("unpaid", TransactionRecord.PaymentStatus.CANCELLED),
+        ],
+    )
+    @mock.patch("hac_shop.drill_suppers.stripe_async.get_client")
+    def test_cancelled(
+        self,
+        get_client_mock,
+        payment_status,
+        status,
+        stripe_checkout_session_object: MockStripeSessionObject,
+        stripe_checkout_session: StripeCheckoutSession,
+        rf: RequestFactory,
+    ):
+
+        stripe_checkout_session_object.payment_status = payment_status
+        client = get_client_mock.return_value
+        client.retrieve_checkout_session = mock.AsyncMock(
+            return_value=stripe_checkout_session_object
+        )
+
+        stripe_checkout_session.session_id = "cs_test"
+        stripe_checkout_session.save()
+        transaction_record = stripe_checkout_session.transaction_record
+
+        request = rf.get(f"/supper/{transaction_record.id}/cancelled?session_id=cs_test")
+        response = async_to_sync(async_views.transaction_record_cancelled)(
+            request, pk=transaction_record.id
+        )
+
+        # Only a booking not paid for is cancelled
+        assert response.status_code == 302
+        transaction_record.refresh_from_db()
+        assert transaction_record.status == status
+
+
+class TestDrillNightReportView:
+    def get_report(self, client, drill_night):
+        return client.get(reverse("drill_suppers:drill_night_report", args=[drill_night.pk]))
+
+    @pytest.mark.parametrize("bookings", [1, 40])
+    def test_query_count(self, admin_client, drill_night, django_assert_num_queries, bookings):
+
+        TransactionRecordFactory.create_batch(bookings, drill_night=drill_night)
+
+        # The request's savepoint and its release, the session and user, the
+        # conditional GET validators, the drill night, the totals and the bookings
+        with django_assert_num_queries(8):
+            response = self.get_report(admin_client, drill_night)
+        assert response.status_code == 200
+
+        # The bookings table comes from the cache
+        with django_assert_num_queries(7):
+            self.get_report(admin_client, drill_night)
+
+    def test_cache_invalidated(self, admin_client, drill_night):
+
+        record = TransactionRecordFactory(drill_night=drill_night, name="Zara")
+        assert "Zara" in self.get_report(admin_client, drill_night).content.decode()
+
+        record.name = "Yusuf"
+        record.save()
+        assert "Yusuf" in self.get_report(admin_client, drill_night).content.decode()
+
+        record.update_status(TransactionRecord.PaymentStatus.PAID)
+        response = self.get_report(admin_client, drill_night)
+        assert 'class="text-decoration-line-through"' not in response.content.decode()
+        assert response.context["totals"][TransactionRecord.PaymentStatus.PAID] == record.quantity
+
+    def test_not_modified(self, admin_client, drill_night, django_assert_num_queries):
+
+        record = TransactionRecordFactory(drill_night=drill_night)
+        response = self.get_report(admin_client, drill_night)
+        assert "Cookie" in response["Vary"]
+        assert "private" in response["Cache-Control"]
+
+        # The savepoint and its release, session and user, and the validators,
+        # without loading the bookings or rendering the page
+        with django_assert_num_queries(5):
+            response = admin_client.get(
+                reverse("drill_suppers:drill_night_report", args=[drill_night.pk]),
+                HTTP_IF_NONE_MATCH=response["ETag"],
+            )
+        assert response.status_code == 304
+
+        etag = response["ETag"]
+        record.delete()
+        response = admin_client.get(
+            reverse("drill_suppers:drill_night_report", args=[drill_night.pk]),
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        assert response.status_code == 200
+
+    def test_live_only_under_asgi(self, admin_client, admin_user, drill_night):
+
+        live_url = reverse("drill_suppers:drill_night_live", args=[drill_night.pk])
+
+        # A sync worker would be held by every open report
+        assert live_url not in self.get_report(admin_client, drill_night).content.decode()
+
+        async_client = AsyncClient()
+        async_client.force_login(admin_user)
+        response = async_to_sync(async_client.get)(
+            reverse("drill_suppers:drill_night_report", args=[drill_night.pk])
+        )
+
+        assert live_url in response.content.decode()
+        assert live.watched(drill_night.pk)
+
+    def test_not_modified_staff_only(self, client, admin_client, drill_night):
+
+        etag = self.get_report(admin_client, drill_night)["ETag"]
+        response = client.get(
+            reverse("drill_suppers:drill_night_report", args=[drill_night.pk]),
+            HTTP_IF_NONE_MATCH=etag,
+        )
+
+        assert response.status_code == 302
+
+
+class TestTransactionRecordDetailView:
+    def test_not_modified(self, client, transaction_record: TransactionRecord):
+
+        url = transaction_record.get_absolute_url()
+        response = client.get(url)
+        assert response.status_code == 200
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == 304
+
+        etag = response["ETag"]
+        transaction_record.update_status(TransactionRecord.PaymentStatus.PAID)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_modified_at_cut_off(self, client, transaction_record: TransactionRecord):
+
+        url = transaction_record.get_absolute_url()
+        etag = client.get(url)["ETag"]
+
+        with mock.patch(
+            "hac_shop.drill_suppers.views.utc_now",
+            return_value=transaction_record.drill_night.cut_off_time + timedelta(minutes=1),
+        ):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 200
+
+    def test_not_found(self, client):
+
+        response = client.get(f"/supper/{uuid.uuid4()}/", HTTP_IF_NONE_MATCH="*")
+
+        assert response.status_code == 404
@@ -0,0 +1,138 @@
+from unittest import mock
+
+import pytest
+from django.urls import reverse
+
+from hac_shop.drill_suppers import caching, waiting_room
+from hac_shop.drill_suppers.models import DrillNight
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def queued_night(drill_night: DrillNight) -> DrillNight:
+    drill_night.waiting_room = True
+    drill_night.admissions_per_minute = 6
+    drill_night.save()
+    return drill_night
+
+
+class TestWaitingRoom:
+    def test_admits_at_rate(self):
+
+        with mock.patch("time.time", return_value=1000):
+            numbers = [waiting_room.issue(1) for _ in range(10)]
+            # A quiet queue has banked a minute of admissions
+            assert waiting_room.advance(1, 6) == (10, 6)
+
+        # Then one more every ten seconds
+        with mock.patch("time.time", return_value=1025):
+            assert waiting_room.advance(1, 6) == (10, 8)
+
+        assert numbers == list(range(1, 11))
+
+    def test_no_admissions_banked_past_the_queue(self):
+
+        with mock.patch("time.time", return_value=1000):
+            waiting_room.issue(1)
+            assert waiting_room.advance(1, 6) == (1, 1)
+
+        with mock.patch("time.time", return_value=1005):
+            for _ in range(10):
+                waiting_room.issue(1)
+            # The rest of the minute's admissions were kept, but no more
+            assert waiting_room.advance(1, 6) == (11, 6)
+
+    def test_slowed_to_meals_left(self, queued_night: DrillNight):
+
+        queued_night.capacity = 4
+        queued_night.save()
+
+        assert waiting_room.admissions_per_minute(queued_night.pk, 6) == 4
+
+        queued_night.reserve_meals(3)
+        caching.invalidate_sellable_nights()
+
+        assert waiting_room.admissions_per_minute(queued_night.pk, 6) == 1
+
+    def test_sold_out_admits_no_one(self):
+
+        with mock.patch("time.time", return_value=1000):
+            waiting_room.issue(1)
+            assert waiting_room.advance(1, 0) == (1, 0)
+
+
+class TestWaitingRoomViews:
+    def test_form_redirects_to_queue(self, client, queued_night: DrillNight):
+
+        response = client.get(reverse("drill_suppers:index"))
+
+        assert response.status_code == 302
+        assert response.url == reverse("drill_suppers:waiting_room", args=[queued_night.pk])
+
+    def test_admitted_from_queue(self, client, queued_night: DrillNight):
+
+        queue_url = reverse("drill_suppers:waiting_room", args=[queued_night.pk])
+
+        # Someone else has taken the burst of admissions
+        with mock.patch("time.time", return_value=1000):
+            for _ in range(6):
+                waiting_room.issue(queued_night.pk)
+            waiting_room.advance(queued_night.pk, 6)
+
+            response = client.get(queue_url)
+
+        assert response.status_code == 200
+        assert response.context["status"]["position"] == 1
+        assert response.context["status"]["admitted"] is False
+        assert client.get(reverse("drill_suppers:index")).status_code == 302
+
+        with mock.patch("time.time", return_value=1010):
+            response = client.get(
+                reverse("drill_suppers:waiting_room_status", args=[queued_night.pk])
+            )
+
+            assert response.json()["admitted"] is True
+            assert client.get(reverse("drill_suppers:index")).status_code == 200
+            assert client.get(queue_url).url == reverse("drill_suppers:index")
+
+    def test_post_needs_admission(self, client, queued_night: DrillNight):
+
+        data = {
+            "drill_night": queued_night.pk,
+            "name": "Name",
+            "email": "name@example.com",
+            "quantity": 1,
+        }
+
+        response = client.post(reverse("drill_suppers:index"), data)
+
+        assert response.status_code == 302
+        assert response.url == reverse("drill_suppers:waiting_room", args=[queued_night.pk])
+        assert not queued_night.transactionrecord_set.exists()
+
+    def test_tampered_ticket_ignored(self, client, queued_night: DrillNight):
+
+        client.get(reverse("drill_suppers:waiting_room", args=[queued_night.pk]))
+        client.cookies[waiting_room.COOKIE_NAME] = '{"%s": 1}' % queued_night.pk
+
+        assert client.get(reverse("drill_suppers:index")).status_code == 302
+
+    def test_status_without_queries(
+        self, client, queued_night: DrillNight, django_assert_num_queries
+    ):
+
+        url = reverse("drill_suppers:waiting_room_status", args=[queued_night.pk])
+        client.get(url)
+
+        with django_assert_num_queries(0):
+            response = client.get(url)
+
+        assert response["Cache-Control"] == "private, no-store"
+
+    def test_closed_room_lets_everyone_in(self, client, drill_night: DrillNight):
+
+        response = client.get(reverse("drill_suppers:waiting_room", args=[drill_night.pk]))
+
+        assert response.url == reverse("drill_suppers:index")
+        assert client.get(reverse("drill_suppers:index")).status_code == 200
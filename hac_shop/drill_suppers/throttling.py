@@ -0,0 +1,207 @@
+"""
+Token bucket rate limits for the views that cost a Stripe call or a write.
+
+A request to a limited view takes a token from a bucket for each of its
+client's IP address, email and session. Each bucket holds the scope's
+burst of requests and refills at its steady rate, so a buyer retrying a
+few times is never held up while a bot is stopped after its burst. The
+limits for each scope are in the DRILL_SUPPERS_RATE_LIMITS setting, and a
+view limited by client and by address has a scope for each.
+
+All of a request's buckets are checked and taken from in one Lua script,
+one round trip to Redis. When Redis can't be used the buckets are kept in
+the memory of the process instead, which still limits each worker.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.shortcuts import render
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Takes a token from every bucket if all of them have one, otherwise
+# returns how many seconds until they will. Floats are returned as strings
+# as Redis truncates Lua numbers to integers
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'at')
+    local available = tonumber(bucket[1]) or capacity
+    local at = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - at) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'at', now)
+    redis.call('EXPIRE', key, ARGV[4])
+end
+return '0'
+"""
+
+# Most buckets kept by each process while Redis is unavailable
+LOCAL_BUCKETS = 10000
+
+_local_buckets = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def get_client():
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        # The configured cache isn't backed by Redis
+        return None
+
+
+def client_ip(request) -> str:
+    # Behind a proxy the client is the address the nearest trusted one saw
+    proxies = settings.DRILL_SUPPERS_TRUSTED_PROXIES
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(",")]
+        return addresses[-min(proxies, len(addresses))]
+
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def identities(request, keys, kwargs) -> dict:
+    """The values identifying the client of a request, by kind."""
+    values = {}
+
+    for kind in keys:
+        if kind == "ip":
+            value = client_ip(request)
+        elif kind == "session":
+            value = request.session.session_key if hasattr(request, "session") else None
+        elif kind in kwargs:
+            value = kwargs[kind]
+        else:
+            # A form field, such as the email entered
+            value = request.POST.get(kind, "").strip().lower()
+
+        if value:
+            values[kind] = str(value)
+
+    return values
+
+
+def bucket_keys(scope: str, values: dict) -> list:
+    return [
+        f"drill_suppers:throttle:{scope}:{kind}:{hashlib.sha1(value.encode()).hexdigest()}"
+        for kind, value in sorted(values.items())
+    ]
+
+
+def take_local(keys: list, now: float, capacity: int, rate: float) -> float:
+    with _local_lock:
+        tokens = []
+        wait = 0
+
+        for key in keys:
+            available, at = _local_buckets.get(key, (capacity, now))
+            available = min(capacity, available + max(0, now - at) * rate)
+            tokens.append(available)
+
+            if available < 1:
+                wait = max(wait, (1 - available) / rate)
+
+        if wait:
+            return wait
+
+        for key, available in zip(keys, tokens):
+            _local_buckets[key] = (available - 1, now)
+            _local_buckets.move_to_end(key)
+
+        while len(_local_buckets) > LOCAL_BUCKETS:
+            _local_buckets.popitem(last=False)
+
+        return 0
+
+
+def take(scope: str, values: dict) -> float:
+    """Take a token for each of the client's buckets, returning 0 or the seconds to wait."""
+    if not values or not settings.DRILL_SUPPERS_RATE_LIMITS_ENABLED:
+        return 0
+
+    requests, seconds = settings.DRILL_SUPPERS_RATE_LIMITS[scope]
+    rate = requests / seconds
+    keys = bucket_keys(scope, values)
+    now = time.time()
+
+    client = get_client()
+
+    if client is not None:
+        try:
+            wait = client.register_script(TAKE_SCRIPT)(
+                keys=keys, args=[now, requests, rate, math.ceil(seconds) + 1]
+            )
+            return float(wait)
+        except RedisError:
+            logger.warning("Redis unavailable, rate limiting in process", exc_info=True)
+
+    return take_local(keys, now, requests, rate)
+
+
+def rate_limited(request, wait: float):
+    response = render(request, "drill_suppers/rate_limited.html", status=429)
+    response["Retry-After"] = str(math.ceil(wait))
+    return response
+
+
+def rate_limit(scope: str, keys=("ip", "session"), methods=("POST",)):
+    """Limit a view's requests per client to the scope's rate.
+
+    keys are the kinds of bucket taken from: ip, session, the name of a URL
+    argument such as pk, or of a form field such as email.
+    """
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method in methods:
+                    wait = await sync_to_async(take, thread_sensitive=False)(
+                        scope, identities(request, keys, kwargs)
+                    )
+                    if wait:
+                        return await sync_to_async(rate_limited)(request, wait)
+
+                return await view(request, *args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                wait = take(scope, identities(request, keys, kwargs))
+                if wait:
+                    return rate_limited(request, wait)
+
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,16 +1,35 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 app_name = "drill_suppers"
+
+if settings.DRILL_SUPPERS_ASYNC_VIEWS:
+    create_view = async_views.transaction_record_create
+    purchased_view = async_views.transaction_record_purchased
+    cancelled_view = async_views.transaction_record_cancelled
+else:
+    create_view = views.TransactionRecordCreate.as_view()
+    purchased_view = views.TransactionRecordPurchased.as_view()
+    cancelled_view = views.TransactionRecordCancelled.as_view()
+
 urlpatterns = [
     # ex: /polls/
-    path("", views.TransactionRecordCreate.as_view(), name="index"),
+    path("", create_view, name="index"),
+    path("availability", views.Availability.as_view(), name="availability"),
+    path("queue/<int:pk>", views.WaitingRoom.as_view(), name="waiting_room"),
+    path("queue/<int:pk>/status", views.WaitingRoomStatus.as_view(), name="waiting_room_status"),
+    path("stripe/webhook", views.StripeWebhook.as_view(), name="stripe_webhook"),
+    path("stripe/stats", views.StripeStats.as_view(), name="stripe_stats"),
+    path("stripe/metrics", views.StripeMetrics.as_view(), name="stripe_metrics"),
     path("<pk>/", views.TransactionRecordDetail.as_view(), name="detail"),
-    path(
-        "<pk>/purchased", views.TransactionRecordPurchased.as_view(), name="purchased"
-    ),
-    path("<pk>/cancel", views.TransactionRecordCancelled.as_view(), name="cancel"),
+    path("<pk>/purchased", purchased_view, name="purchased"),
+    path("<pk>/cancel", cancelled_view, name="cancel"),
     path("<pk>/refund", views.TransactionRecordRefund.as_view(), name="refund"),
+    path("refunds/<pk>", views.RefundBatchProgress.as_view(), name="refund_batch"),
     path("report/<pk>", views.DrillNightReport.as_view(), name="drill_night_report"),
+    path("report/<pk>/live", async_views.drill_night_live, name="drill_night_live"),
+    path("report/<pk>/export", views.DrillNightExport.as_view(), name="drill_night_export"),
+    path("export", views.BookingsExport.as_view(), name="bookings_export"),
 ]
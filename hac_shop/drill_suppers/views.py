@@ -1,25 +1,150 @@
-from django.http.response import HttpResponse, JsonResponse
-from django.shortcuts import redirect
+import hashlib
+import math
+
+import stripe
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http.response import Http404, HttpResponse, JsonResponse
+from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, UpdateView
+from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.crypto import constant_time_compare
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.vary import vary_on_cookie
+
+from hac_shop.utils.views import conditional
+
+from . import caching, exports, live, metrics, stripe_client, throttling, waiting_room, webhooks
+
+from .forms import BookingsExportForm, PurchaseForm, RefundForm
+from .models import (
+    DrillNight,
+    DrillNightSoldOutError,
+    DrillNightUnavailableError,
+    RefundBatch,
+    RefundBatchItem,
+    StripeCheckoutSession,
+    TransactionRecord,
+    utc_now,
+)
+
+SOLD_OUT_MESSAGE = "Sorry, there are not enough meals left for this night"
+UNAVAILABLE_MESSAGE = "Bookings for this night are paused, please try again in a minute"
+
 
-from .forms import PurchaseForm, RefundForm
-from .models import DrillNight, StripeCheckoutSession, TransactionRecord
+def stripe_unavailable(request):
+    return render(request, "drill_suppers/stripe_unavailable.html", status=503)
 
 
+# Each purchase costs a Stripe call and holds meals until it expires. The
+# form carries a new idempotency key each time, so must never be cached
+@method_decorator(
+    [
+        throttling.rate_limit("purchase", keys=("email", "session")),
+        throttling.rate_limit("purchase_ip", keys=("ip",)),
+    ],
+    name="post",
+)
+@method_decorator(never_cache, name="get")
 class TransactionRecordCreate(CreateView):
     model = TransactionRecord
     form_class = PurchaseForm
 
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Seats are reserved in their own short transaction, so the request must
+        # not keep the drill night row locked while waiting on Stripe
+        return transaction.non_atomic_requests(super().as_view(**initkwargs))
+
+    def get(self, request, *args, **kwargs):
+        return waiting_room.queue_redirect(request) or super().get(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        # A repeated submission of the form goes to the booking it already
+        # made, even if the night has since sold out
+        self.object = self.get_form().earlier_booking()
+        if self.object is not None:
+            return redirect(self.get_success_url())
+
+        # Fail fast rather than hold meals for a buyer who can't reach Stripe
+        if stripe_client.breaker_open():
+            return stripe_unavailable(request)
+
+        # Only buyers let through a night's waiting room may book it
+        queued = waiting_room.queue_redirect(request, request.POST.get("drill_night"))
+        if queued is not None:
+            return queued
+
+        return super().post(request, *args, **kwargs)
+
+    def form_valid(self, form):
+        try:
+            return super().form_valid(form)
+        except DrillNightSoldOutError:
+            form.add_error("drill_night", SOLD_OUT_MESSAGE)
+            return self.form_invalid(form)
+        except DrillNightUnavailableError:
+            form.add_error("drill_night", UNAVAILABLE_MESSAGE)
+            return self.form_invalid(form)
+        except stripe_client.StripeUnavailableError:
+            if self.object is not None:
+                self.object.update_status(TransactionRecord.PaymentStatus.CANCELLED)
+
+            return stripe_unavailable(self.request)
+
     def get_success_url(self) -> str:
+        # Only a booking from an earlier submission can have moved on
+        if self.object.status != TransactionRecord.PaymentStatus.AWAITING_CHECKOUT:
+            return self.object.get_absolute_url()
+
         checkout_session = self.object.stripecheckoutsession
         checkout_session.generate_session()
         return checkout_session.checkout_url
 
 
+def transaction_record_validators(request, pk):
+    """The ETag and Last-Modified of a booking's page, from one primary key lookup."""
+    try:
+        row = (
+            TransactionRecord.objects.filter(pk=pk)
+            .values_list(
+                "updated_at",
+                "drill_night__updated_at",
+                "drill_night__cut_off_time",
+                "stripecheckoutsession__checkout_url",
+            )
+            .first()
+        )
+    except ValidationError:
+        row = None
+
+    if row is None:
+        return None, None
+
+    updated_at, drill_night_updated_at, cut_off_time, checkout_url = row
+    # The cancel button goes once the cut-off passes, without any save
+    before_cut_off = utc_now() < cut_off_time
+    etag = hashlib.sha1(
+        f"{updated_at}|{drill_night_updated_at}|{before_cut_off}|{checkout_url}".encode()
+    ).hexdigest()
+
+    return etag, max(updated_at, drill_night_updated_at)
+
+
+@method_decorator(
+    [cache_control(private=True, no_cache=True), conditional(transaction_record_validators)],
+    name="get",
+)
 class TransactionRecordDetail(DetailView):
     model = TransactionRecord
 
@@ -39,9 +164,13 @@ class TransactionRecordPurchased(DetailView):
         if checkout_session.session_id != checkout_session_id:
             return JsonResponse({"reason": "incorrect session id"}, status=400)
 
+        # The webhook has usually confirmed the payment before the buyer gets
+        # here, only ask Stripe if it hasn't arrived yet
+        if transaction_record.status == TransactionRecord.PaymentStatus.PAID:
+            return redirect(transaction_record)
+
         if checkout_session.verify_if_paid():
-            transaction_record.status = TransactionRecord.PaymentStatus.PAID
-            transaction_record.save()
+            transaction_record.update_status(TransactionRecord.PaymentStatus.PAID)
             return redirect(transaction_record)
         else:
             return JsonResponse({"reason": "not paid"}, status=400)
@@ -62,24 +191,270 @@ class TransactionRecordCancelled(DetailView):
         if checkout_session.session_id != checkout_session_id:
             return JsonResponse({"reason": "incorrect session id"}, status=400)
 
-        if checkout_session.verify_if_paid():
-            transaction_record.status = TransactionRecord.PaymentStatus.CANCELLED
-            transaction_record.save()
+        if transaction_record.status == TransactionRecord.PaymentStatus.CANCELLED:
             return redirect(reverse("drill_suppers:index"))
-        else:
-            return JsonResponse({"reason": "not paid"}, status=400)
 
+        # Only a booking still awaiting checkout can be cancelled, the buyer may
+        # have paid in another tab before the webhook arrived
+        if (
+            transaction_record.status != TransactionRecord.PaymentStatus.AWAITING_CHECKOUT
+            or checkout_session.verify_if_paid()
+        ):
+            return redirect(transaction_record)
+
+        transaction_record.update_status(TransactionRecord.PaymentStatus.CANCELLED)
+        return redirect(reverse("drill_suppers:index"))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class StripeWebhook(View):
+    def post(self, request, *args, **kwargs):
+        # Without a secret every signature would check out, forged ones included
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            return JsonResponse({"reason": "webhook secret not configured"}, status=400)
+
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body,
+                request.META.get("HTTP_STRIPE_SIGNATURE", ""),
+                settings.STRIPE_WEBHOOK_SECRET,
+            )
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return JsonResponse({"reason": "invalid event"}, status=400)
+
+        webhooks.handle_event(event)
+
+        return JsonResponse({"received": True})
 
+
+@method_decorator(staff_member_required, name="dispatch")
+class StripeStats(View):
+    def get(self, request, *args, **kwargs):
+        # Figures for the process that served the request
+        return JsonResponse(stripe_client.stats())
+
+
+class Availability(View):
+    """The drill nights on sale as JSON, for the members' app and notice boards."""
+
+    def get(self, request, *args, **kwargs):
+        body, etag, expires = caching.get_availability()
+        max_age = max(int((expires - utc_now()).total_seconds()), 0)
+
+        etag = f'"{etag}"'
+        response = get_conditional_response(request, etag=etag) or HttpResponse(
+            body, content_type="application/json"
+        )
+
+        # Never kept past the next cut-off, or beyond the maximum age
+        response["ETag"] = etag
+        patch_cache_control(response, public=True, max_age=max_age)
+        return response
+
+
+@method_decorator(cache_control(private=True, no_store=True), name="dispatch")
+class WaitingRoom(View):
+    """The holding page of a night's waiting room, which gives out queue numbers."""
+
+    def get(self, request, pk, *args, **kwargs):
+        rate = caching.get_waiting_rooms().get(pk)
+        if rate is None:
+            return redirect(reverse("drill_suppers:index"))
+
+        numbers = waiting_room.tickets(request)
+        number = numbers.get(pk)
+        issued, admitted = waiting_room.advance(
+            pk, waiting_room.admissions_per_minute(pk, rate)
+        )
+
+        if number is not None and number <= admitted:
+            return redirect(reverse("drill_suppers:index"))
+
+        # A number from before the queue expired would never be reached
+        new_ticket = number is None or number > issued
+        if new_ticket:
+            number = numbers[pk] = waiting_room.issue(pk)
+
+        status = waiting_room.status(pk, number)
+        response = render(
+            request,
+            "drill_suppers/waiting_room.html",
+            {
+                "drill_night_id": pk,
+                "drill_night": dict(caching.get_sellable_choices()).get(pk),
+                "status": status,
+                "minutes": math.ceil((status["wait"] or 0) / 60),
+                "status_url": reverse("drill_suppers:waiting_room_status", args=[pk]),
+            },
+        )
+        if new_ticket:
+            waiting_room.set_tickets(response, numbers)
+
+        return response
+
+
+# Polled by every buyer in the queue, so it reads only the cookie and Redis
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+@method_decorator(cache_control(private=True, no_store=True), name="dispatch")
+class WaitingRoomStatus(View):
+    def get(self, request, pk, *args, **kwargs):
+        return JsonResponse(waiting_room.status(pk, waiting_room.tickets(request).get(pk)))
+
+
+class StripeMetrics(View):
+    """Stripe call metrics for Prometheus, for staff or with the metrics token."""
+
+    def get(self, request, *args, **kwargs):
+        token = settings.DRILL_SUPPERS_METRICS_TOKEN
+        authorization = request.headers.get("Authorization", "")
+
+        if not (
+            request.user.is_staff
+            or (token and constant_time_compare(authorization, f"Bearer {token}"))
+        ):
+            return HttpResponse(status=401)
+
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+@method_decorator(
+    [
+        throttling.rate_limit("refund", keys=("session", "pk")),
+        throttling.rate_limit("refund_ip", keys=("ip",)),
+    ],
+    name="post",
+)
 class TransactionRecordRefund(UpdateView):
     model = TransactionRecord
     form_class = RefundForm
     template_name = "drill_suppers/transactionrecord_refund.html"
 
     def form_valid(self, form):
-        self.object.refund()
+        try:
+            self.object.refund()
+        except stripe_client.StripeUnavailableError:
+            # The worker retries the refund once Stripe is back
+            self.object.refund_later()
+            messages.info(
+                self.request,
+                "Your refund has been queued and will be made in the next few minutes",
+            )
+
         return redirect(self.object)
 
 
-@method_decorator(staff_member_required, name='dispatch')
+def drill_night_report_validators(request, pk):
+    """The ETag and Last-Modified of a night's report, from one indexed aggregate."""
+    row = (
+        DrillNight.objects.filter(pk=pk)
+        .annotate(
+            bookings=Count("transactionrecord"),
+            last_booking=Max("transactionrecord__updated_at"),
+        )
+        .values_list("updated_at", "bookings", "last_booking")
+        .first()
+    )
+
+    if row is None:
+        return None, None
+
+    updated_at, bookings, last_booking = row
+    last_modified = max(updated_at, last_booking or updated_at)
+
+    # The count changes when a booking is deleted, which the latest time may not
+    return f"{bookings}-{last_modified.timestamp()}", last_modified
+
+
+# The report is only for staff, so mustn't be stored by shared caches or
+# answered from another user's cached copy
+@method_decorator(
+    [
+        vary_on_cookie,
+        staff_member_required,
+        cache_control(private=True, no_cache=True),
+        conditional(drill_night_report_validators),
+    ],
+    name="get",
+)
 class DrillNightReport(DetailView):
     model = DrillNight
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        records = self.object.transactionrecord_set.all()
+
+        # Meals by status and the cache key for the bookings table, in one query
+        totals = TransactionRecord.booking_totals(self.object.pk)
+
+        context["totals"] = totals
+        context["subtotals"] = [
+            (status, label, totals[status])
+            for status, label in TransactionRecord.PaymentStatus.choices
+        ]
+        # Following the bookings live holds a request open for each report,
+        # which only an async worker can afford, so under WSGI the report is
+        # left to be refreshed
+        context["live_updates"] = isinstance(self.request, ASGIRequest)
+
+        if context["live_updates"]:
+            # Where the live updates for the open report start from
+            context["live_after"] = live.latest_id(self.object.pk)
+            live.watch(self.object.pk, settings.DRILL_SUPPERS_LIVE_TIMEOUT + live.WATCH_SECONDS)
+        # Only run if the cached table has to be rendered again. The related
+        # manager sets each record's drill night, so its id mustn't be deferred
+        context["bookings"] = records.order_by("name", "pk").only(
+            "drill_night", "name", "email", "quantity", "status", "dietary_notes"
+        )
+        return context
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class DrillNightExport(DetailView):
+    model = DrillNight
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get("format", "csv")
+        if export_format not in exports.FORMATS:
+            raise Http404("No such export format")
+
+        drill_night = self.get_object()
+        return exports.response(
+            exports.bookings(drill_nights=[drill_night]),
+            export_format,
+            f"bookings-{drill_night.date_time:%Y-%m-%d}",
+        )
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class BookingsExport(View):
+    template_name = "drill_suppers/bookings_export.html"
+
+    def get(self, request, *args, **kwargs):
+        if "start" not in request.GET:
+            return render(request, self.template_name, {"form": BookingsExportForm()})
+
+        form = BookingsExportForm(request.GET)
+        if not form.is_valid():
+            return render(request, self.template_name, {"form": form}, status=400)
+
+        start, end = form.cleaned_data["start"], form.cleaned_data["end"]
+        return exports.response(
+            exports.bookings(start=start, end=end),
+            form.cleaned_data["format"],
+            f"bookings-{start:%Y-%m-%d}-to-{end:%Y-%m-%d}",
+        )
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class RefundBatchProgress(DetailView):
+    model = RefundBatch
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["progress"] = self.object.progress()
+        context["failed"] = self.object.items.filter(
+            status__in=[RefundBatchItem.Status.FAILED, RefundBatchItem.Status.SKIPPED]
+        ).select_related("transaction_record")
+        return context
@@ -0,0 +1,237 @@
+"""
+Waiting rooms for drill nights expecting a rush when they go on sale.
+
+A buyer arriving at the purchase form while a night with a waiting room is
+on sale is sent to its holding page, which gives them the next number in
+the night's queue in a signed cookie. The page polls the status view until
+their number is admitted, then returns them to the form. Only admitted
+buyers can book the night, so the checkout and Stripe only see as many
+buyers as are let through.
+
+Numbers are admitted at the night's admissions per minute, and never
+faster than the meals left each minute, from a token bucket holding at
+most a minute of admissions. The queue is a counter and a hash in Redis,
+advanced by one Lua script, so every process shares it and a poll costs one
+round trip and no database query. When Redis can't be used the queue is
+kept in the memory of the process instead.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.shortcuts import redirect
+from django.urls import reverse
+from redis.exceptions import RedisError
+
+from . import caching
+
+logger = logging.getLogger(__name__)
+
+COOKIE_NAME = "drill_suppers_queue"
+COOKIE_SALT = "drill_suppers.waiting_room"
+
+# Queues of nights no one has joined or polled for this long are removed by Redis
+QUEUE_EXPIRE_SECONDS = 60 * 60 * 48
+# Seconds of admissions banked while no one is waiting, so a quiet queue lets
+# buyers straight in
+BURST_SECONDS = 60
+# Bounds on how often the holding page polls, further back buyers poll less
+MIN_POLL_SECONDS = 3
+MAX_POLL_SECONDS = 30
+
+# Admits the numbers the bucket has tokens for, up to the last number given
+# out, and returns the last number given out and the last admitted. The time
+# is returned as a string as Redis truncates Lua numbers to integers
+ADVANCE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local issued = tonumber(redis.call('GET', KEYS[2]) or '0')
+local state = redis.call('HMGET', KEYS[1], 'admitted', 'at')
+local admitted = tonumber(state[1]) or 0
+local at = math.max(tonumber(state[2]) or 0, now - tonumber(ARGV[3]))
+if rate > 0 then
+    local admitting = math.min(math.floor((now - at) * rate), issued - admitted)
+    if admitting > 0 then
+        admitted = admitted + admitting
+        at = at + admitting / rate
+    end
+else
+    at = now
+end
+redis.call('HSET', KEYS[1], 'admitted', admitted, 'at', tostring(at))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return {issued, admitted}
+"""
+
+_local_issued = {}
+_local_state = {}
+_local_lock = threading.Lock()
+
+
+def issued_key(drill_night_id) -> str:
+    return f"drill_suppers:queue:{drill_night_id}:issued"
+
+
+def state_key(drill_night_id) -> str:
+    return f"drill_suppers:queue:{drill_night_id}:state"
+
+
+def get_client():
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        # The configured cache isn't backed by Redis
+        return None
+
+
+def issue(drill_night_id) -> int:
+    """Give out the next number in a night's queue."""
+    client = get_client()
+
+    if client is not None:
+        try:
+            pipeline = client.pipeline()
+            pipeline.incr(issued_key(drill_night_id))
+            pipeline.expire(issued_key(drill_night_id), QUEUE_EXPIRE_SECONDS)
+            return pipeline.execute()[0]
+        except RedisError:
+            logger.warning("Redis unavailable, queueing in process", exc_info=True)
+
+    with _local_lock:
+        _local_issued[drill_night_id] = _local_issued.get(drill_night_id, 0) + 1
+        return _local_issued[drill_night_id]
+
+
+def advance_local(drill_night_id, now: float, rate: float) -> Tuple[int, int]:
+    with _local_lock:
+        issued = _local_issued.get(drill_night_id, 0)
+        admitted, at = _local_state.get(drill_night_id, (0, 0))
+        at = max(at, now - BURST_SECONDS)
+
+        if rate > 0:
+            admitting = min(math.floor((now - at) * rate), issued - admitted)
+            if admitting > 0:
+                admitted += admitting
+                at += admitting / rate
+        else:
+            at = now
+
+        _local_state[drill_night_id] = (admitted, at)
+        return issued, admitted
+
+
+def admissions_per_minute(drill_night_id, rate: int) -> int:
+    """The night's rate, slowed to the meals left so a sold out night admits no one."""
+    body, _, _ = caching.get_availability()
+    remaining = {
+        night["id"]: night["remaining"] for night in json.loads(body)["drill_nights"]
+    }.get(drill_night_id)
+
+    return rate if remaining is None else min(rate, remaining)
+
+
+def advance(drill_night_id, per_minute: int) -> Tuple[int, int]:
+    """Admit the numbers due at per_minute, returning the last issued and admitted."""
+    per_second = per_minute / 60
+    now = time.time()
+    client = get_client()
+
+    if client is not None:
+        try:
+            issued, admitted = client.register_script(ADVANCE_SCRIPT)(
+                keys=[state_key(drill_night_id), issued_key(drill_night_id)],
+                args=[now, per_second, BURST_SECONDS, QUEUE_EXPIRE_SECONDS],
+            )
+            return int(issued), int(admitted)
+        except RedisError:
+            logger.warning("Redis unavailable, queueing in process", exc_info=True)
+
+    return advance_local(drill_night_id, now, per_second)
+
+
+def tickets(request) -> dict:
+    """The queue numbers held by the client, by night."""
+    try:
+        value = request.get_signed_cookie(
+            COOKIE_NAME,
+            salt=COOKIE_SALT,
+            max_age=settings.DRILL_SUPPERS_QUEUE_TICKET_HOURS * 60 * 60,
+        )
+        return {int(pk): number for pk, number in json.loads(value).items()}
+    except (KeyError, signing.BadSignature, ValueError, AttributeError):
+        return {}
+
+
+def set_tickets(response, numbers: dict) -> None:
+    response.set_signed_cookie(
+        COOKIE_NAME,
+        json.dumps(numbers),
+        salt=COOKIE_SALT,
+        max_age=settings.DRILL_SUPPERS_QUEUE_TICKET_HOURS * 60 * 60,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def status(drill_night_id, number: Optional[int]) -> dict:
+    """Where a number stands in a night's queue, for the holding page."""
+    rate = caching.get_waiting_rooms().get(drill_night_id)
+
+    # The waiting room has closed, or the night has gone off sale
+    if rate is None:
+        return {
+            "admitted": True,
+            "position": 0,
+            "wait": 0,
+            "sold_out": False,
+            "poll": MIN_POLL_SECONDS,
+        }
+
+    per_minute = admissions_per_minute(drill_night_id, rate)
+    _, admitted = advance(drill_night_id, per_minute)
+    position = 0 if number is None else max(number - admitted, 0)
+    wait = math.ceil(position * 60 / per_minute) if per_minute else None
+
+    return {
+        "admitted": number is not None and number <= admitted,
+        "position": position,
+        "wait": wait,
+        "sold_out": per_minute == 0,
+        "poll": min(max((wait or 0) // 4, MIN_POLL_SECONDS), MAX_POLL_SECONDS),
+    }
+
+
+def queue_redirect(request, drill_night_id=None):
+    """A redirect to the holding page of a waiting room the client hasn't been admitted from.
+
+    Checks the given night, or every night with a waiting room when none is
+    given, and returns None when the client may go on.
+    """
+    waiting_rooms = caching.get_waiting_rooms()
+
+    if drill_night_id is None:
+        drill_night_ids = list(waiting_rooms)
+    else:
+        try:
+            drill_night_ids = [int(drill_night_id)] if int(drill_night_id) in waiting_rooms else []
+        except ValueError:
+            # Left to the form to reject
+            drill_night_ids = []
+
+    numbers = tickets(request)
+
+    for pk in drill_night_ids:
+        number = numbers.get(pk)
+
+        if number is None or number > advance(pk, admissions_per_minute(pk, waiting_rooms[pk]))[1]:
+            return redirect(reverse("drill_suppers:waiting_room", args=[pk]))
+
+    return None
@@ -0,0 +1,81 @@
+"""
+Handlers for the Stripe webhook events that settle drill supper purchases.
+
+Stripe may deliver an event more than once, or out of order, so every
+handler only moves a record on from the status it is expected to be in.
+"""
+import logging
+
+from .models import StripeCheckoutSession, TransactionRecord
+
+logger = logging.getLogger(__name__)
+
+
+def get_checkout_session(**lookup):
+    try:
+        return StripeCheckoutSession.objects.select_related("transaction_record").get(
+            **lookup
+        )
+    except StripeCheckoutSession.DoesNotExist:
+        logger.info("No checkout session for %s", lookup)
+        return None
+
+
+def checkout_session_completed(session) -> None:
+    checkout_session = get_checkout_session(session_id=session.id)
+
+    if checkout_session is None:
+        return
+
+    if session.payment_intent and not checkout_session.payment_intent:
+        checkout_session.payment_intent = session.payment_intent
+        checkout_session.save(update_fields=["payment_intent"])
+
+    transaction_record = checkout_session.transaction_record
+
+    if (
+        session.payment_status == "paid"
+        and transaction_record.status == TransactionRecord.PaymentStatus.AWAITING_CHECKOUT
+    ):
+        transaction_record.update_status(TransactionRecord.PaymentStatus.PAID)
+
+
+def checkout_session_expired(session) -> None:
+    checkout_session = get_checkout_session(session_id=session.id)
+
+    if checkout_session is None:
+        return
+
+    transaction_record = checkout_session.transaction_record
+
+    if transaction_record.status == TransactionRecord.PaymentStatus.AWAITING_CHECKOUT:
+        transaction_record.update_status(TransactionRecord.PaymentStatus.CANCELLED)
+
+
+def charge_refunded(charge) -> None:
+    if not charge.payment_intent:
+        return
+
+    checkout_session = get_checkout_session(payment_intent=charge.payment_intent)
+
+    if checkout_session is None:
+        return
+
+    transaction_record = checkout_session.transaction_record
+
+    if transaction_record.status == TransactionRecord.PaymentStatus.PAID:
+        transaction_record.update_status(TransactionRecord.PaymentStatus.REFUNDED)
+
+
+HANDLERS = {
+    "checkout.session.completed": checkout_session_completed,
+    "checkout.session.expired": checkout_session_expired,
+    "charge.refunded": charge_refunded,
+}
+
+
+def handle_event(event) -> None:
+    handler = HANDLERS.get(event.type)
+
+    if handler is not None:
+        handler(event.data.object)
@@ -0,0 +1,43 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """A paginator that takes the size of a large unfiltered table from Postgres' statistics.
+
+    COUNT(*) reads the whole table, which at hundreds of thousands of rows
+    costs more than the page itself. The estimate is kept up to date by
+    autovacuum, and is only used above threshold rows and when nothing is
+    filtered, so small and filtered lists keep their exact counts.
+    """
+
+    threshold = 10000
+
+    @cached_property
+    def count(self) -> int:
+        if isinstance(self.object_list, QuerySet):
+            estimate = self.estimated_count(self.object_list)
+
+            if estimate is not None and estimate >= self.threshold:
+                return estimate
+
+        return super().count
+
+    @staticmethod
+    def estimated_count(queryset: QuerySet):
+        connection = connections[queryset.db]
+
+        if connection.vendor != "postgresql" or queryset.query.where:
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+
+        # -1 for a table that has never been analysed
+        return int(row[0]) if row and row[0] >= 0 else None
@@ -0,0 +1,54 @@
+import os
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from django.contrib import messages
+from django.template.loader import get_template
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+from django.views.generic import TemplateView
+
+
+def conditional(validators):
+    """Answer conditional GETs with 304 Not Modified before the view runs.
+
+    validators(request, *args, **kwargs) returns the (etag, last_modified)
+    of the page, or (None, None) to always run the view, and is called once
+    per request so both can come from a single query.
+    """
+
+    def etag(request, *args, **kwargs):
+        request.validators = validators(request, *args, **kwargs)
+        return request.validators[0]
+
+    def last_modified(request, *args, **kwargs):
+        return request.validators[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+@lru_cache(maxsize=None)
+def templates_last_modified(*template_names: str) -> datetime:
+    # Templates only change with a deploy, which restarts the process
+    mtimes = [
+        os.path.getmtime(get_template(name).origin.name) for name in template_names
+    ]
+    return datetime.fromtimestamp(max(mtimes), timezone.utc)
+
+
+class StaticPageView(TemplateView):
+    """A page rendered from its template alone, answering 304 until a deploy changes it."""
+
+    def validators(self, request, *args, **kwargs):
+        # Flash messages are shown once, so the page must be rendered to show them
+        if len(messages.get_messages(request)):
+            return None, None
+
+        return None, templates_last_modified(self.template_name, "base.html")
+
+    @method_decorator([vary_on_cookie, cache_control(no_cache=True)])
+    def dispatch(self, request, *args, **kwargs):
+        view = conditional(self.validators)(super().dispatch)
+        return view(request, *args, **kwargs)
@@ -0,0 +1,138 @@
+"""
+Measure the queries and latency of the drill night admin changelist.
+
+Seeds NIGHTS drill nights and TRANSACTIONS transactions into the configured
+(empty, Postgres) database, then fetches each changelist page RUNS times as
+a superuser, with the changelist as it is and as Django's defaults would
+have it: an exact COUNT(*) for the pages and another for the total, every
+field of each night loaded, and no bookings column. Run with:
+
+    python manage.py shell < scripts/benchmark_admin_changelist.py
+"""
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from hac_shop.drill_suppers.admin import DrillNightAdmin
+from hac_shop.drill_suppers.models import DrillNight, TransactionRecord
+from hac_shop.users.models import User
+
+NIGHTS = 10_000
+TRANSACTIONS = 500_000
+RUNS = 5
+
+
+def seed():
+    if DrillNight.objects.count() >= NIGHTS:
+        return
+
+    start = datetime.now(timezone.utc) - timedelta(days=NIGHTS // 2)
+    DrillNight.objects.bulk_create(
+        [
+            DrillNight(
+                date_time=start + timedelta(days=day, hours=21),
+                cut_off_time=start + timedelta(days=day, hours=18),
+                on_sale=False,
+            )
+            for day in range(NIGHTS)
+        ],
+        batch_size=1000,
+    )
+
+    drill_nights = list(DrillNight.objects.values_list("pk", flat=True))
+    statuses = TransactionRecord.PaymentStatus.values
+    for offset in range(0, TRANSACTIONS, 50_000):
+        TransactionRecord.objects.bulk_create(
+            (
+                TransactionRecord(
+                    drill_night_id=random.choice(drill_nights),
+                    name=f"Member {i}",
+                    email=f"member{i}@example.com",
+                    quantity=random.randint(1, 5),
+                    status=random.choice(statuses),
+                )
+                for i in range(offset, offset + 50_000)
+            ),
+            batch_size=5000,
+        )
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+
+def measure(client, url):
+    timings = []
+
+    for _ in range(RUNS):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - started)
+
+        assert response.status_code == 200, response.status_code
+
+    return len(queries), statistics.median(timings) * 1000
+
+
+def django_defaults():
+    return mock.patch.multiple(
+        DrillNightAdmin,
+        paginator=Paginator,
+        show_full_result_count=True,
+        list_display=[
+            field for field in DrillNightAdmin.list_display if field != "paid_bookings"
+        ],
+        get_changelist=lambda self, request, **kwargs: ChangeList,
+    )
+
+
+seed()
+settings.ALLOWED_HOSTS = ["*"]
+settings.DEBUG = False
+
+user, _ = User.objects.get_or_create(
+    username="changelist-benchmark", defaults={"is_staff": True, "is_superuser": True}
+)
+client = Client()
+client.force_login(user)
+
+changelist = reverse("admin:drill_suppers_drillnight_changelist")
+# Pages are numbered from 0
+last_page = (DrillNight.objects.count() - 1) // DrillNightAdmin.list_per_page
+year = DrillNight.objects.order_by("-date_time").values_list("date_time", flat=True)[0].year
+pages = [
+    ("first page", changelist),
+    ("last page", f"{changelist}?p={last_page}"),
+    ("newest first", f"{changelist}?o=-1"),
+    ("one year", f"{changelist}?date_time__year={year}"),
+]
+
+print(
+    f"{DrillNight.objects.count()} nights, {TransactionRecord.objects.count()} "
+    f"transactions on {connection.vendor}, median of {RUNS}"
+)
+
+try:
+    for name, url in pages:
+        queries, milliseconds = measure(client, url)
+
+        with django_defaults():
+            default_queries, default_milliseconds = measure(client, url)
+
+        print(
+            f"{name:>12}: {queries} queries {milliseconds:.0f}ms, "
+            f"Django defaults {default_queries} queries {default_milliseconds:.0f}ms"
+        )
+finally:
+    user.delete()
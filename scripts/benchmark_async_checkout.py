@@ -0,0 +1,77 @@
+"""
+Compare creating Stripe checkout sessions from a fixed pool of sync workers,
+as gunicorn's sync workers do, with the async path used by the ASGI views,
+against the fake Stripe server with injected latency.
+
+    python manage.py shell < scripts/benchmark_async_checkout.py
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import stripe
+from django.db import connection
+
+from hac_shop.drill_suppers.models import (
+    DrillNight,
+    StripeCheckoutSession,
+    TransactionRecord,
+)
+from scripts import fake_stripe_server
+
+CHECKOUTS = 200
+SYNC_WORKERS = 8
+LATENCY = 0.3
+
+stripe.api_base = fake_stripe_server.start(latency=LATENCY)
+
+drill_night = DrillNight.objects.create(
+    date_time=datetime.now(timezone.utc) + timedelta(days=7),
+    cut_off_time=datetime.now(timezone.utc) + timedelta(days=7, hours=-3),
+)
+
+
+def checkout_sessions():
+    sessions = []
+
+    for i in range(CHECKOUTS):
+        transaction_record = TransactionRecord.objects.create(
+            drill_night=drill_night, name=f"Member {i}", email=f"member{i}@example.com"
+        )
+        sessions.append(
+            StripeCheckoutSession.objects.create(transaction_record=transaction_record)
+        )
+
+    return sessions
+
+
+def generate_session(checkout_session):
+    checkout_session.generate_session()
+    connection.close()
+
+
+def report(label, elapsed):
+    print(
+        f"{label}: {CHECKOUTS} checkouts in {elapsed:.2f}s "
+        f"({CHECKOUTS / elapsed:.1f}/s) with {LATENCY * 1000:.0f}ms Stripe latency"
+    )
+
+
+sessions = checkout_sessions()
+started = time.perf_counter()
+with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as pool:
+    list(pool.map(generate_session, sessions))
+report(f"Sync, {SYNC_WORKERS} workers", time.perf_counter() - started)
+
+
+async def generate_sessions(sessions):
+    await asyncio.gather(*(session.agenerate_session() for session in sessions))
+
+
+sessions = checkout_sessions()
+started = time.perf_counter()
+asyncio.run(generate_sessions(sessions))
+report("Async, 1 process", time.perf_counter() - started)
+
+drill_night.delete()
@@ -0,0 +1,103 @@
+"""
+Measure the peak memory and speed of the bookings exports.
+
+ROWS transaction records are made for one drill night, then each export is
+run to completion in a forked process, which reports how far its peak RSS
+grew during the export and how many rows a second it wrote. Building the
+whole export in memory, as the HTML report does, is measured alongside for
+comparison. Run against a local database with:
+
+    python manage.py shell < scripts/benchmark_exports.py
+"""
+import csv
+import io
+import multiprocessing
+import resource
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.db import connection, connections
+
+from hac_shop.drill_suppers import exports
+from hac_shop.drill_suppers.models import DrillNight, TransactionRecord
+
+ROWS = 100_000
+
+
+def in_memory():
+    # Every record loaded at once, as a template looping over the queryset would
+    records = list(TransactionRecord.objects.select_related("drill_night"))
+    output = io.StringIO()
+    csv.writer(output).writerows(
+        [str(record.drill_night), record.name, record.email, record.quantity]
+        for record in records
+    )
+    return output.getvalue().encode()
+
+
+def streamed(export_format):
+    def run():
+        response = exports.response(exports.bookings(), export_format, "bookings")
+        return response.streaming_content
+
+    return run
+
+
+def measure(name, export, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    content = export()
+    size = sum(len(chunk) for chunk in content) if not isinstance(content, bytes) else len(content)
+    elapsed = time.perf_counter() - started
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((name, elapsed, size, (peak - before) / 1024))
+    connection.close()
+
+
+drill_night = DrillNight.objects.create(
+    date_time=datetime.now(timezone.utc) + timedelta(days=365),
+    cut_off_time=datetime.now(timezone.utc) + timedelta(days=364),
+    annotation="Export benchmark",
+    on_sale=False,
+)
+
+try:
+    TransactionRecord.objects.bulk_create(
+        [
+            TransactionRecord(
+                drill_night=drill_night,
+                name=f"Benchmark Buyer {number}",
+                email=f"buyer-{number}@example.com",
+                quantity=number % 5 + 1,
+                dietary_notes="No nuts" if number % 10 == 0 else "",
+            )
+            for number in range(ROWS)
+        ],
+        batch_size=5000,
+    )
+    total = TransactionRecord.objects.count()
+
+    fork = multiprocessing.get_context("fork")
+    results = fork.Queue()
+    print(f"{total} rows on {connection.vendor}")
+
+    for name, export in [
+        ("in memory csv", in_memory),
+        ("streamed csv", streamed("csv")),
+        ("streamed xlsx", streamed("xlsx")),
+    ]:
+        # Each process must have its own connection
+        connections.close_all()
+        process = fork.Process(target=measure, args=(name, export, results))
+        process.start()
+        name, elapsed, size, peak_mb = results.get()
+        process.join()
+
+        print(
+            f"{name:>14}: {elapsed:.2f}s, {total / elapsed:,.0f} rows/s, "
+            f"{size / 1024 / 1024:.1f}MB written, peak RSS +{peak_mb:.1f}MB"
+        )
+finally:
+    drill_night.delete()
@@ -0,0 +1,75 @@
+"""
+Measure how many jobs a second the database job queue runs as workers are
+added.
+
+For each worker count the queue is filled with JOBS jobs, which each sleep
+for JOB_SECONDS to stand in for a Stripe call, and that many worker
+processes run it until it is empty. Run against a local Postgres database
+(SKIP LOCKED isn't available on SQLite) with:
+
+    python manage.py shell < scripts/benchmark_job_queue.py
+
+The benchmark refuses to run unless DEBUG is on and the database holds no
+jobs but its own.
+"""
+import multiprocessing
+import time
+
+from django.conf import settings
+from django.db import connection, connections
+
+from hac_shop.drill_suppers import jobs
+from hac_shop.drill_suppers.models import Job
+
+JOBS = 2000
+JOB_SECONDS = 0.005
+WORKER_COUNTS = [1, 2, 4, 8, 16]
+BATCH_SIZES = [1, 10]
+
+
+def fill():
+    Job.objects.filter(function="time.sleep").delete()
+    Job.objects.bulk_create(
+        [Job(function="time.sleep", args=[JOB_SECONDS]) for _ in range(JOBS)],
+        batch_size=1000,
+    )
+
+
+def run_worker(batch_size):
+    jobs.work(batch_size=batch_size, burst=True)
+    connection.close()
+
+
+if connection.vendor != "postgresql":
+    raise SystemExit("The job queue benchmark needs a Postgres database")
+
+if not settings.DEBUG or Job.objects.exclude(function="time.sleep").exists():
+    raise SystemExit("The job queue benchmark needs a local database with no other jobs")
+
+fork = multiprocessing.get_context("fork")
+
+print(f"{JOBS} jobs of {JOB_SECONDS * 1000:.0f}ms each")
+
+for batch_size in BATCH_SIZES:
+    for workers in WORKER_COUNTS:
+        fill()
+        # The workers must not share the parent's connection
+        connections.close_all()
+
+        started = time.perf_counter()
+        processes = [
+            fork.Process(target=run_worker, args=(batch_size,)) for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        done = Job.objects.filter(status=Job.Status.DONE).count()
+        print(
+            f"{workers:>2} workers, batches of {batch_size:>2}: "
+            f"{done} jobs in {elapsed:.2f}s ({done / elapsed:.0f} jobs/s)"
+        )
+
+Job.objects.all().delete()
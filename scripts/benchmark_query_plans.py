@@ -0,0 +1,111 @@
+"""
+Compare the query plans of the drill supper queries with and without the
+indexes added in migration 0012.
+
+Seeds several years of drill nights and 100k+ transactions into the
+configured (empty, Postgres) database, then run with:
+
+    python manage.py shell < scripts/benchmark_query_plans.py
+
+The "before" plans are taken inside a transaction that drops the indexes
+and is then rolled back, so the database is left as it was.
+"""
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.db import connection, models, transaction
+
+from hac_shop.drill_suppers.models import DrillNight, TransactionRecord
+
+YEARS = 6
+TRANSACTIONS = 150_000
+
+INDEXES = [
+    (DrillNight, "drillnight_sellable_idx"),
+    (TransactionRecord, "transaction_night_status_idx"),
+    (TransactionRecord, "transaction_status_idx"),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+def seed():
+    if DrillNight.objects.count() >= YEARS * 104:
+        return
+
+    start = datetime.now(timezone.utc) - timedelta(weeks=52 * (YEARS - 1))
+    DrillNight.objects.bulk_create(
+        [
+            DrillNight(
+                date_time=start + timedelta(weeks=week, days=day, hours=21),
+                cut_off_time=start + timedelta(weeks=week, days=day, hours=18),
+                on_sale=start + timedelta(weeks=week) > datetime.now(timezone.utc),
+            )
+            for week in range(52 * YEARS)
+            for day in (1, 2)
+        ],
+        batch_size=1000,
+    )
+
+    drill_nights = list(DrillNight.objects.only("pk"))
+    statuses = [choice for choice, _ in TransactionRecord.PaymentStatus.choices]
+    TransactionRecord.objects.bulk_create(
+        (
+            TransactionRecord(
+                drill_night=random.choice(drill_nights),
+                name=f"Member {i}",
+                email=f"member{i}@example.com",
+                quantity=random.randint(1, 5),
+                status=random.choices(statuses, weights=[1, 20, 2, 2])[0],
+            )
+            for i in range(TRANSACTIONS)
+        ),
+        batch_size=5000,
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def explain(label):
+    print(f"\n==== {label} ====")
+
+    drill_night = DrillNight.objects.order_by("-date_time")[52].pk
+    plans = {
+        "sellable nights": DrillNight.sellable.all(),
+        "meal totals for a night": TransactionRecord.objects.filter(
+            drill_night=drill_night, status=TransactionRecord.PaymentStatus.PAID
+        ).values("drill_night").annotate(sold=models.Sum("quantity")),
+        "admin status filter": TransactionRecord.objects.filter(
+            status=TransactionRecord.PaymentStatus.REFUNDED,
+            drill_night__date_time__year=datetime.now().year,
+        ),
+    }
+
+    for name, queryset in plans.items():
+        started = time.perf_counter()
+        plan = queryset.explain(analyze=True, buffers=True)
+        print(f"\n-- {name} ({(time.perf_counter() - started) * 1000:.1f}ms)\n{plan}")
+
+
+if connection.vendor != "postgresql":
+    raise SystemExit("The query plan benchmark needs a Postgres database")
+
+seed()
+
+try:
+    with transaction.atomic():
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for model, name in INDEXES:
+                index = next(i for i in model._meta.indexes if i.name == name)
+                schema_editor.remove_index(model, index)
+
+        explain("Before, without the indexes")
+        raise Rollback
+except Rollback:
+    pass
+
+explain("After, with the indexes")
@@ -0,0 +1,527 @@
+"""
+A stand-in for the parts of the Stripe API the drill suppers app uses, for
+load testing the whole purchase flow and for working offline.
+
+It serves checkout sessions (create, retrieve, expire and list), prices and
+refunds, and sends signed webhook events to the app as sessions are paid,
+expire or are refunded. Responses can be slowed down with a latency
+distribution, and a share of them turned into 500 errors or 429 rate limit
+responses, so the app can be measured against Stripe having a bad day.
+
+Run it on its own:
+
+    python scripts/fake_stripe_server.py --port 12111 --latency 0.3 \\
+        --latency-distribution lognormal --error-rate 0.01 --rate-limit 100 \\
+        --webhook-url http://localhost:8000/supper/stripe/webhook \\
+        --webhook-secret whsec_test
+
+and start the app with STRIPE_API_BASE=http://127.0.0.1:12111 and the same
+STRIPE_WEBHOOK_SECRET, or start it in a background thread with start().
+
+Nobody completes the checkout pages, so a session is paid for with
+
+    POST /_fake/checkout/sessions/<id>/pay
+
+which sends checkout.session.completed like a real payment would. Counts of
+the requests served and errors injected are at GET /_fake/stats.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class Latency:
+    """Seconds to wait before answering each request, drawn from a distribution."""
+
+    DISTRIBUTIONS = ["constant", "uniform", "exponential", "lognormal"]
+
+    def __init__(self, mean: float = 0.0, distribution: str = "constant", spread: float = 0.5):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution}")
+
+        self.mean = mean
+        self.distribution = distribution
+        self.spread = spread
+
+    def sample(self) -> float:
+        if self.mean <= 0:
+            return 0.0
+
+        if self.distribution == "uniform":
+            return random.uniform(self.mean * (1 - self.spread), self.mean * (1 + self.spread))
+
+        if self.distribution == "exponential":
+            return random.expovariate(1 / self.mean)
+
+        if self.distribution == "lognormal":
+            # A long tail with the given mean, spread is the shape parameter sigma
+            mu = math.log(self.mean) - self.spread ** 2 / 2
+            return random.lognormvariate(mu, self.spread)
+
+        return self.mean
+
+
+class TokenBucket:
+    """Allows rate requests a second on average, in bursts of up to rate."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+def error(status: int, error_type: str, message: str, code: Optional[str] = None):
+    body = {"type": error_type, "message": message}
+
+    if code:
+        body["code"] = code
+
+    return status, {"error": body}
+
+
+def first(params: dict, name: str, default=None):
+    return params.get(name, [default])[0]
+
+
+class FakeStripe:
+    WEBHOOK_ATTEMPTS = 4
+
+    def __init__(
+        self,
+        latency: Optional[Latency] = None,
+        error_rate: float = 0.0,
+        rate_limit: Optional[float] = None,
+        webhook_url: Optional[str] = None,
+        webhook_secret: str = "",
+    ) -> None:
+        self.latency = latency or Latency()
+        self.error_rate = error_rate
+        self.rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+
+        self.sessions: dict = {}
+        self.refunds: dict = {}
+        self.idempotent_responses: dict = {}
+        self.stats = Counter()
+        self.webhook_tasks: set = set()
+        self.webhook_client: Optional[httpx.AsyncClient] = None
+
+    # Webhooks
+
+    def send_event(self, event_type: str, data_object: dict) -> None:
+        if not self.webhook_url:
+            return
+
+        task = asyncio.get_running_loop().create_task(
+            self.post_event(event_type, dict(data_object))
+        )
+        # Keep a reference until it's sent, the loop only holds a weak one
+        self.webhook_tasks.add(task)
+        task.add_done_callback(self.webhook_tasks.discard)
+
+    async def post_event(self, event_type: str, data_object: dict) -> None:
+        payload = json.dumps(
+            {
+                "id": f"evt_test_{uuid.uuid4().hex}",
+                "object": "event",
+                "type": event_type,
+                "created": int(time.time()),
+                "livemode": False,
+                "data": {"object": data_object},
+            }
+        )
+        timestamp = int(time.time())
+        signature = hmac.new(
+            self.webhook_secret.encode(),
+            f"{timestamp}.{payload}".encode(),
+            hashlib.sha256,
+        ).hexdigest()
+
+        if self.webhook_client is None:
+            self.webhook_client = httpx.AsyncClient(timeout=30)
+
+        # Stripe retries failed deliveries with backoff, over days rather than seconds
+        for attempt in range(self.WEBHOOK_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(2 ** attempt)
+
+            try:
+                response = await self.webhook_client.post(
+                    self.webhook_url,
+                    content=payload,
+                    headers={
+                        "Content-Type": "application/json",
+                        "Stripe-Signature": f"t={timestamp},v1={signature}",
+                    },
+                )
+                self.stats[f"webhook {event_type} {response.status_code}"] += 1
+
+                if response.is_success:
+                    return
+            except httpx.HTTPError as exception:
+                logger.warning("Sending %s failed: %s", event_type, exception)
+                self.stats[f"webhook {event_type} failed"] += 1
+
+    # Checkout sessions
+
+    def create_checkout_session(self, params: dict):
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "url": f"https://checkout.stripe.com/pay/{session_id}",
+            "client_reference_id": first(params, "client_reference_id"),
+            "customer_email": first(params, "customer_email"),
+            "success_url": first(params, "success_url"),
+            "cancel_url": first(params, "cancel_url"),
+            "mode": first(params, "mode", "payment"),
+            "status": "open",
+            "payment_status": "unpaid",
+            "payment_intent": f"pi_test_{uuid.uuid4().hex}",
+            "expires_at": int(first(params, "expires_at", time.time() + 24 * 60 * 60)),
+            "created": int(time.time()),
+        }
+        self.sessions[session_id] = session
+
+        return 200, session
+
+    def retrieve_checkout_session(self, session_id: str):
+        if session_id not in self.sessions:
+            return error(
+                404, "invalid_request_error", f"No such checkout.session: '{session_id}'"
+            )
+
+        return 200, self.sessions[session_id]
+
+    def expire_checkout_session(self, session_id: str):
+        status, session = self.retrieve_checkout_session(session_id)
+
+        if status != 200:
+            return status, session
+
+        if session["status"] != "open":
+            return error(
+                400,
+                "invalid_request_error",
+                "Only Checkout Sessions with a status in [open] can be expired",
+            )
+
+        session["status"] = "expired"
+        self.send_event("checkout.session.expired", session)
+
+        return 200, session
+
+    def list_checkout_sessions(self, params: dict):
+        sessions = list(reversed(self.sessions.values()))
+
+        if first(params, "payment_intent"):
+            sessions = [
+                session
+                for session in sessions
+                if session["payment_intent"] == first(params, "payment_intent")
+            ]
+
+        if first(params, "created[gte]"):
+            sessions = [
+                session
+                for session in sessions
+                if session["created"] >= int(first(params, "created[gte]"))
+            ]
+
+        starting_after = first(params, "starting_after")
+        if starting_after:
+            ids = [session["id"] for session in sessions]
+            sessions = sessions[ids.index(starting_after) + 1:] if starting_after in ids else []
+
+        limit = min(int(first(params, "limit", 10)), 100)
+
+        return 200, {
+            "object": "list",
+            "url": "/v1/checkout/sessions",
+            "data": sessions[:limit],
+            "has_more": len(sessions) > limit,
+        }
+
+    def pay_checkout_session(self, session_id: str):
+        status, session = self.retrieve_checkout_session(session_id)
+
+        if status != 200:
+            return status, session
+
+        if session["status"] != "open":
+            return error(400, "invalid_request_error", "The checkout session isn't open")
+
+        session.update(status="complete", payment_status="paid")
+        self.send_event("checkout.session.completed", session)
+
+        return 200, session
+
+    # Prices and refunds
+
+    def create_price(self, params: dict):
+        price = {
+            "id": f"price_test_{uuid.uuid4().hex}",
+            "object": "price",
+            "currency": first(params, "currency", "gbp").lower(),
+            "unit_amount": int(first(params, "unit_amount", 0)),
+            "tax_behavior": first(params, "tax_behavior"),
+            "active": True,
+        }
+
+        return 200, price
+
+    def create_refund(self, params: dict):
+        payment_intent = first(params, "payment_intent")
+        paid = [
+            session
+            for session in self.sessions.values()
+            if session["payment_intent"] == payment_intent
+            and session["payment_status"] == "paid"
+        ]
+
+        if not paid:
+            return error(
+                400,
+                "invalid_request_error",
+                f"No paid payment intent: '{payment_intent}'",
+                code="resource_missing",
+            )
+
+        if payment_intent in self.refunds:
+            return error(
+                400,
+                "invalid_request_error",
+                f"Charge for {payment_intent} has already been refunded.",
+                code="charge_already_refunded",
+            )
+
+        refund = {
+            "id": f"re_test_{uuid.uuid4().hex}",
+            "object": "refund",
+            "payment_intent": payment_intent,
+            "status": "succeeded",
+            "created": int(time.time()),
+        }
+        self.refunds[payment_intent] = refund
+        self.send_event(
+            "charge.refunded",
+            {
+                "id": f"ch_test_{uuid.uuid4().hex}",
+                "object": "charge",
+                "payment_intent": payment_intent,
+                "refunded": True,
+            },
+        )
+
+        return 200, refund
+
+    # Routing
+
+    def route(self, method: str, path: str, params: dict):
+        parts = path.strip("/").split("/")
+
+        if parts[:3] == ["v1", "checkout", "sessions"]:
+            if method == "POST" and len(parts) == 3:
+                return self.create_checkout_session(params)
+
+            if method == "GET" and len(parts) == 3:
+                return self.list_checkout_sessions(params)
+
+            if method == "GET" and len(parts) == 4:
+                return self.retrieve_checkout_session(parts[3])
+
+            if method == "POST" and len(parts) == 5 and parts[4] == "expire":
+                return self.expire_checkout_session(parts[3])
+
+        if method == "POST" and parts == ["v1", "prices"]:
+            return self.create_price(params)
+
+        if method == "POST" and parts == ["v1", "refunds"]:
+            return self.create_refund(params)
+
+        if method == "POST" and parts[:3] == ["_fake", "checkout", "sessions"] and parts[4:] == ["pay"]:
+            return self.pay_checkout_session(parts[3])
+
+        if method == "GET" and parts == ["_fake", "stats"]:
+            return 200, dict(self.stats)
+
+        return error(404, "invalid_request_error", f"Unrecognized request URL ({method}: {path})")
+
+    def endpoint(self, method: str, path: str) -> str:
+        """The request counted in the stats, without any object ID."""
+        parts = [
+            "<id>" if part.startswith(("cs_", "price_", "re_")) else part
+            for part in path.strip("/").split("/")
+        ]
+        return f"{method} /{'/'.join(parts)}"
+
+    async def respond(self, method: str, target: str, headers: dict, body: bytes):
+        url = urlsplit(target)
+        params = parse_qs(body.decode() if method == "POST" else url.query)
+
+        # Only the Stripe API is slowed down and made to fail
+        if not url.path.startswith("/_fake/"):
+            self.stats[self.endpoint(method, url.path)] += 1
+            await asyncio.sleep(self.latency.sample())
+
+            if self.rate_limiter and not self.rate_limiter.take():
+                self.stats["rate limited"] += 1
+                return error(
+                    429,
+                    "invalid_request_error",
+                    "Request rate limit exceeded.",
+                    code="rate_limit",
+                )
+
+            if random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return error(500, "api_error", "Injected server error")
+
+        # Stripe answers a repeated idempotency key with the first response
+        key = headers.get("idempotency-key")
+        if method == "POST" and key and key in self.idempotent_responses:
+            self.stats["idempotent replays"] += 1
+            return self.idempotent_responses[key]
+
+        response = self.route(method, url.path, params)
+
+        if method == "POST" and key:
+            self.idempotent_responses[key] = response
+
+        return response
+
+    async def handle(self, reader, writer) -> None:
+        # One HTTP/1.1 connection, answering requests until the client closes it
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode().split("\r\n")
+                method, target, _ = request_line.split(" ", 2)
+
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, response = await self.respond(method, target, headers, body)
+                payload = json.dumps(response).encode()
+
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Request-Id: req_{uuid.uuid4().hex[:14]}\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port: int = 0, started=None) -> None:
+        server = await asyncio.start_server(
+            self.handle, "127.0.0.1", port, backlog=4096
+        )
+
+        if started is not None:
+            started(server.sockets[0].getsockname()[1])
+
+        async with server:
+            await server.serve_forever()
+
+
+def start(port: int = 0, latency: float = 0.0, **options) -> str:
+    """Serve from a background thread, returning the URL to use as stripe.api_base.
+
+    Options are passed to FakeStripe, latency may be a number of seconds or
+    a Latency.
+    """
+    ready = threading.Event()
+    address = {}
+
+    def started(bound_port):
+        address["port"] = bound_port
+        ready.set()
+
+    if not isinstance(latency, Latency):
+        latency = Latency(latency)
+
+    fake_stripe = FakeStripe(latency=latency, **options)
+    threading.Thread(
+        target=asyncio.run, args=(fake_stripe.serve(port, started),), daemon=True
+    ).start()
+    ready.wait()
+
+    return f"http://127.0.0.1:{address['port']}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Mean seconds before each response"
+    )
+    parser.add_argument(
+        "--latency-distribution", choices=Latency.DISTRIBUTIONS, default="constant"
+    )
+    parser.add_argument(
+        "--latency-spread",
+        type=float,
+        default=0.5,
+        help="The relative spread of uniform latency, or sigma for lognormal",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of requests answered with a 500"
+    )
+    parser.add_argument(
+        "--rate-limit", type=float, help="Requests a second allowed before answering 429"
+    )
+    parser.add_argument("--webhook-url", help="Where to send webhook events")
+    parser.add_argument("--webhook-secret", default="", help="Secret to sign them with")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fake_stripe = FakeStripe(
+        latency=Latency(args.latency, args.latency_distribution, args.latency_spread),
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        webhook_url=args.webhook_url,
+        webhook_secret=args.webhook_secret,
+    )
+    asyncio.run(fake_stripe.serve(args.port))
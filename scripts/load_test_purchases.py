@@ -0,0 +1,127 @@
+"""
+Load test the whole purchase flow of a running site against the fake Stripe
+server, on one machine.
+
+Each simulated buyer loads the purchase form, submits it, follows the
+redirect to the (fake) Stripe checkout and pays, after which the fake
+server sends checkout.session.completed to the site's webhook. Start the
+fake server with the site's webhook URL and secret:
+
+    python scripts/fake_stripe_server.py --latency 0.3 \\
+        --latency-distribution lognormal \\
+        --webhook-url http://127.0.0.1:8000/supper/stripe/webhook \\
+        --webhook-secret whsec_test
+
+then the site with STRIPE_API_BASE=http://127.0.0.1:12111,
+STRIPE_WEBHOOK_SECRET=whsec_test and DRILL_SUPPERS_RATE_LIMITS_ENABLED=False,
+as every buyer comes from one address (under gunicorn or uvicorn to measure
+a real deployment), and finally:
+
+    python scripts/load_test_purchases.py --buyers 500 --concurrency 50
+
+At least one drill night must be on sale.
+"""
+import argparse
+import asyncio
+import re
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+DRILL_NIGHT_OPTION = re.compile(r'<option value="(\d+)"')
+
+
+async def buy(client: httpx.AsyncClient, args, number: int, timings: list, outcomes: Counter):
+    started = time.perf_counter()
+
+    try:
+        form = await client.get(f"{args.app_url}/supper/")
+        drill_nights = DRILL_NIGHT_OPTION.findall(form.text)
+
+        if not drill_nights:
+            outcomes["no drill night on sale"] += 1
+            return
+
+        response = await client.post(
+            f"{args.app_url}/supper/",
+            data={
+                "csrfmiddlewaretoken": CSRF_INPUT.search(form.text).group(1),
+                "name": f"Load Test {number}",
+                "email": f"load-test-{number}@example.com",
+                "drill_night": drill_nights[0],
+                "quantity": 1,
+            },
+            headers={"Referer": f"{args.app_url}/supper/"},
+        )
+    except httpx.HTTPError as error:
+        outcomes[type(error).__name__] += 1
+        return
+
+    if response.status_code == 429:
+        outcomes["rate limited, start the site with DRILL_SUPPERS_RATE_LIMITS_ENABLED=False"] += 1
+        return
+
+    if response.status_code != 302:
+        outcomes[f"purchase {response.status_code}"] += 1
+        return
+
+    timings.append(time.perf_counter() - started)
+
+    # The checkout URL ends with the session ID
+    session_id = response.headers["Location"].rsplit("/", 1)[1]
+    paid = await client.post(f"{args.stripe_url}/_fake/checkout/sessions/{session_id}/pay")
+    outcomes["paid" if paid.status_code == 200 else f"payment {paid.status_code}"] += 1
+
+
+async def main(args):
+    timings: list = []
+    outcomes: Counter = Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def buyer(number):
+        async with semaphore:
+            # A client each, so every buyer has their own CSRF cookie
+            async with httpx.AsyncClient(timeout=60) as client:
+                await buy(client, args, number, timings, outcomes)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(buyer(number) for number in range(args.buyers)))
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.buyers} buyers, {args.concurrency} at a time, in {elapsed:.2f}s")
+    print(f"{len(timings) / elapsed:.1f} checkouts/s")
+
+    if timings:
+        timings.sort()
+        print(
+            "Form to checkout redirect: "
+            f"p50 {statistics.median(timings) * 1000:.0f}ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.0f}ms, "
+            f"p99 {timings[int(len(timings) * 0.99) - 1] * 1000:.0f}ms, "
+            f"max {timings[-1] * 1000:.0f}ms"
+        )
+
+    for outcome, count in outcomes.most_common():
+        print(f"  {outcome}: {count}")
+
+    async with httpx.AsyncClient() as client:
+        stats = (await client.get(f"{args.stripe_url}/_fake/stats")).json()
+
+    print("Fake Stripe:")
+    for name, count in sorted(stats.items()):
+        print(f"  {name}: {count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--app-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--stripe-url", default="http://127.0.0.1:12111")
+    parser.add_argument("--buyers", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+
+    asyncio.run(main(parser.parse_args()))